@@ -37,6 +37,7 @@ def get(landing_job_id: str):
         "id": landing_job.id,
         "status": landing_job.status.value,
         "commit_id": landing_job.landed_commit_id,
+        "phase_timings": landing_job.phase_timings or {},
     }
 
 
@@ -16,6 +16,7 @@ from landoapi.projects import (
     get_release_managers,
     get_sec_approval_project_phid,
     get_secure_project_phid,
+    prefetch_landing_project_phids,
     project_search,
 )
 from landoapi.repos import get_repos_for_env
@@ -72,13 +73,16 @@ def get(phab: PhabricatorClient, revision_id: str):
 
     nodes, edges = build_stack_graph(revision)
     try:
-        stack_data = request_extended_revision_data(phab, list(nodes))
+        stack_data, release_managers, _ = phab.run_concurrently(
+            lambda: request_extended_revision_data(phab, list(nodes)),
+            lambda: get_release_managers(phab),
+            lambda: prefetch_landing_project_phids(phab),
+        )
     except ValueError:
         return not_found_problem
 
     supported_repos = get_repos_for_env(current_app.config.get("ENVIRONMENT"))
 
-    release_managers = get_release_managers(phab)
     if not release_managers:
         raise Exception("Could not find `#release-managers` project on Phabricator.")
 
@@ -113,12 +117,17 @@ def get(phab: PhabricatorClient, revision_id: str):
 
     involved_phids = list(involved_phids)
 
-    users = user_search(phab, involved_phids)
-    projects = project_search(phab, involved_phids)
-
-    secure_project_phid = get_secure_project_phid(phab)
-
-    sec_approval_project_phid = get_sec_approval_project_phid(phab)
+    (
+        users,
+        projects,
+        secure_project_phid,
+        sec_approval_project_phid,
+    ) = phab.run_concurrently(
+        lambda: user_search(phab, involved_phids),
+        lambda: project_search(phab, involved_phids),
+        lambda: get_secure_project_phid(phab),
+        lambda: get_sec_approval_project_phid(phab),
+    )
     if not sec_approval_project_phid:
         raise Exception("Could not find `#sec-approval` project on Phabricator.")
 
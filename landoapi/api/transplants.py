@@ -2,6 +2,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import functools
 import logging
 import urllib.parse
 from datetime import datetime
@@ -27,6 +28,7 @@ from landoapi.projects import (
     get_release_managers,
     get_sec_approval_project_phid,
     get_secure_project_phid,
+    prefetch_landing_project_phids,
     project_search,
 )
 from landoapi.repos import (
@@ -46,6 +48,7 @@ from landoapi.revisions import (
     select_diff_author,
 )
 from landoapi.stacks import (
+    RevisionData,
     RevisionStack,
     build_stack_graph,
     get_diffs_for_revision,
@@ -57,6 +60,7 @@ from landoapi.transplants import (
     LandingAssessmentState,
     StackAssessment,
     build_stack_assessment_state,
+    get_raw_diff_by_id,
     run_landing_checks,
 )
 from landoapi.users import user_search
@@ -129,12 +133,28 @@ def _find_stack_from_landing_path(
     return build_stack_graph(revision)
 
 
+def _request_stack_from_landing_path(
+    phab: PhabricatorClient, landing_path: list[tuple[int, int]]
+) -> tuple[set[str], set[tuple[str, str]], RevisionData]:
+    """Return the nodes, edges and extended revision data of the landing stack."""
+    nodes, edges = _find_stack_from_landing_path(phab, landing_path)
+    return nodes, edges, request_extended_revision_data(phab, list(nodes))
+
+
 @auth.require_auth0(scopes=("lando", "profile", "email"), userinfo=True)
 @require_phabricator_api_key(optional=True)
 def dryrun(phab: PhabricatorClient, data: dict):
     landing_path = _parse_transplant_request(data)["landing_path"]
 
-    release_managers = get_release_managers(phab)
+    (
+        release_managers,
+        _,
+        (nodes, edges, stack_data),
+    ) = phab.run_concurrently(
+        lambda: get_release_managers(phab),
+        lambda: prefetch_landing_project_phids(phab),
+        lambda: _request_stack_from_landing_path(phab, landing_path),
+    )
     if not release_managers:
         raise Exception("Could not find `#release-managers` project on Phabricator.")
 
@@ -147,8 +167,6 @@ def dryrun(phab: PhabricatorClient, data: dict):
     supported_repos = get_repos_for_env(current_app.config.get("ENVIRONMENT"))
 
     relman_group_phid = phab.expect(release_managers, "phid")
-    nodes, edges = _find_stack_from_landing_path(phab, landing_path)
-    stack_data = request_extended_revision_data(phab, list(nodes))
     stack = RevisionStack(set(stack_data.revisions.keys()), edges)
     landing_assessment = LandingAssessmentState.from_landing_path(
         landing_path, stack_data, g.auth0_user
@@ -183,7 +201,15 @@ def post(phab: PhabricatorClient, data: dict):
         },
     )
 
-    release_managers = get_release_managers(phab)
+    (
+        release_managers,
+        _,
+        (nodes, edges, stack_data),
+    ) = phab.run_concurrently(
+        lambda: get_release_managers(phab),
+        lambda: prefetch_landing_project_phids(phab),
+        lambda: _request_stack_from_landing_path(phab, landing_path),
+    )
     if not release_managers:
         raise Exception("Could not find `#release-managers` project on Phabricator.")
 
@@ -197,8 +223,6 @@ def post(phab: PhabricatorClient, data: dict):
 
     supported_repos = get_repos_for_env(current_app.config.get("ENVIRONMENT"))
 
-    nodes, edges = _find_stack_from_landing_path(phab, landing_path)
-    stack_data = request_extended_revision_data(phab, list(nodes))
     stack = RevisionStack(set(stack_data.revisions.keys()), edges)
 
     landing_assessment = LandingAssessmentState.from_landing_path(
@@ -260,21 +284,33 @@ def post(phab: PhabricatorClient, data: dict):
         involved_phids.update(gather_involved_phids(revision, revision_diffs))
 
     involved_phids = list(involved_phids)
-    users = user_search(phab, involved_phids)
-    projects = project_search(phab, involved_phids)
-
-    secure_project_phid = get_secure_project_phid(phab)
+    (
+        users,
+        projects,
+        secure_project_phid,
+        checkin_phid,
+        sec_approval_project_phid,
+        *raw_diffs,
+    ) = phab.run_concurrently(
+        lambda: user_search(phab, involved_phids),
+        lambda: project_search(phab, involved_phids),
+        lambda: get_secure_project_phid(phab),
+        lambda: get_checkin_project_phid(phab),
+        lambda: get_sec_approval_project_phid(phab),
+        *(
+            functools.partial(get_raw_diff_by_id, phab, diff["id"])
+            for _revision, diff in to_land
+        ),
+    )
 
     # Take note of any revisions that the checkin project tag must be
     # removed from.
-    checkin_phid = get_checkin_project_phid(phab)
     checkin_revision_phids = [
         r["phid"]
         for r in revisions
         if checkin_phid in phab.expect(r, "attachments", "projects", "projectPHIDs")
     ]
 
-    sec_approval_project_phid = get_sec_approval_project_phid(phab)
     relman_phids = {
         member["phid"]
         for member in release_managers["attachments"]["members"]["members"]
@@ -284,7 +320,7 @@ def post(phab: PhabricatorClient, data: dict):
     revision_reviewers = {}
 
     # Build the patches to land.
-    for revision, diff in to_land:
+    for (revision, diff), raw_diff in zip(to_land, raw_diffs):
         reviewers = get_collated_reviewers(revision)
         accepted_reviewers = reviewers_for_commit_message(
             reviewers, users, projects, sec_approval_project_phid
@@ -339,7 +375,6 @@ def post(phab: PhabricatorClient, data: dict):
             "timestamp": timestamp,
         }
 
-        raw_diff = phab.call_conduit("differential.getrawdiff", diffID=diff["id"])
         lando_revision.set_patch(raw_diff, patch_data)
         db.session.commit()
         lando_revisions.append(lando_revision)
@@ -380,6 +415,7 @@ def post(phab: PhabricatorClient, data: dict):
     # Submit landing job.
     job.status = LandingJobStatus.SUBMITTED
     job.set_landed_revision_diffs()
+    job.notify_queue()
     db.session.commit()
 
     logger.info(f"New landing job {job.id} created for {landing_repo.tree} repo.")
@@ -32,6 +32,7 @@ from landoapi.repos import (
     Repo,
     get_repos_for_env,
 )
+from landoapi.storage import db
 
 logger = logging.getLogger(__name__)
 
@@ -174,6 +175,8 @@ def post_patches(data: dict):
         target_commit_hash=base_commit,
         target_commit_hash_vcs=base_commit_format,
     )
+    job.notify_queue()
+    db.session.commit()
     logger.info(
         f"Created try landing job {job.id} with {len(revisions)} "
         f"changesets against {base_commit} for {ldap_username}."
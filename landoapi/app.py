@@ -16,6 +16,7 @@ from landoapi.celery import celery_subsystem
 from landoapi.dockerflow import dockerflow
 from landoapi.hooks import initialize_hooks
 from landoapi.logging import logging_subsystem
+from landoapi.metrics import metrics
 from landoapi.phabricator import phabricator_subsystem
 from landoapi.repos import repo_clone_subsystem
 from landoapi.sentry import sentry_subsystem
@@ -82,7 +83,9 @@ def load_config() -> dict[str, Any]:
         "PHABRICATOR_ADMIN_API_KEY",
         "PHABRICATOR_UNPRIVILEGED_API_KEY",
         "PHABRICATOR_URL",
+        "REPO_BUNDLES_PATH",
         "REPO_CLONES_PATH",
+        "REPO_PREPARATION_WORKERS",
         "REPOS_TO_LAND",
         "SENTRY_DSN",
         "TREESTATUS_APP",
@@ -93,6 +96,7 @@ def load_config() -> dict[str, Any]:
         "LOG_LEVEL": "INFO",
         "MAIL_FROM": "mozphab-prod@mozilla.com",
         "REPO_CLONES_PATH": "/repos",
+        "REPO_PREPARATION_WORKERS": 4,
     }
 
     for key in config_keys:
@@ -112,6 +116,7 @@ def construct_app(config: dict[str, Any], spec: str = "swagger.yml") -> connexio
     flask_app = app.app
     flask_app.config.update(config)
     flask_app.register_blueprint(dockerflow)
+    flask_app.register_blueprint(metrics)
     initialize_hooks(flask_app)
 
     return app
@@ -5,6 +5,7 @@
 from __future__ import annotations
 
 import logging
+from typing import Any, Callable, Iterable
 
 from flask_caching import Cache
 from flask_caching.backends.rediscache import RedisCache
@@ -21,6 +22,41 @@ cache = Cache()
 cache.suppress_failure = SuppressRedisFailure
 
 
+def get_many_cached(
+    key_prefix: str,
+    ids: Iterable[str],
+    fetch: Callable[[list[str]], dict[str, Any]],
+    timeout: int = DEFAULT_CACHE_KEY_TIMEOUT_SECONDS,
+) -> dict[str, Any]:
+    """Return a dictionary mapping each of `ids` to its value, cached per id.
+
+    Cached values are read with a single `get_many`. The ids that missed are
+    passed to `fetch` in a single call, and each value it returns is cached
+    individually under `<key_prefix><id>`. Ids without a value are left out.
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return {}
+
+    values = [None] * len(ids)
+    with cache.suppress_failure():
+        values = cache.get_many(*(f"{key_prefix}{id_}" for id_ in ids))
+
+    result = {id_: value for id_, value in zip(ids, values) if value is not None}
+    missing = [id_ for id_ in ids if id_ not in result]
+    if missing:
+        fetched = fetch(missing)
+        if fetched:
+            with cache.suppress_failure():
+                cache.set_many(
+                    {f"{key_prefix}{id_}": value for id_, value in fetched.items()},
+                    timeout=timeout,
+                )
+        result.update(fetched)
+
+    return result
+
+
 class CacheSubsystem(Subsystem):
     name = "cache"
 
@@ -66,19 +66,84 @@ def worker(celery_arguments):
 
 
 @cli.command(name="landing-worker")
-def landing_worker():
-    from landoapi.app import auth0_subsystem, lando_ui_subsystem
+@click.option(
+    "--per-repo",
+    is_flag=True,
+    help="Run a separate worker process for each repository.",
+)
+@click.option(
+    "--repo-groups",
+    envvar="LANDING_WORKER_REPO_GROUPS",
+    default="",
+    help=(
+        "Run a separate worker process for each group of repositories. Groups are "
+        "separated by `;` and repositories within a group by `,`."
+    ),
+)
+@click.option(
+    "--metrics-port",
+    envvar="LANDING_WORKER_METRICS_PORT",
+    type=int,
+    default=None,
+    help=(
+        "Serve worker metrics on this port. When running a worker process per "
+        "repository group, each process uses the next port."
+    ),
+)
+def landing_worker(per_repo: bool, repo_groups: str, metrics_port: Optional[int]):
+    from landoapi.app import auth0_subsystem, lando_ui_subsystem, repo_clone_subsystem
 
     exclusions = [auth0_subsystem, lando_ui_subsystem]
     for system in get_subsystems(exclude=exclusions):
         system.ensure_ready()
 
     from landoapi.workers.landing_worker import LandingWorker
-
-    worker = LandingWorker()
+    from landoapi.workers.supervisor import WorkerSupervisor, parse_repo_groups
+
+    if per_repo or repo_groups:
+        try:
+            groups = (
+                [[name] for name in sorted(repo_clone_subsystem.repos)]
+                if per_repo
+                else parse_repo_groups(repo_groups)
+            )
+        except ValueError as exc:
+            raise click.BadParameter(str(exc), param_hint="--repo-groups")
+
+        supervisor = WorkerSupervisor(LandingWorker, groups, metrics_port=metrics_port)
+        supervisor.start()
+        return
+
+    worker = LandingWorker(metrics_port=metrics_port)
     worker.start()
 
 
+@cli.command(name="create-repo-bundles")
+@click.option(
+    "--keep",
+    type=click.IntRange(min=1),
+    default=2,
+    help="Number of snapshots to keep for each repository.",
+)
+def create_repo_bundles(keep: int):
+    """Snapshot the repository clones to REPO_BUNDLES_PATH.
+
+    New clones are seeded from the newest snapshot, so that only the changes since
+    it was created are pulled.
+
+    The clones in REPO_CLONES_PATH are only read from: they are not pulled, updated
+    or cleaned first, and draft changesets are not stripped. This makes it safe to
+    run alongside landing workers using the same clones, but the snapshots are only
+    as recent as the clones.
+    """
+    from landoapi.app import repo_clone_subsystem
+
+    if not repo_clone_subsystem.bundles_path:
+        raise click.UsageError("REPO_BUNDLES_PATH is not set.")
+
+    repo_clone_subsystem.create_bundles(keep=keep)
+
+
 @cli.command(name="run-pre-deploy-sequence")
 def run_pre_deploy_sequence():
     """Runs the sequence of commands required before a deployment."""
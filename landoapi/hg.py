@@ -3,6 +3,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import configparser
 import copy
+import hashlib
 import io
 import json
 import logging
@@ -11,8 +12,9 @@ import posixpath
 import shlex
 import shutil
 import subprocess
-import tempfile
+import sys
 import uuid
+from collections import Counter, OrderedDict
 from contextlib import contextmanager
 from pathlib import Path
 from typing import (
@@ -36,6 +38,86 @@ REJECTS_PATH = Path("/tmp/patch_rejects")
 # Name of the environment variable that will store the push user's email address.
 REQUEST_USER_ENV_VAR = "AUTOLAND_REQUEST_USER"
 
+# Status codes printed by `hg status`.
+HG_STATUS_CODES = {
+    "M": "modified",
+    "A": "added",
+    "R": "removed",
+    "!": "deleted",
+    "?": "unknown",
+    "I": "ignored",
+}
+
+# Commands that modify neither the working directory nor the draft changesets.
+READ_ONLY_HG_COMMANDS = {
+    "bookmarks",
+    "files",
+    "id",
+    "identify",
+    "log",
+    "outgoing",
+    "paths",
+    "root",
+    "status",
+}
+
+# Global options that take a value, see `hg_command_name`.
+HG_OPTIONS_WITH_VALUE = {"--config", "--cwd", "--encoding", "-R", "--repository"}
+
+# Formatters run by `HgRepo.run_code_formatters`.
+SUPPORTED_FORMATTERS = (
+    "black",
+    "clang-format",
+    "rustfmt",
+)
+
+# Files whose contents change how the formatters format code.
+FORMATTER_CONFIG_PATHS = (
+    ".lando.ini",
+    ".clang-format",
+    "pyproject.toml",
+    "rustfmt.toml",
+    ".rustfmt.toml",
+    "tools/lint/black.yml",
+    "tools/lint/clang-format.yml",
+    "tools/lint/rustfmt.yml",
+)
+
+# Files which configure the formatters for the directory containing them and its
+# subdirectories.
+FORMATTER_DIRECTORY_CONFIG_FILES = (
+    ".clang-format",
+    "pyproject.toml",
+    "rustfmt.toml",
+    ".rustfmt.toml",
+)
+
+# Paths in the checkout that determine what `mach bootstrap` installs.
+MACH_BOOTSTRAP_PATHS = (
+    "python/mach",
+    "python/mozboot",
+    "python/sites",
+    "tools/lint",
+)
+
+# Number of formatter results remembered by each repo, see `HgRepo.format_files`.
+FORMATTER_CACHE_SIZE = int(os.environ.get("FORMATTER_CACHE_SIZE", 1000))
+
+# Maximum number of git to hg SHA conversions kept in the on-disk mapping cache.
+GIT_HG_MAP_SIZE = int(os.environ.get("GIT_HG_MAP_SIZE", 10000))
+
+# Output of `git cinnabar git2hg` for a Git SHA that has no Mercurial equivalent.
+NULL_HG_SHA = "0" * 40
+
+# Bundle type of the snapshots created by `HgRepo.create_bundle`. Stream bundles
+# contain the repository store as is, which is much faster to apply than changegroups.
+STREAM_BUNDLE_SPEC = "none-v2;stream=v2"
+
+# Number of commands a persistent command server runs before it is restarted.
+HG_COMMAND_SERVER_MAX_COMMANDS = int(
+    os.environ.get("HG_COMMAND_SERVER_MAX_COMMANDS", 1000)
+)
+
 
 class HgException(Exception):
     @staticmethod
@@ -165,6 +247,23 @@ AUTOFORMAT_COMMIT_MESSAGE = """
 """.strip()
 
 
+def hg_command_name(args: list[str]) -> Optional[str]:
+    """Return the name of the command run by the hg arguments `args`."""
+    args = iter(args)
+    for arg in args:
+        if arg in HG_OPTIONS_WITH_VALUE:
+            next(args, None)
+        elif not arg.startswith("-"):
+            return arg
+    return None
+
+
+def revset_string(value: str) -> str:
+    """Return `value` as a quoted string for use in a revset."""
+    escaped = value.replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{escaped}'"
+
+
 class HgRepo:
     ENCODING = "utf-8"
     DEFAULT_CONFIGS = {
@@ -185,10 +284,36 @@ class HgRepo:
         "extensions.set_landing_system": "/app/hgext/set_landing_system.py",
     }
 
-    def __init__(self, path, config=None, native_git_source: Optional[str] = None):
+    def __init__(
+        self,
+        path,
+        config=None,
+        native_git_source: Optional[str] = None,
+        persistent: bool = False,
+    ):
         self.path = path
         self.config = copy.copy(self.DEFAULT_CONFIGS)
 
+        # A persistent repo keeps its command server running between contexts
+        # (e.g. `for_push`) so that it can be reused across landing jobs.
+        self.persistent = persistent
+        self.hg_repo = None
+        self.commands_run = 0
+
+        # The remote head last pulled from each source.
+        self.last_pulled_heads = {}
+
+        # Whether the working directory is known to be clean with no draft
+        # changesets, in which case `clean_repo` has nothing to do.
+        self.known_clean = False
+
+        # How many updates pulled from upstream, and how many skipped the pull.
+        self.pulls = Counter()
+
+        # Formatter results keyed by formatter config hashes, path and content hash.
+        # The value is the formatted content, or `None` if the file was unchanged.
+        self.formatter_cache = OrderedDict()
+
         # Somewhere to store patch headers for testing.
         self.patch_header = None
 
@@ -203,6 +328,9 @@ class HgRepo:
             cinnabar_path_name = f"{path.name}-git"
             self.cinnabar_path = path.with_name(cinnabar_path_name)
 
+        # Known git to hg SHA conversions, loaded from `git_hg_map_path` on first use.
+        self._git_hg_map = None
+
     @property
     def mach_path(self) -> Optional[Path]:
         """Return the `Path` to `mach`, if it exists."""
@@ -215,23 +343,69 @@ class HgRepo:
 
     def _clean_and_close(self):
         """Perform closing activities when exiting any context managers."""
-        try:
-            self.clean_repo()
-        except Exception as e:
-            logger.exception(e)
-        self.hg_repo.close()
+        if self.hg_repo is not None:
+            try:
+                self.clean_repo()
+            except Exception as e:
+                logger.exception(e)
+        self._release()
 
     def _open(self):
+        if self.persistent and self._server_is_healthy():
+            return
+
+        self.close()
         self.hg_repo = hglib.open(
             self.path, encoding=self.ENCODING, configs=self._config_to_list()
         )
+        self.commands_run = 0
+
+    def _release(self):
+        """Close the command server, unless it is persistent."""
+        if not self.persistent:
+            self.close()
+
+    def _server_is_healthy(self) -> bool:
+        """Return `True` if the running command server can be reused."""
+        if self.hg_repo is None or self.hg_repo.server is None:
+            return False
+
+        if self.commands_run >= HG_COMMAND_SERVER_MAX_COMMANDS:
+            logger.info(
+                "Recycling hg command server.",
+                extra={"path": self.path, "commands_run": self.commands_run},
+            )
+            return False
+
+        try:
+            self.hg_repo.root()
+        except Exception as e:
+            logger.warning(
+                "hg command server is unresponsive, restarting.",
+                extra={"path": self.path},
+                exc_info=e,
+            )
+            return False
+
+        return True
+
+    def close(self):
+        """Stop the command server, if it is running."""
+        if self.hg_repo is None:
+            return
+
+        try:
+            self.hg_repo.close()
+        except Exception as e:
+            logger.warning(f"Could not close hg command server: {e}")
+        self.hg_repo = None
 
     @contextmanager
     def for_push(self, request_user_email):
         """Prepare the repo with the correct environment variables set for pushing.
 
-        The request user's email address needs to be present before initializing a repo
-        if the repo is to be used for pushing remotely.
+        The request user's email address is passed to the remote when pushing, see
+        `push`.
         """
         os.environ[REQUEST_USER_ENV_VAR] = request_user_email
         logger.debug(f"{REQUEST_USER_ENV_VAR} set to {request_user_email}")
@@ -255,7 +429,43 @@ class HgRepo:
         finally:
             self._clean_and_close()
 
-    def clone(self, source):
+    @contextmanager
+    def for_preparation(self):
+        """Prepare the repo for applying patches ahead of time.
+
+        Unlike `for_pull`, the repo is not cleaned when exiting the context manager so
+        that the changesets created can be pushed later using `for_push`.
+        """
+        self._open()
+        try:
+            yield self
+        finally:
+            self._release()
+
+    @contextmanager
+    def for_reading(self):
+        """Open the repo for read only commands, e.g. to create a bundle of it.
+
+        Unlike `for_pull`, the repo is not cleaned when exiting the context manager,
+        so the working directory and draft changesets of a worker using the same
+        clone are left alone, as with `for_preparation`.
+        """
+        with self.for_preparation():
+            yield self
+
+    def clone(self, source, bundle: Optional[Path] = None):
+        """Clone `source`, seeding the clone from a local `bundle` if given."""
+        if bundle is not None:
+            try:
+                self.clone_from_bundle(source, bundle)
+                return
+            except Exception as e:
+                logger.warning(
+                    f"Could not clone from bundle {bundle}, cloning {source}: {e}"
+                )
+                self.close()
+                shutil.rmtree(self.path, ignore_errors=True)
+
         # Use of robustcheckout here would work, but is probably not worth
         # the hassle as most of the benefits come from repeated working
         # directory creation. Since this is a one-time clone and is unlikely
@@ -267,21 +477,57 @@ class HgRepo:
             configs=self._config_to_list(),
         )
 
-    def clone_cinnabar(self, source):
+    def clone_from_bundle(self, source, bundle: Path):
+        """Create the repo from a stream `bundle` and pull the rest from `source`."""
+        hglib.init(self.path, encoding=self.ENCODING, configs=self._config_to_list())
+        (Path(self.path) / ".hg" / "hgrc").write_text(f"[paths]\ndefault = {source}\n")
+
+        with self.for_pull():
+            self.run_hg(["unbundle", str(bundle)])
+            self.run_hg(["pull", source])
+            self.run_hg(["update"])
+
+    def create_bundle(self, dest: Path):
+        """Write a stream bundle of the repo to `dest`, see `clone`."""
+        self.run_hg(["bundle", "--all", "--type", STREAM_BUNDLE_SPEC, str(dest)])
+
+    def clone_cinnabar(self, source, bundle: Optional[Path] = None):
+        """Clone the native Git source, seeding it from a local `bundle` if given.
+
+        The bundle is created by `create_cinnabar_bundle` and includes the cinnabar
+        metadata, so that only changes since the bundle was created are fetched.
+        """
         if not self.cinnabar_path or not self.native_git_source:
             raise Exception("No cinnabar path set, can't create cinnabar clone.")
 
-        # Clone the native Git source repo.
-        self.run_git(
-            ["clone", self.native_git_source, self.cinnabar_path.name],
-            # Run the command from the parent directory.
-            cwd=self.cinnabar_path.parent,
-        )
+        if bundle is not None:
+            self.run_git(
+                ["clone", str(bundle), self.cinnabar_path.name],
+                cwd=self.cinnabar_path.parent,
+            )
+            self.run_git(["fetch", str(bundle), "refs/cinnabar/*:refs/cinnabar/*"])
+            self.run_git(["remote", "set-url", "origin", self.native_git_source])
+            self.run_git(["fetch", "origin"])
+        else:
+            # Clone the native Git source repo.
+            self.run_git(
+                ["clone", self.native_git_source, self.cinnabar_path.name],
+                # Run the command from the parent directory.
+                cwd=self.cinnabar_path.parent,
+            )
 
         # Update the repo and get cinnabar metadata.
         self.update_cinnabar_repo(source)
 
-    def run_hg(self, args: list[str]) -> bytes:
+    def create_cinnabar_bundle(self, dest: Path):
+        """Write a bundle of the cinnabar clone, including its metadata, to `dest`."""
+        self.run_git(["bundle", "create", str(dest), "--all"])
+
+    def run_hg(self, args: list[str], stdin: Optional[bytes] = None) -> bytes:
+        """Run an hg command on the command server and return its output.
+
+        `stdin` is served to the command as its standard input, e.g. for `import -`.
+        """
         correlation_id = str(uuid.uuid4())
         logger.info(
             "running hg command",
@@ -296,14 +542,26 @@ class HgRepo:
         out = hglib.util.BytesIO()
         err = hglib.util.BytesIO()
         out_channels = {b"o": out.write, b"e": err.write}
-        ret = self.hg_repo.runcommand(
-            [
-                arg.encode(self.ENCODING) if isinstance(arg, str) else arg
-                for arg in args
-            ],
-            {},
-            out_channels,
-        )
+        in_channels = {}
+        if stdin is not None:
+            stdin_buf = io.BytesIO(stdin)
+            in_channels = {b"I": stdin_buf.read, b"L": stdin_buf.readline}
+        self.commands_run += 1
+        if hg_command_name(args) not in READ_ONLY_HG_COMMANDS:
+            self.known_clean = False
+        try:
+            ret = self.hg_repo.runcommand(
+                [
+                    arg.encode(self.ENCODING) if isinstance(arg, str) else arg
+                    for arg in args
+                ],
+                in_channels,
+                out_channels,
+            )
+        except (hglib.error.ServerError, hglib.error.ResponseError):
+            # The command server died, start a new one next time.
+            self.close()
+            raise
 
         out = out.getvalue()
         err = err.getvalue()
@@ -333,35 +591,121 @@ class HgRepo:
         return last_result
 
     def clean_repo(self, *, strip_non_public_commits=True):
-        # Reset rejects directory
-        if REJECTS_PATH.is_dir():
-            shutil.rmtree(REJECTS_PATH)
-        REJECTS_PATH.mkdir()
-
-        # Copy .rej files to a temporary folder.
-        rejects = Path(f"{self.path}/").rglob("*.rej")
-        for reject in rejects:
-            os.makedirs(
-                REJECTS_PATH.joinpath(reject.parents[0].as_posix()[1:]), exist_ok=True
-            )
-            shutil.copy(reject, REJECTS_PATH.joinpath(reject.as_posix()[1:]))
+        """Discard working directory changes and, optionally, draft changesets.
+
+        Rejects left by failed patches are copied to `REJECTS_PATH` first. Only the
+        paths reported by `hg status` are reverted, and nothing is done if the repo
+        is known to be clean already. The repo is only marked as known to be clean
+        once every step succeeded.
+        """
+        if self.known_clean:
+            return
+
+        status = self.working_copy_status()
+        rejects = self.save_rejects(status)
+
+        clean = True
 
         # Clean working directory.
-        try:
-            self.run_hg(["--quiet", "revert", "--no-backup", "--all"])
-        except hglib.error.CommandError:
-            pass
-        try:
-            self.run_hg(["purge"])
-        except hglib.error.CommandError:
-            pass
+        changed = (
+            status["modified"] + status["added"] + status["removed"] + status["deleted"]
+        )
+        if changed:
+            try:
+                self.run_hg(
+                    ["--quiet", "revert", "--no-backup"]
+                    + [f"path:{path}" for path in changed]
+                )
+            except hglib.error.CommandError:
+                clean = False
+
+        # Rejects may be ignored files, which a plain purge keeps.
+        ignored_rejects = [path for path in rejects if path in status["ignored"]]
+        if ignored_rejects:
+            try:
+                self.run_hg(
+                    ["purge", "--all"] + [f"path:{path}" for path in ignored_rejects]
+                )
+            except hglib.error.CommandError:
+                clean = False
+
+        # Reverting added files leaves them behind as unknown files. Purge the whole
+        # working directory so directories emptied by it are removed as well.
+        if status["unknown"] + status["added"] + rejects:
+            try:
+                self.run_hg(["purge"])
+            except hglib.error.CommandError:
+                clean = False
 
         # Strip any lingering draft changesets.
         if strip_non_public_commits:
             try:
-                self.run_hg(["strip", "--no-backup", "-r", "not public()"])
+                if self.run_hg(["log", "-r", "not public()", "-T", "{node}\n"]):
+                    self.run_hg(["strip", "--no-backup", "-r", "not public()"])
             except hglib.error.CommandError:
-                pass
+                clean = False
+            self.known_clean = clean
+
+    def save_rejects(self, status: Optional[dict[str, list[str]]] = None) -> list[str]:
+        """Replace the rejects of the repo in `REJECTS_PATH` with its `.rej` files.
+
+        Only the repo's own directory within `REJECTS_PATH` is cleared, as other
+        worker processes store the rejects of their repos there too. Returns the
+        paths of the rejects, relative to the repo root.
+        """
+        if status is None:
+            status = self.working_copy_status()
+
+        repo_rejects_path = REJECTS_PATH / self.path[1:]
+        if repo_rejects_path.is_dir():
+            shutil.rmtree(repo_rejects_path, ignore_errors=True)
+        repo_rejects_path.mkdir(parents=True, exist_ok=True)
+        rejects = [
+            path
+            for path in status["unknown"] + status["ignored"]
+            if path.endswith(".rej")
+        ]
+        for path in rejects:
+            reject = Path(self.path) / path
+            destination = REJECTS_PATH / reject.as_posix()[1:]
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(reject, destination)
+
+        return rejects
+
+    def working_copy_status(self) -> dict[str, list[str]]:
+        """Return the paths in the working directory by status, from `hg status`."""
+        output = self.run_hg(
+            [
+                "status",
+                "--modified",
+                "--added",
+                "--removed",
+                "--deleted",
+                "--unknown",
+                "--ignored",
+                "--print0",
+            ]
+        ).decode(self.ENCODING)
+
+        status = {code: [] for code in HG_STATUS_CODES.values()}
+        for entry in output.split("\0"):
+            if entry:
+                status[HG_STATUS_CODES[entry[0]]].append(entry[2:])
+        return status
+
+    def strip_descendants(self, node: str):
+        """Discard working directory changes and changesets descending from `node`.
+
+        The working directory is updated to `node`.
+        """
+        self.clean_repo(strip_non_public_commits=False)
+        try:
+            self.run_hg(["strip", "--no-backup", "-r", f"descendants({node}) - {node}"])
+        except hglib.error.CommandError:
+            # There were no changesets to strip.
+            pass
+        self.run_hg(["update", "--clean", "-r", node])
 
     def apply_patch(self, patch_io_buf: io.StringIO):
         patch_helper = HgPatchHelper(patch_io_buf)
@@ -370,89 +714,107 @@ class HgRepo:
 
         self.patch_header = patch_helper.get_header
 
-        # Import the diff to apply the changes then commit separately to
-        # ensure correct parsing of the commit message.
-        f_msg = tempfile.NamedTemporaryFile(encoding="utf-8", mode="w+")
-        f_diff = tempfile.NamedTemporaryFile(encoding="utf-8", mode="w+")
-        with f_msg, f_diff:
-            patch_helper.write_commit_description(f_msg)
-            f_msg.flush()
-            patch_helper.write_diff(f_diff)
-            f_diff.flush()
-
-            similarity_args = ["-s", "95"]
-
-            # TODO: Using `hg import` here is less than ideal because
-            # it does not use a 3-way merge. It would be better
-            # to use `hg import --exact` then `hg rebase`, however we
-            # aren't guaranteed to have the patche's parent changeset
-            # in the local repo.
-            # Also, Apply the patch, with file rename detection (similarity).
-            # Using 95 as the similarity to match automv's default.
-            import_cmd = ["import", "--no-commit"] + similarity_args
+        # Commit using the extracted date, user, and commit desc.
+        date = patch_helper.get_header("Date")
+        user = patch_helper.get_header("User")
 
-            try:
-                if patch_helper.get_header("Fail HG Import") == b"FAIL":
-                    # For testing, force a PatchConflict exception if this header is
-                    # defined.
-                    raise hglib.error.CommandError(
-                        (),
-                        1,
-                        b"",
-                        b"forced fail: hunk FAILED -- saving rejects to file",
-                    )
-                self.run_hg(import_cmd + [f_diff.name])
-            except hglib.error.CommandError as exc:
-                if isinstance(HgException.from_hglib_error(exc), PatchConflict):
-                    # Try again using 'patch' instead of hg's internal patch utility.
-                    # But first reset to a clean working directory as hg's attempt
-                    # might have partially applied the patch.
-                    logger.info("import failed, retrying with 'patch'", exc_info=exc)
-                    import_cmd += ["--config", "ui.patch=patch"]
-                    self.clean_repo(strip_non_public_commits=False)
-
-                    self._prevent_hg_modifications(f_diff.name)
-
-                    try:
-                        # When using an external patch util mercurial won't
-                        # automatically handle add/remove/renames.
-                        self.run_hg(import_cmd + [f_diff.name])
-                        self.run_hg(["addremove"] + similarity_args)
-                    except hglib.error.CommandError:
-                        # Use the original exception from import with the built-in
-                        # patcher since both attempts failed.
-                        raise HgException.from_hglib_error(exc) from exc
-
-            # Commit using the extracted date, user, and commit desc.
-            # --landing_system is provided by the set_landing_system hgext.
-            date = patch_helper.get_header("Date")
-            user = patch_helper.get_header("User")
-
-            if not user:
-                raise ValueError("Missing `User` header!")
-
-            if not date:
-                raise ValueError("Missing `Date` header!")
+        if not user:
+            raise ValueError("Missing `User` header!")
 
-            self.run_hg(
-                ["commit"]
-                + ["--date", date]
-                + ["--user", user]
-                + ["--landing_system", "lando"]
-                + ["--logfile", f_msg.name]
-            )
+        if not date:
+            raise ValueError("Missing `Date` header!")
+
+        commit_desc, diff = patch_helper.get_commit_description_and_diff()
 
-    def _prevent_hg_modifications(self, diff_name: str) -> None:
-        """Inspect the patch data and raise an exception if any file is in .hg."""
-        with open(diff_name) as f:
-            diff = f.read()
+        # The last line of a diff is only parsed if it is terminated.
+        if not diff.endswith("\n"):
+            diff += "\n"
+        diffs = rs_parsepatch.get_counts(diff)
+        self._prevent_hg_modifications(diffs)
 
-        parsed_diff = rs_parsepatch.get_diffs(diff)
-        filenames = [posixpath.normpath(d["filename"]) for d in parsed_diff]
+        # The diff and commit description are passed to hg on stdin, without
+        # writing them to disk.
+        diff = diff.encode(self.ENCODING)
+
+        similarity_args = ["-s", "95"]
+
+        # TODO: Using `hg import` here is less than ideal because
+        # it does not use a 3-way merge. It would be better
+        # to use `hg import --exact` then `hg rebase`, however we
+        # aren't guaranteed to have the patche's parent changeset
+        # in the local repo.
+        # Also, Apply the patch, with file rename detection (similarity).
+        # Using 95 as the similarity to match automv's default.
+        import_cmd = ["import", "--no-commit"] + similarity_args
+
+        try:
+            if patch_helper.get_header("Fail HG Import") == b"FAIL":
+                # For testing, force a PatchConflict exception if this header is
+                # defined.
+                raise hglib.error.CommandError(
+                    (),
+                    1,
+                    b"",
+                    b"forced fail: hunk FAILED -- saving rejects to file",
+                )
+            self.run_hg(import_cmd + ["-"], stdin=diff)
+        except hglib.error.CommandError as exc:
+            if isinstance(HgException.from_hglib_error(exc), PatchConflict):
+                if not self._external_patch_may_apply(diffs):
+                    # `patch` would fail in the same way, don't retry. The rejects
+                    # are otherwise saved when cleaning the repo before the retry.
+                    self.save_rejects()
+                    raise HgException.from_hglib_error(exc) from exc
+
+                # Try again using 'patch' instead of hg's internal patch utility.
+                # But first reset to a clean working directory as hg's attempt
+                # might have partially applied the patch.
+                logger.info("import failed, retrying with 'patch'", exc_info=exc)
+                import_cmd += ["--config", "ui.patch=patch"]
+                self.clean_repo(strip_non_public_commits=False)
+
+                try:
+                    # When using an external patch util mercurial won't
+                    # automatically handle add/remove/renames.
+                    self.run_hg(import_cmd + ["-"], stdin=diff)
+                    self.run_hg(["addremove"] + similarity_args)
+                except hglib.error.CommandError:
+                    # Use the original exception from import with the built-in
+                    # patcher since both attempts failed.
+                    raise HgException.from_hglib_error(exc) from exc
+
+        # Import the diff to apply the changes then commit separately to
+        # ensure correct parsing of the commit message.
+        # --landing_system is provided by the set_landing_system hgext.
+        self.run_hg(
+            ["commit"]
+            + ["--date", date]
+            + ["--user", user]
+            + ["--landing_system", "lando"]
+            + ["--logfile", "-"],
+            stdin=commit_desc.encode(self.ENCODING),
+        )
+
+    @staticmethod
+    def _prevent_hg_modifications(diffs: list[dict]) -> None:
+        """Inspect the parsed diff and raise an exception if any file is in .hg."""
+        filenames = [posixpath.normpath(d["filename"]) for d in diffs]
 
         if any(f == ".hg" or f.startswith(".hg/") for f in filenames):
             raise ValueError("Patch modifies forbidden path.")
 
+    @staticmethod
+    def _external_patch_may_apply(diffs: list[dict]) -> bool:
+        """Return `True` if retrying a failed import with `patch` may succeed.
+
+        `patch` can't apply binary diffs, and can't improve on hg for diffs that
+        only rename, copy or change the mode of files. Patches with any text
+        changes are still retried, even if they also contain binary diffs.
+        """
+        return any(
+            not d["binary"] and (d["added_lines"] or d["deleted_lines"]) for d in diffs
+        )
+
     def read_lando_config(self) -> Optional[configparser.ConfigParser]:
         """Attempt to read the `.lando.ini` file."""
         try:
@@ -467,24 +829,131 @@ class HgRepo:
 
         return parser
 
-    def run_code_formatters(self) -> str:
+    def run_code_formatters(self, paths: Optional[list[str]] = None) -> str:
         """Run automated code formatters, returning the output of the process.
 
+        Only `paths` are formatted if given, otherwise the outgoing changesets are.
         Changes made by code formatters are applied to the working directory and
         are not committed into version control.
         """
-        supported_formatters = [
-            "black",
-            "clang-format",
-            "rustfmt",
-        ]
-
-        linter_args = [f"--linter={formatter}" for formatter in supported_formatters]
+        linter_args = [f"--linter={formatter}" for formatter in SUPPORTED_FORMATTERS]
+        target_args = ["--outgoing"] if paths is None else ["--", *paths]
 
         return self.run_mach_command(
-            ["lint", *linter_args, "--fix", "--outgoing", "--verbose"]
+            ["lint", *linter_args, "--fix", "--verbose", *target_args]
         )
 
+    def stack_files(self, stack_size: int) -> list[str]:
+        """Return the files added or modified by the top `stack_size` changesets."""
+        output = self.run_hg(
+            [
+                "status",
+                "--modified",
+                "--added",
+                "--no-status",
+                "--print0",
+                "--rev",
+                f".~{stack_size}",
+                "--rev",
+                ".",
+            ]
+        ).decode(self.ENCODING)
+        return [path for path in output.split("\0") if path]
+
+    def formatter_config_hash(self) -> str:
+        """Return a hash of the formatters and their configuration in the checkout.
+
+        The installed formatter versions are covered by the `mach bootstrap`
+        fingerprint, as the formatters are installed by it.
+        """
+        digest = hashlib.sha256(",".join(SUPPORTED_FORMATTERS).encode("utf-8"))
+        digest.update(self.mach_bootstrap_fingerprint().encode("utf-8"))
+        for config_path in FORMATTER_CONFIG_PATHS:
+            path = Path(self.path) / config_path
+            if path.is_file():
+                digest.update(config_path.encode("utf-8"))
+                digest.update(hashlib.sha256(path.read_bytes()).digest())
+        return digest.hexdigest()
+
+    def directory_formatter_config_hash(self, directory: str) -> str:
+        """Return a hash of the formatter configuration applying to `directory`.
+
+        This covers the `FORMATTER_DIRECTORY_CONFIG_FILES` in `directory` and its
+        ancestors, below the root of the checkout.
+        """
+        digest = hashlib.sha256()
+        while directory:
+            for name in FORMATTER_DIRECTORY_CONFIG_FILES:
+                config_path = posixpath.join(directory, name)
+                path = Path(self.path) / config_path
+                if path.is_file():
+                    digest.update(config_path.encode("utf-8"))
+                    digest.update(hashlib.sha256(path.read_bytes()).digest())
+            directory = posixpath.dirname(directory)
+        return digest.hexdigest()
+
+    def format_files(self, paths: list[str]) -> Optional[str]:
+        """Format `paths` in the working directory, reusing earlier results.
+
+        Files with contents that were formatted before at the same path and under
+        the same formatter configuration (e.g. when a job is retried) are not
+        formatted again, their cached result is written instead. The path is part
+        of the cache key since it selects the formatter, along with the
+        configuration of the formatters in its directory and the ones above it.
+        Return the formatters' output, or `None` if they did not need to run.
+        """
+        config_hash = self.formatter_config_hash()
+        directory_hashes = {}
+
+        def cache_key(path: str, content: bytes) -> tuple[str, str, str, str]:
+            directory = posixpath.dirname(path)
+            if directory not in directory_hashes:
+                directory_hashes[directory] = self.directory_formatter_config_hash(
+                    directory
+                )
+            return (
+                config_hash,
+                directory_hashes[directory],
+                path,
+                hashlib.sha256(content).hexdigest(),
+            )
+
+        pending = {}
+        for path in paths:
+            file_path = Path(self.path) / path
+            if not file_path.is_file() or file_path.is_symlink():
+                continue
+
+            key = cache_key(path, file_path.read_bytes())
+            if key not in self.formatter_cache:
+                pending[path] = key
+                continue
+
+            self.formatter_cache.move_to_end(key)
+            formatted = self.formatter_cache[key]
+            if formatted is not None:
+                self.known_clean = False
+                file_path.write_bytes(formatted)
+
+        if not pending:
+            logger.info("Files are already formatted.", extra={"paths": paths})
+            return None
+
+        output = self.run_code_formatters(list(pending))
+
+        for path, key in pending.items():
+            content = (Path(self.path) / path).read_bytes()
+            formatted_key = cache_key(path, content)
+            self.formatter_cache[key] = None if formatted_key == key else content
+
+            # The formatted contents are known to need no further formatting.
+            self.formatter_cache[formatted_key] = None
+
+        while len(self.formatter_cache) > FORMATTER_CACHE_SIZE:
+            self.formatter_cache.popitem(last=False)
+
+        return output
+
     def run_mach_bootstrap(self) -> str:
         """Run `mach bootstrap` to configure the system for code formatting."""
         return self.run_mach_command(
@@ -496,6 +965,62 @@ class HgRepo:
             ]
         )
 
+    @staticmethod
+    def mach_state_path() -> Path:
+        """Return the directory where `mach bootstrap` installs its state."""
+        return Path(
+            os.environ.get("MOZBUILD_STATE_PATH", Path.home() / ".mozbuild")
+        ).expanduser()
+
+    def mach_bootstrap_fingerprint(self) -> str:
+        """Return a fingerprint of everything that `mach bootstrap` depends on.
+
+        This is the last changeset to touch `MACH_BOOTSTRAP_PATHS` in the checkout,
+        along with the Python version running the worker.
+        """
+        # Walk back from the checkout and stop at the first match, rather than
+        # scanning the whole changelog with `file()`.
+        node = self.run_hg(
+            [
+                "log",
+                "-l",
+                "1",
+                "-r",
+                "reverse(::.)",
+                "-T",
+                "{node}",
+                "--",
+                *(f"path:{path}" for path in MACH_BOOTSTRAP_PATHS),
+            ]
+        )
+
+        digest = hashlib.sha256(node)
+        digest.update(sys.version.encode("utf-8"))
+        return digest.hexdigest()
+
+    def ensure_mach_bootstrap(self, stamp_path: Path) -> bool:
+        """Run `mach bootstrap` unless it already ran with the same fingerprint.
+
+        The fingerprint of the last successful bootstrap is recorded in
+        `stamp_path`. Return `True` if bootstrap was run.
+        """
+        fingerprint = self.mach_bootstrap_fingerprint()
+        try:
+            stamp = json.loads(stamp_path.read_text())
+        except (OSError, ValueError):
+            stamp = {}
+
+        if stamp.get("fingerprint") == fingerprint and self.mach_state_path().is_dir():
+            logger.info(
+                "Skipping mach bootstrap, nothing changed since the last one.",
+                extra={"path": self.path, "fingerprint": fingerprint},
+            )
+            return False
+
+        self.run_mach_bootstrap()
+        stamp_path.write_text(json.dumps({"fingerprint": fingerprint}))
+        return True
+
     def run_mach_command(self, args: list[str]) -> str:
         """Run a command using the local `mach`, raising if it is missing."""
         if not self.mach_path:
@@ -504,6 +1029,9 @@ class HgRepo:
         # Convert to `str` here so we can log the mach path.
         command_args = [str(self.mach_path)] + args
 
+        # `mach` may modify the working directory outside of hg.
+        self.known_clean = False
+
         try:
             logger.info("running mach command", extra={"command": command_args})
 
@@ -603,7 +1131,7 @@ class HgRepo:
             return None
 
         try:
-            self.run_code_formatters()
+            self.format_files(self.stack_files(stack_size))
         except subprocess.CalledProcessError as exc:
             logger.warning("Failed to run automated code formatters.")
             logger.exception(exc)
@@ -630,8 +1158,9 @@ class HgRepo:
                 details=exc.stdout,
             )
 
-    def push(self, target, bookmark=None, force_push: bool = False):
-        if not os.getenv(REQUEST_USER_ENV_VAR):
+    def push(self, target, bookmark=None, force_push: bool = False, rev: str = "tip"):
+        request_user_email = os.getenv(REQUEST_USER_ENV_VAR)
+        if not request_user_email:
             raise ValueError(f"{REQUEST_USER_ENV_VAR} not set while attempting to push")
 
         # For testing, force a LostPushRace exception if this header is
@@ -647,13 +1176,22 @@ class HgRepo:
         if force_push:
             extra_args.append("-f")
 
+        # The command server may have been started for an earlier job, so its
+        # environment can't be relied on to pass the request user to ssh.
+        if self.config.get("ui.ssh"):
+            ssh = (
+                f"env {REQUEST_USER_ENV_VAR}={shlex.quote(request_user_email)} "
+                f"{self.config['ui.ssh']}"
+            )
+            extra_args += ["--config", f"ui.ssh={ssh}"]
+
         try:
             if bookmark is None:
-                self.run_hg(["push", "-r", "tip", target] + extra_args)
+                self.run_hg(["push", "-r", rev, target] + extra_args)
             else:
                 self.run_hg_cmds(
                     [
-                        ["bookmark", bookmark],
+                        ["bookmark", "-r", rev, bookmark],
                         ["push", "-B", bookmark, target] + extra_args,
                     ]
                 )
@@ -673,9 +1211,7 @@ class HgRepo:
         # When we have a cinnabar clone and the target changeset is a `git` SHA,
         # use the cinnabar clone to convert it to the hg SHA.
         if self.cinnabar_path and target_cset_vcs == "git":
-            logger.info(f"Converting git cset {target_cset} to hg")
-            self.update_cinnabar_repo(source)
-            target_cset = self.git_to_hg(target_cset)
+            target_cset = self.convert_git_cset(source, target_cset)
 
         # Strip any lingering changes.
         self.clean_repo()
@@ -685,17 +1221,88 @@ class HgRepo:
 
         return target_cset
 
+    def convert_git_cset(self, source: str, git_sha: str) -> str:
+        """Convert `git_sha` to hg, updating the cinnabar repo only if needed.
+
+        The cinnabar repo is only updated from `source` when `git_sha` is not
+        already known to it.
+        """
+        logger.info(f"Converting git cset {git_sha} to hg")
+        hg_sha = self.git_to_hg_many([git_sha]).get(git_sha)
+        if hg_sha:
+            return hg_sha
+
+        self.update_cinnabar_repo(source)
+        return self.git_to_hg(git_sha)
+
     def git_to_hg(self, git_sha: str) -> str:
         """Convert a `git_sha` to a Mercurial SHA."""
-        hg_sha = self.run_git(["cinnabar", "git2hg", git_sha])
+        hg_sha = self.git_to_hg_many([git_sha]).get(git_sha)
 
-        if hg_sha == "0" * 40:
+        if not hg_sha:
             raise CinnabarConversionError(
                 f"Could not convert Git SHA {git_sha} to a Mercurial SHA."
             )
 
         return hg_sha
 
+    @property
+    def git_hg_map_path(self) -> Optional[Path]:
+        """Return the `Path` of the on-disk git to hg SHA mapping cache."""
+        if self.cinnabar_path:
+            return self.cinnabar_path.with_name(
+                f"{self.cinnabar_path.name}.git2hg.json"
+            )
+
+    @property
+    def git_hg_map(self) -> OrderedDict:
+        """Return the cached git to hg SHA conversions, oldest first."""
+        if self._git_hg_map is None:
+            try:
+                entries = json.loads(self.git_hg_map_path.read_text())
+            except (OSError, ValueError):
+                entries = {}
+            self._git_hg_map = OrderedDict(entries)
+
+        return self._git_hg_map
+
+    def save_git_hg_map(self):
+        """Write the git to hg SHA mapping cache to disk."""
+        while len(self.git_hg_map) > GIT_HG_MAP_SIZE:
+            self.git_hg_map.popitem(last=False)
+
+        partial_path = self.git_hg_map_path.with_name(
+            f".{self.git_hg_map_path.name}.{os.getpid()}"
+        )
+        partial_path.write_text(json.dumps(self.git_hg_map))
+        os.replace(partial_path, self.git_hg_map_path)
+
+    def git_to_hg_many(self, git_shas: list[str]) -> dict[str, str]:
+        """Convert `git_shas` to Mercurial SHAs with a single `git2hg` call.
+
+        Conversions are looked up in the on-disk mapping cache first. SHAs
+        that are unknown to the cinnabar repo are left out of the result.
+        """
+        converted = {
+            sha: self.git_hg_map[sha] for sha in git_shas if sha in self.git_hg_map
+        }
+        missing = list(dict.fromkeys(sha for sha in git_shas if sha not in converted))
+        if not missing:
+            return converted
+
+        output = self.run_git(["cinnabar", "git2hg", *missing])
+        new = {
+            git_sha: hg_sha
+            for git_sha, hg_sha in zip(missing, output.split())
+            if hg_sha != NULL_HG_SHA
+        }
+        if new:
+            self.git_hg_map.update(new)
+            self.save_git_hg_map()
+
+        converted.update(new)
+        return converted
+
     def run_git(self, args: list[str], cwd: Optional[Path] = None) -> str:
         """Run a `git` command on the associated Git repo."""
         correlation_id = str(uuid.uuid4())
@@ -786,23 +1393,82 @@ class HgRepo:
         """Return the currently checked out node."""
         return self.run_hg(["identify", "-r", ".", "-i"])
 
+    def lookup_node(self, rev: str) -> Optional[str]:
+        """Return the node of `rev`, or `None` if it is not in the repo."""
+        try:
+            return self.run_hg(["log", "-r", rev, "-T", "{node}"]).decode("utf-8")
+        except hglib.error.CommandError:
+            return None
+
+    def last_changesets_for_paths(self, paths: list[str]) -> dict[str, str]:
+        """Return the last changeset to touch each of `paths`, in a single query.
+
+        Paths that have no history are mapped to an empty string.
+        """
+        if not paths:
+            return {}
+
+        # Selects the last changeset for each path. Walking these from newest to
+        # oldest, the first changeset that touches a path is its last changeset.
+        # `filelog()` only reads the filelog of each path, where `file()` would
+        # scan the whole changelog once per path.
+        revset = " + ".join(f"max(filelog({revset_string(path)}))" for path in paths)
+        output = self.run_hg(
+            [
+                "log",
+                # `filelog()` resolves plain paths relative to the working directory.
+                "--cwd",
+                self.path,
+                "-r",
+                f"sort({revset}, -rev)",
+                "-T",
+                "{node}\\0{join(files, '\\0')}\\n",
+            ]
+        ).decode(self.ENCODING)
+
+        remaining = set(paths)
+        changesets = {}
+        for line in output.splitlines():
+            node, *files = line.split("\0")
+            for path in remaining.intersection(files):
+                changesets[path] = node
+            remaining.difference_update(files)
+
+        return {path: changesets.get(path, "") for path in paths}
+
+    def pull_if_needed(self, source: str, remote_rev: str) -> bool:
+        """Pull from `source` unless `remote_rev` is already in the repo.
+
+        Returns `True` if the repo was pulled.
+        """
+        if self.last_pulled_heads.get(source) == remote_rev or self.lookup_node(
+            remote_rev
+        ):
+            logger.info(
+                "Skipping pull, changeset is already present.",
+                extra={"path": self.path, "source": source, "rev": remote_rev},
+            )
+            self.pulls["skipped"] += 1
+            return False
+
+        self.run_hg(["pull", source])
+        self.last_pulled_heads[source] = remote_rev
+        self.pulls["pulled"] += 1
+        return True
+
     def update_from_upstream(self, source, remote_rev):
-        # Pull and update to remote tip.
-        cmds = [
-            ["pull", source],
-            ["rebase", "--abort"],
-            ["update", "--clean", "-r", remote_rev],
-        ]
+        # Pull and update to remote tip, skipping the steps which are not needed.
+        try:
+            self.pull_if_needed(source, remote_rev)
 
-        for cmd in cmds:
-            try:
-                self.run_hg(cmd)
-            except hglib.error.CommandError as e:
-                if b"abort: no rebase in progress" in e.err:
-                    # there was no rebase in progress, nothing to see here
-                    continue
-                else:
-                    raise HgException.from_hglib_error(e)
+            if (Path(self.path) / ".hg" / "rebasestate").exists():
+                self.run_hg(["rebase", "--abort"])
+
+            current_node = self.lookup_node(".")
+            if not current_node or current_node != self.lookup_node(remote_rev):
+                self.run_hg(["update", "--clean", "-r", remote_rev])
+        except hglib.error.CommandError as e:
+            raise HgException.from_hglib_error(e)
 
     def rebase(self, base_revision, target_cset):
         # Perform rebase if necessary. Returns tip revision.
@@ -235,51 +235,36 @@ class HgPatchHelper(PatchHelper):
         if not self.headers:
             raise ValueError("Failed to parse headers from patch.")
 
-    def get_commit_description(self) -> str:
-        """Returns the commit description."""
+    def get_commit_description_and_diff(self) -> tuple[str, str]:
+        """Return the commit description and the diff, in a single pass."""
         commit_desc = []
+        diff = ""
 
         try:
             for i, line in enumerate(self.patch, start=1):
-                if i <= self.header_end_line_no:
-                    continue
-
-                # If we found a `Diff Start Line` header and we have parsed to that line,
-                # the commit description has been parsed and we can break.
-                # If there was no `Diff Start Line` header, iterate through each line until
-                # we find a `diff` line, then break as we have parsed the commit description.
+                # If we found a `Diff Start Line` header, parse the diff from that line.
+                # If there was no `Diff Start Line` header, iterate through each line
+                # until we find a `diff` line.
                 if (self.diff_start_line and i == self.diff_start_line) or (
                     not self.diff_start_line and self._is_diff_line(line)
                 ):
+                    diff = line + self.patch.read()
                     break
 
-                commit_desc.append(line)
+                if i > self.header_end_line_no:
+                    commit_desc.append(line)
 
-            return "".join(commit_desc).strip()
+            return "".join(commit_desc).strip(), diff
         finally:
             self.patch.seek(0)
 
+    def get_commit_description(self) -> str:
+        """Returns the commit description."""
+        return self.get_commit_description_and_diff()[0]
+
     def get_diff(self) -> str:
         """Return the diff for this patch."""
-        diff = []
-
-        try:
-            for i, line in enumerate(self.patch, start=1):
-                # If we found a `Diff Start Line` header, parse the diff until that line.
-                # If there was no `Diff Start Line` header, iterate through each line until
-                # we find a `diff` line.
-                if (not self.diff_start_line and self._is_diff_line(line)) or (
-                    self.diff_start_line and i == self.diff_start_line
-                ):
-                    diff.append(line)
-                    break
-
-            buf = self.patch.read()
-            diff.append(buf)
-
-            return "".join(diff)
-        finally:
-            self.patch.seek(0)
+        return self.get_commit_description_and_diff()[1]
 
     def parse_author_information(self) -> tuple[str, str]:
         """Return the author name and email from the patch."""
@@ -29,6 +29,7 @@ def check_maintenance() -> Optional[Response]:
         "dockerflow.heartbeat",
         "dockerflow.version",
         "dockerflow.lbheartbeat",
+        "metrics.get_metrics",
         "landoapi_api_treestatus_delete_stack",
         "landoapi_api_treestatus_delete_tree",
         "landoapi_api_treestatus_get_logs",
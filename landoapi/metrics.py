@@ -0,0 +1,195 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Metrics in the Prometheus text exposition format.
+
+The API serves landing queue metrics on `/__metrics__`, and each landing worker
+process can serve its own metrics with a `MetricsExporter`.
+"""
+
+from __future__ import annotations
+
+import datetime
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable
+
+from flask import Blueprint, Response
+from sqlalchemy import func
+
+from landoapi.cache import cache
+from landoapi.models.landing_job import LandingJob, LandingJobStatus
+from landoapi.storage import db
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# How long the landing queue metrics are cached for, so that frequent scraping
+# does not load the database.
+QUEUE_METRICS_CACHE_SECONDS = int(os.environ.get("QUEUE_METRICS_CACHE_SECONDS", 15))
+
+# Upper bounds of the buckets of the landing job attempts histogram.
+ATTEMPTS_BUCKETS = (1, 2, 3, 5, 10)
+
+QUEUED_STATUSES = (
+    LandingJobStatus.SUBMITTED,
+    LandingJobStatus.IN_PROGRESS,
+    LandingJobStatus.DEFERRED,
+)
+
+metrics = Blueprint("metrics", __name__)
+
+
+@dataclass
+class Metric:
+    """A metric and its samples."""
+
+    name: str
+    type: str
+    help: str
+    samples: list[tuple[str, dict[str, str], float]] = field(default_factory=list)
+
+    def add(self, value: float, suffix: str = "", **labels: str):
+        """Add a sample, `suffix` is appended to the name (e.g. `_bucket`)."""
+        self.samples.append((suffix, labels, value))
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    escaped = (
+        str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        for value in labels.values()
+    )
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped))
+    return f"{{{pairs}}}"
+
+
+def render_metrics(metrics: Iterable[Metric]) -> str:
+    """Render `metrics` in the Prometheus text exposition format."""
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for suffix, labels, value in metric.samples:
+            lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {value:g}")
+
+    return "\n".join(lines) + "\n"
+
+
+def landing_queue_metrics() -> list[Metric]:
+    """Return metrics describing the landing job queue.
+
+    Each metric is computed with a single aggregate query.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    jobs = Metric(
+        "lando_landing_jobs", "gauge", "Number of queued landing jobs by status."
+    )
+    rows = (
+        db.session.query(LandingJob.repository_name, LandingJob.status, func.count())
+        .filter(LandingJob.status.in_(QUEUED_STATUSES))
+        .group_by(LandingJob.repository_name, LandingJob.status)
+    )
+    for repository_name, status, count in rows:
+        jobs.add(count, repository=repository_name, status=status.value)
+
+    oldest = Metric(
+        "lando_landing_queue_oldest_submitted_age_seconds",
+        "gauge",
+        "Age of the oldest submitted landing job.",
+    )
+    rows = (
+        db.session.query(LandingJob.repository_name, func.min(LandingJob.created_at))
+        .filter(LandingJob.status == LandingJobStatus.SUBMITTED)
+        .group_by(LandingJob.repository_name)
+    )
+    for repository_name, created_at in rows:
+        oldest.add((now - created_at).total_seconds(), repository=repository_name)
+
+    attempts = Metric(
+        "lando_landing_job_attempts",
+        "histogram",
+        "Number of attempts made to land queued landing jobs.",
+    )
+    counts = dict(
+        db.session.query(LandingJob.attempts, func.count())
+        .filter(LandingJob.status.in_(QUEUED_STATUSES))
+        .group_by(LandingJob.attempts)
+    )
+    for bound in ATTEMPTS_BUCKETS:
+        attempts.add(
+            sum(count for value, count in counts.items() if value <= bound),
+            "_bucket",
+            le=str(bound),
+        )
+    attempts.add(sum(counts.values()), "_bucket", le="+Inf")
+    attempts.add(sum(value * count for value, count in counts.items()), "_sum")
+    attempts.add(sum(counts.values()), "_count")
+
+    # Don't keep the transaction open.
+    db.session.commit()
+
+    return [jobs, oldest, attempts]
+
+
+@cache.cached(key_prefix="landing-queue-metrics", timeout=QUEUE_METRICS_CACHE_SECONDS)
+def rendered_landing_queue_metrics() -> str:
+    """Return the landing queue metrics, rendered and cached."""
+    return render_metrics(landing_queue_metrics())
+
+
+@metrics.route("/__metrics__")
+def get_metrics():
+    """Return the landing queue metrics for scraping."""
+    return Response(rendered_landing_queue_metrics(), content_type=CONTENT_TYPE)
+
+
+class MetricsExporter:
+    """Serve metrics over HTTP from a background thread.
+
+    `collect` is called for every request and returns the metrics to serve.
+    """
+
+    def __init__(self, port: int, collect: Callable[[], Iterable[Metric]]):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                try:
+                    body = render_metrics(collect()).encode("utf-8")
+                except Exception as e:
+                    logger.exception(f"Could not collect metrics: {e}")
+                    self.send_error(500)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self.server = ThreadingHTTPServer(("", port), Handler)
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="metrics-exporter", daemon=True
+        )
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        logger.info(f"Serving metrics on port {self.port}.")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
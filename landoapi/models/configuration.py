@@ -25,6 +25,13 @@ class ConfigurationKey(enum.Enum):
     LANDING_WORKER_STOPPED = "LANDING_WORKER_STOPPED"
     API_IN_MAINTENANCE = "API_IN_MAINTENANCE"
     WORKER_THROTTLE_SECONDS = "WORKER_THROTTLE_SECONDS"
+    LANDING_WORKER_TRAIN_SIZE = "LANDING_WORKER_TRAIN_SIZE"
+    LANDING_WORKER_PIPELINE_ENABLED = "LANDING_WORKER_PIPELINE_ENABLED"
+    LANDING_WORKER_IDLE_PULL_SECONDS = "LANDING_WORKER_IDLE_PULL_SECONDS"
+    LANDING_QUEUE_POLICY = "LANDING_QUEUE_POLICY"
+    LANDING_QUEUE_REPOSITORY_WEIGHTS = "LANDING_QUEUE_REPOSITORY_WEIGHTS"
+    LANDING_QUEUE_REQUESTER_CAP = "LANDING_QUEUE_REQUESTER_CAP"
+    LANDING_QUEUE_AGING_SECONDS = "LANDING_QUEUE_AGING_SECONDS"
 
 
 @enum.unique
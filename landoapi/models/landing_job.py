@@ -15,12 +15,14 @@ from typing import (
 import flask_sqlalchemy
 from mots.config import FileConfig
 from mots.directory import Directory
-from sqlalchemy import or_
+from sqlalchemy import case, func, or_, select, text, update
 from sqlalchemy.dialects.postgresql import array
 from sqlalchemy.dialects.postgresql.json import JSONB
+from sqlalchemy.engine import Connection
 from sqlalchemy.orm.attributes import flag_modified
 
 from landoapi.models.base import Base
+from landoapi.models.configuration import ConfigurationKey, ConfigurationVariable
 from landoapi.models.revisions import Revision, revision_landing_job
 from landoapi.storage import db
 
@@ -28,6 +30,13 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_GRACE_SECONDS = int(os.environ.get("DEFAULT_GRACE_SECONDS", 60 * 2))
 
+# How long a worker's claim on a job lasts unless it is renewed. Jobs whose lease
+# expired are considered abandoned and may be reclaimed by any worker.
+DEFAULT_LEASE_SECONDS = int(os.environ.get("DEFAULT_LEASE_SECONDS", 60 * 5))
+
+# Postgres channel on which changes to the landing job queue are announced.
+LANDING_JOB_NOTIFY_CHANNEL = "lando_landing_jobs"
+
 
 @enum.unique
 class LandingJobStatus(enum.Enum):
@@ -77,6 +86,39 @@ class LandingJobAction(enum.Enum):
     CANCEL = "CANCEL"
 
 
+@enum.unique
+class LandingQueuePolicy(enum.Enum):
+    """Policies used to order the landing job queue.
+
+    The active policy is selected with `ConfigurationKey.LANDING_QUEUE_POLICY`.
+    """
+
+    # Higher priority jobs first, then older jobs first.
+    FIFO = "FIFO"
+
+    # Weighted round-robin across repositories and requesters, with priority aging.
+    FAIR_SHARE = "FAIR_SHARE"
+
+
+def parse_repository_weights(value: str) -> dict[str, int]:
+    """Parse a list of repository weights such as `autoland:3, try:1`.
+
+    Invalid entries are logged and ignored.
+    """
+    weights = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+
+        name, _, weight = entry.partition(":")
+        try:
+            weights[name.strip()] = max(int(weight), 1)
+        except ValueError:
+            logger.error(f"Ignoring invalid repository weight {entry!r}.")
+
+    return weights
+
+
 class LandingJob(Base):
     """State for a landing job."""
 
@@ -135,6 +177,21 @@ class LandingJob(Base):
     # VCS of the `target_commit_hash`.
     target_commit_hash_vcs = db.Column(db.Text(), nullable=True)
 
+    # Identifier of the worker which last claimed the job.
+    worker_id = db.Column(db.Text(), nullable=True)
+
+    # Time at which the worker's claim on an `IN_PROGRESS` job expires, unless
+    # the worker renews it.
+    lease_expires_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    # Deferred jobs are not retried before this time.
+    not_before = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    # Seconds spent in each phase of the last attempt at landing the job.
+    # Patches are timed individually, keyed by revision.
+    # E.g. {"pull": 1.52, "apply": 0.41, "apply:D123": 0.41, "push": 3.07}
+    phase_timings = db.Column(JSONB, nullable=True)
+
     revisions: list[Revision] = db.relationship(
         "Revision",
         secondary=revision_landing_job,
@@ -227,6 +284,7 @@ class LandingJob(Base):
         cls,
         repositories: Optional[Iterable[str]] = None,
         grace_seconds: int = DEFAULT_GRACE_SECONDS,
+        policy: Optional[LandingQueuePolicy] = None,
     ) -> flask_sqlalchemy.BaseQuery:
         """Return a query which selects the queued jobs.
 
@@ -235,6 +293,10 @@ class LandingJob(Base):
                 the landing job search query.
             grace_seconds (int): Ignore landing jobs that were submitted after this
                 many seconds ago.
+            policy (LandingQueuePolicy): The policy used to order the queue. Defaults
+                to the policy set in `ConfigurationKey.LANDING_QUEUE_POLICY`.
+
+        Deferred jobs are not selected until their `not_before` time has passed.
         """
         applicable_statuses = (
             LandingJobStatus.SUBMITTED,
@@ -246,11 +308,20 @@ class LandingJob(Base):
         if repositories:
             q = q.filter(cls.repository_name.in_(repositories))
 
+        now = datetime.datetime.now(datetime.timezone.utc)
         if grace_seconds:
-            now = datetime.datetime.now(datetime.timezone.utc)
             grace_cutoff = now - datetime.timedelta(seconds=grace_seconds)
             q = q.filter(cls.created_at < grace_cutoff)
 
+        # Skip deferred jobs which are backing off.
+        q = q.filter(or_(cls.not_before.is_(None), cls.not_before <= now))
+
+        if policy is None:
+            policy = cls.queue_policy()
+
+        if policy == LandingQueuePolicy.FAIR_SHARE:
+            return cls._fair_share_order(q, now)
+
         # Any `LandingJobStatus.IN_PROGRESS` job is first and there should
         # be a maximum of one (per repository). For
         # `LandingJobStatus.SUBMITTED` jobs, higher priority items come first
@@ -259,19 +330,238 @@ class LandingJob(Base):
 
         return q
 
+    @staticmethod
+    def queue_policy() -> LandingQueuePolicy:
+        """Return the policy set in `ConfigurationKey.LANDING_QUEUE_POLICY`."""
+        value = ConfigurationVariable.get(
+            ConfigurationKey.LANDING_QUEUE_POLICY, LandingQueuePolicy.FIFO.value
+        )
+        try:
+            return LandingQueuePolicy(value)
+        except ValueError:
+            logger.error(f"Unknown landing queue policy {value!r}, using FIFO.")
+            return LandingQueuePolicy.FIFO
+
+    @classmethod
+    def _fair_share_order(
+        cls, q: flask_sqlalchemy.BaseQuery, now: datetime.datetime
+    ) -> flask_sqlalchemy.BaseQuery:
+        """Order the jobs selected by `q` with the `FAIR_SHARE` policy.
+
+        Jobs are served in rounds. In each round, a repository gets as many jobs as
+        its weight (`ConfigurationKey.LANDING_QUEUE_REPOSITORY_WEIGHTS`, 1 by
+        default) and a requester gets at most
+        `ConfigurationKey.LANDING_QUEUE_REQUESTER_CAP` jobs. A burst of jobs from one
+        repository or requester is therefore interleaved with everyone else's jobs.
+
+        If `ConfigurationKey.LANDING_QUEUE_AGING_SECONDS` is set, a job's priority
+        increases by one each time it has waited that long, up to the highest
+        priority in the queue, so that low priority jobs are not starved.
+        """
+        weights = parse_repository_weights(
+            ConfigurationVariable.get(
+                ConfigurationKey.LANDING_QUEUE_REPOSITORY_WEIGHTS, ""
+            )
+        )
+        requester_cap = max(
+            ConfigurationVariable.get(ConfigurationKey.LANDING_QUEUE_REQUESTER_CAP, 1),
+            1,
+        )
+        aging_seconds = ConfigurationVariable.get(
+            ConfigurationKey.LANDING_QUEUE_AGING_SECONDS, 0
+        )
+
+        priority = cls.priority
+        if aging_seconds > 0:
+            age = func.extract("epoch", now - cls.created_at)
+            priority = func.least(
+                cls.priority + func.floor(age / aging_seconds),
+                func.max(cls.priority).over(),
+            )
+
+        # Window functions can't be used in a query which locks rows, so the jobs
+        # are ranked in subqueries. Requesters get their share of each round first,
+        # then the jobs of each repository are shared out in that order.
+        requester_ranked = q.with_entities(
+            cls.id.label("id"),
+            cls.repository_name.label("repository_name"),
+            cls.created_at.label("created_at"),
+            priority.label("priority"),
+            (
+                (
+                    func.row_number().over(
+                        partition_by=cls.requester_email, order_by=cls.created_at
+                    )
+                    - 1
+                )
+                / requester_cap
+            ).label("round"),
+        ).subquery()
+
+        repository_weight = (
+            case(weights, value=requester_ranked.c.repository_name, else_=1)
+            if weights
+            else 1
+        )
+        repository_round = (
+            func.row_number().over(
+                partition_by=requester_ranked.c.repository_name,
+                order_by=(requester_ranked.c.round, requester_ranked.c.created_at),
+            )
+            - 1
+        ) / repository_weight
+        ranked = db.session.query(
+            requester_ranked.c.id,
+            requester_ranked.c.priority,
+            func.greatest(requester_ranked.c.round, repository_round).label("round"),
+        ).subquery()
+
+        return cls.query.join(ranked, cls.id == ranked.c.id).order_by(
+            cls.status.desc(),
+            ranked.c.priority.desc(),
+            ranked.c.round,
+            cls.created_at,
+        )
+
     @classmethod
     def next_job_for_update_query(
-        cls, repositories: Optional[Iterable[str]] = None
+        cls,
+        repositories: Optional[Iterable[str]] = None,
+        worker_id: Optional[str] = None,
     ) -> flask_sqlalchemy.BaseQuery:
-        """Return a query which selects the next job and locks the row."""
+        """Return a query which selects the next job and locks the row.
+
+        `IN_PROGRESS` jobs are only selected if they are not leased, if their lease
+        expired, or if they were claimed by `worker_id`.
+        """
         query = cls.job_queue_query(repositories=repositories)
 
+        now = datetime.datetime.now(datetime.timezone.utc)
+        reclaimable = [
+            cls.status != LandingJobStatus.IN_PROGRESS,
+            cls.lease_expires_at.is_(None),
+            cls.lease_expires_at < now,
+        ]
+        if worker_id:
+            reclaimable.append(cls.worker_id == worker_id)
+        query = query.filter(or_(*reclaimable))
+
         # Returned rows should be locked for updating, this ensures the next
-        # job can be claimed.
-        query = query.with_for_update()
+        # job can be claimed. Rows already locked by another worker are skipped
+        # so that concurrent workers can each claim a different job instead of
+        # waiting on the same row.
+        query = query.with_for_update(of=cls, skip_locked=True)
 
         return query
 
+    @classmethod
+    def seconds_until_next_eligible(
+        cls,
+        repositories: Optional[Iterable[str]] = None,
+        grace_seconds: int = DEFAULT_GRACE_SECONDS,
+    ) -> Optional[float]:
+        """Return the number of seconds until a queued job becomes eligible.
+
+        Queued jobs become eligible when they leave the grace period, or for deferred
+        jobs, when their backoff ends. Returns `None` if there are no queued jobs
+        waiting to become eligible.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        eligible_at = []
+
+        if grace_seconds:
+            grace = datetime.timedelta(seconds=grace_seconds)
+            q = db.session.query(func.min(cls.created_at)).filter(
+                cls.status.in_((LandingJobStatus.SUBMITTED, LandingJobStatus.DEFERRED)),
+                cls.created_at >= now - grace,
+            )
+            if repositories:
+                q = q.filter(cls.repository_name.in_(repositories))
+
+            oldest_created_at = q.scalar()
+            if oldest_created_at is not None:
+                eligible_at.append(oldest_created_at + grace)
+
+        q = db.session.query(func.min(cls.not_before)).filter(
+            cls.status == LandingJobStatus.DEFERRED,
+            cls.not_before > now,
+        )
+        if repositories:
+            q = q.filter(cls.repository_name.in_(repositories))
+
+        earliest_not_before = q.scalar()
+        if earliest_not_before is not None:
+            eligible_at.append(earliest_not_before)
+
+        if not eligible_at:
+            return None
+
+        return max((min(eligible_at) - now).total_seconds(), 0)
+
+    def claim(self, worker_id: str, lease_seconds: int = DEFAULT_LEASE_SECONDS):
+        """Mark the job as being processed by `worker_id` and lease it."""
+        self.status = LandingJobStatus.IN_PROGRESS
+        self.attempts += 1
+        self.phase_timings = {}
+        self.worker_id = worker_id
+        self.lease_expires_at = datetime.datetime.now(
+            datetime.timezone.utc
+        ) + datetime.timedelta(seconds=lease_seconds)
+
+    def record_phase_timing(self, phase: str, seconds: float):
+        """Add `seconds` to the time spent in `phase` of the current attempt."""
+        timings = dict(self.phase_timings or {})
+        timings[phase] = round(timings.get(phase, 0) + seconds, 3)
+        self.phase_timings = timings
+
+    @classmethod
+    def renew_leases(
+        cls,
+        connection: Connection,
+        job_ids: Iterable[int],
+        worker_id: str,
+        lease_seconds: int = DEFAULT_LEASE_SECONDS,
+    ) -> int:
+        """Extend the leases `worker_id` holds on the given jobs.
+
+        The update is executed on `connection` rather than the session, so it can be
+        used from a thread other than the one processing the jobs. Returns the number
+        of leases which were renewed.
+
+        Jobs whose rows are locked, typically by pending changes in the session
+        processing them, are skipped rather than waited for. They don't need
+        renewing meanwhile, as workers claiming jobs skip locked rows too.
+        """
+        lease_expires_at = datetime.datetime.now(
+            datetime.timezone.utc
+        ) + datetime.timedelta(seconds=lease_seconds)
+        unlocked_job_ids = (
+            select(cls.id)
+            .where(
+                cls.id.in_(list(job_ids)),
+                cls.worker_id == worker_id,
+                cls.status == LandingJobStatus.IN_PROGRESS,
+            )
+            .with_for_update(skip_locked=True)
+        )
+        result = connection.execute(
+            update(cls.__table__)
+            .where(cls.id.in_(unlocked_job_ids))
+            .values(lease_expires_at=lease_expires_at)
+        )
+        return result.rowcount
+
+    def notify_queue(self):
+        """Notify listening workers that this job's queue has changed.
+
+        Notifications are transactional, they are delivered when the current
+        transaction is committed.
+        """
+        db.session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": LANDING_JOB_NOTIFY_CHANNEL, "payload": self.repository_name},
+        )
+
     def add_revisions(self, revisions: list[Revision]):
         """Associate a list of revisions with job."""
         for revision in revisions:
@@ -343,7 +633,8 @@ class LandingJob(Base):
             db (SQLAlchemy.db): the database to commit to
             **kwargs:
                 Additional arguments required by each action, e.g. `message` or
-                `commit_id`.
+                `commit_id`. `DEFER` optionally accepts `not_before`, the earliest
+                time at which the job should be retried.
         """
         actions = {
             LandingJobAction.LAND: {
@@ -356,6 +647,7 @@ class LandingJob(Base):
             },
             LandingJobAction.DEFER: {
                 "required_params": ["message"],
+                "optional_params": ["not_before"],
                 "status": LandingJobStatus.DEFERRED,
             },
             LandingJobAction.CANCEL: {
@@ -367,22 +659,35 @@ class LandingJob(Base):
         if action not in actions:
             raise ValueError(f"{action} is not a valid action")
 
-        required_params = actions[action]["required_params"]
-        if sorted(required_params) != sorted(kwargs.keys()):
-            missing_params = required_params - kwargs.keys()
+        required_params = set(actions[action]["required_params"])
+        optional_params = set(actions[action].get("optional_params", []))
+        missing_params = required_params - kwargs.keys()
+        if missing_params:
             raise ValueError(f"Missing {missing_params} params")
 
+        unexpected_params = kwargs.keys() - required_params - optional_params
+        if unexpected_params:
+            raise ValueError(f"Unexpected {unexpected_params} params")
+
         if commit and db is None:
             raise ValueError("db is required when commit is set to True")
 
         self.status = actions[action]["status"]
 
+        # The job is no longer being processed, release the lease.
+        self.lease_expires_at = None
+
+        # Only deferred jobs are held back from being retried.
+        self.not_before = kwargs.get("not_before")
+
         if action in (LandingJobAction.FAIL, LandingJobAction.DEFER):
             self.error = kwargs["message"]
 
         if action == LandingJobAction.LAND:
             self.landed_commit_id = kwargs["commit_id"]
 
+        self.notify_queue()
+
         if commit:
             db.session.commit()
 
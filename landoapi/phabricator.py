@@ -4,9 +4,15 @@
 
 from __future__ import annotations
 
+import copy
 import json
 import logging
+import os
+import random
 import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import (
     datetime,
     timezone,
@@ -18,11 +24,14 @@ from enum import (
 from json.decoder import JSONDecodeError
 from typing import (
     Any,
+    Callable,
     Iterable,
     Optional,
 )
 
 import requests
+from flask import current_app, has_app_context
+from requests.adapters import HTTPAdapter
 
 from landoapi.systems import Subsystem
 
@@ -30,6 +39,51 @@ logger = logging.getLogger(__name__)
 
 PHAB_API_KEY_RE = re.compile(r"^api-.{28}$")
 
+# Maximum number of Conduit requests a `PhabricatorClient` makes concurrently.
+CONDUIT_CONCURRENCY = int(os.environ.get("CONDUIT_CONCURRENCY", 4))
+
+# Maximum number of keep-alive connections to Phabricator kept by each process.
+CONDUIT_POOL_SIZE = int(os.environ.get("CONDUIT_POOL_SIZE", 10))
+
+# Seconds to wait for a connection to Phabricator, and for a Conduit response.
+CONDUIT_CONNECT_TIMEOUT_SECONDS = float(
+    os.environ.get("CONDUIT_CONNECT_TIMEOUT_SECONDS", 5)
+)
+CONDUIT_READ_TIMEOUT_SECONDS = float(os.environ.get("CONDUIT_READ_TIMEOUT_SECONDS", 30))
+
+# Conduit methods with a read timeout other than `CONDUIT_READ_TIMEOUT_SECONDS`.
+CONDUIT_METHOD_READ_TIMEOUTS = {
+    "conduit.ping": 5,
+    "user.whoami": 10,
+    "differential.creatediff": 120,
+    "differential.getrawdiff": 60,
+}
+
+# Conduit methods without side effects other than `*.search`, which are safe to
+# retry.
+IDEMPOTENT_CONDUIT_METHODS = {
+    "conduit.ping",
+    "differential.getrawdiff",
+    "differential.querydiffs",
+    "user.whoami",
+}
+
+# Number of times an idempotent Conduit request is retried after a transient
+# failure, and the base delay in seconds of the exponential backoff.
+CONDUIT_RETRIES = int(os.environ.get("CONDUIT_RETRIES", 2))
+CONDUIT_RETRY_DELAY_SECONDS = float(os.environ.get("CONDUIT_RETRY_DELAY_SECONDS", 0.25))
+
+# HTTP statuses returned by Phabricator, or the proxies in front of it, when it is
+# temporarily unavailable.
+TRANSIENT_HTTP_STATUSES = {502, 503, 504}
+
+# Number of consecutive transient failures after which requests to Phabricator
+# fail fast, and for how many seconds.
+CONDUIT_CIRCUIT_THRESHOLD = int(os.environ.get("CONDUIT_CIRCUIT_THRESHOLD", 5))
+CONDUIT_CIRCUIT_RESET_SECONDS = float(
+    os.environ.get("CONDUIT_CIRCUIT_RESET_SECONDS", 30)
+)
+
 
 @unique
 class PhabricatorRevisionStatus(Enum):
@@ -158,6 +212,63 @@ class ReviewerStatus(Enum):
         }.get(self, False)
 
 
+class CircuitBreaker:
+    """Fail fast while a remote service is degraded.
+
+    The circuit opens after `threshold` consecutive failures, and requests are
+    refused until `reset_seconds` have passed. A single trial request is then
+    let through, which closes the circuit if it succeeds.
+    """
+
+    def __init__(self, threshold: int, reset_seconds: float):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+
+    def reset(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def allow(self) -> bool:
+        """Return `True` if a request may be sent."""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+
+            # Let this request through as a trial, and refuse others meanwhile.
+            self.opened_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures < self.threshold:
+                return
+
+            if self.opened_at is None:
+                logger.warning(
+                    f"Circuit opened after {self.failures} consecutive failures."
+                )
+            self.opened_at = time.monotonic()
+
+
+# Shared by all `PhabricatorClient`s of the process.
+conduit_circuit_breaker = CircuitBreaker(
+    CONDUIT_CIRCUIT_THRESHOLD, CONDUIT_CIRCUIT_RESET_SECONDS
+)
+
+
 class PhabricatorClient:
     """A class to interface with Phabricator's Conduit API.
 
@@ -166,19 +277,48 @@ class PhabricatorClient:
     the request to the server or decoding the JSON response, this class will
     bubble up the exception, as a PhabricatorAPIException caused by the
     underlying exception.
+
+    Unless a `session` is given, clients share a keep-alive connection pool
+    per process. Idempotent requests are retried after transient failures,
+    and requests fail fast while Phabricator is degraded.
+
+    Results of idempotent requests are memoized for the lifetime of the
+    client, which is a single API request for clients provided by
+    `require_phabricator_api_key`. Any other request clears the memo.
     """
 
+    _shared_session = None
+    _shared_session_pid = None
+    _shared_session_lock = threading.Lock()
+
     def __init__(
-        self, url: str, api_token: str, *, session: Optional[requests.Session] = None
+        self,
+        url: str,
+        api_token: str,
+        *,
+        session: Optional[requests.Session] = None,
+        max_concurrency: int = CONDUIT_CONCURRENCY,
     ):
         self.url_base = url
         self.api_url = url + "api/" if url[-1] == "/" else url + "/api/"
         self.api_token = api_token
-        self.session = session or self.create_session()
+        self.session = session or self.shared_session()
+        self.max_concurrency = max_concurrency
+
+        # Limits the requests in flight across all threads using this client,
+        # including nested `run_concurrently` calls.
+        self.request_slots = threading.BoundedSemaphore(max(1, max_concurrency))
+
+        # Results of idempotent requests, keyed by method and canonical params.
+        self.memo: dict[tuple[str, str], Future] = {}
+        self.memo_lock = threading.Lock()
 
     def call_conduit(self, method: str, **kwargs) -> Any:
         """Return the result of an RPC call to a conduit method.
 
+        Identical idempotent calls are only sent once, and concurrent identical
+        calls wait for the first one to complete.
+
         Args:
             **kwargs: Every method parameter is passed as a keyword argument.
 
@@ -193,6 +333,37 @@ class PhabricatorClient:
                 if there is a request exception while communicating
                 with the conduit API.
         """
+        if not self.is_idempotent(method):
+            # Memoized results may be stale after a change.
+            with self.memo_lock:
+                self.memo.clear()
+            return self._call_conduit(method, **kwargs)
+
+        key = (method, json.dumps(kwargs, sort_keys=True))
+        with self.memo_lock:
+            future = self.memo.get(key)
+            if future is None:
+                future = self.memo[key] = Future()
+                pending = True
+            else:
+                pending = False
+
+        if pending:
+            try:
+                future.set_result(self._call_conduit(method, **kwargs))
+            except Exception as exc:
+                # Don't memoize failures, so that a later call can try again.
+                with self.memo_lock:
+                    if self.memo.get(key) is future:
+                        del self.memo[key]
+                future.set_exception(exc)
+                raise
+
+        # Callers may modify the result, don't share it.
+        return copy.deepcopy(future.result())
+
+    def _call_conduit(self, method: str, **kwargs) -> Any:
+        """Send an RPC call to a conduit method, see `call_conduit`."""
         if "__conduit__" not in kwargs:
             kwargs["__conduit__"] = {"token": self.api_token}
 
@@ -206,23 +377,119 @@ class PhabricatorClient:
         del extra_data["params"]["__conduit__"]  # Sanitize the api token.
         logger.debug("call to conduit", extra=extra_data)
 
-        try:
-            response = self.session.post(self.api_url + method, data=data).json()
-        except requests.RequestException as exc:
-            raise PhabricatorCommunicationException(
-                "An error occurred when communicating with Phabricator"
-            ) from exc
-        except JSONDecodeError as exc:
-            raise PhabricatorCommunicationException(
-                "Phabricator response could not be decoded as JSON"
-            ) from exc
+        retries = CONDUIT_RETRIES if self.is_idempotent(method) else 0
+        timeout = (
+            CONDUIT_CONNECT_TIMEOUT_SECONDS,
+            CONDUIT_METHOD_READ_TIMEOUTS.get(method, CONDUIT_READ_TIMEOUT_SECONDS),
+        )
+        for attempt in range(retries + 1):
+            if not conduit_circuit_breaker.allow():
+                raise PhabricatorCommunicationException(
+                    "Phabricator is unavailable, try again later"
+                )
+
+            if attempt:
+                # Exponential backoff with full jitter.
+                time.sleep(
+                    random.uniform(0, CONDUIT_RETRY_DELAY_SECONDS * 2 ** (attempt - 1))
+                )
+
+            try:
+                with self.request_slots:
+                    response = self.session.post(
+                        self.api_url + method, data=data, timeout=timeout
+                    )
+                if response.status_code in TRANSIENT_HTTP_STATUSES:
+                    response.raise_for_status()
+                response = response.json()
+            except (
+                requests.ConnectionError,
+                requests.HTTPError,
+                requests.Timeout,
+            ) as exc:
+                conduit_circuit_breaker.record_failure()
+                if attempt < retries:
+                    logger.warning(
+                        f"Transient error calling {method}, retrying: {exc}",
+                        extra=extra_data,
+                    )
+                    continue
+
+                raise PhabricatorCommunicationException(
+                    "An error occurred when communicating with Phabricator"
+                ) from exc
+            except requests.RequestException as exc:
+                raise PhabricatorCommunicationException(
+                    "An error occurred when communicating with Phabricator"
+                ) from exc
+            except JSONDecodeError as exc:
+                raise PhabricatorCommunicationException(
+                    "Phabricator response could not be decoded as JSON"
+                ) from exc
+
+            conduit_circuit_breaker.record_success()
+            break
 
         PhabricatorAPIException.raise_if_error(response)
         return response.get("result")
 
+    def run_concurrently(self, *calls: Callable[[], Any]) -> list[Any]:
+        """Run independent Phabricator requests concurrently.
+
+        Each of `calls` takes no arguments and typically wraps one or more
+        `call_conduit` calls. At most `max_concurrency` calls run at once, each
+        within the current Flask app context. Conduit requests made by the client
+        are limited to `max_concurrency` in total, even when calls are nested.
+
+        Returns:
+            The results of `calls`, in the same order.
+
+        Raises:
+            The exception raised by the first failing call, in order of `calls`.
+        """
+        if len(calls) < 2 or self.max_concurrency < 2:
+            return [call() for call in calls]
+
+        app = current_app._get_current_object() if has_app_context() else None
+
+        def run(call: Callable[[], Any]) -> Any:
+            if app is None:
+                return call()
+
+            with app.app_context():
+                return call()
+
+        max_workers = min(self.max_concurrency, len(calls))
+        with ThreadPoolExecutor(max_workers, thread_name_prefix="conduit") as executor:
+            futures = [executor.submit(run, call) for call in calls]
+            return [future.result() for future in futures]
+
+    @staticmethod
+    def is_idempotent(method: str) -> bool:
+        """Return `True` if the Conduit `method` is safe to retry."""
+        return method.endswith(".search") or method in IDEMPOTENT_CONDUIT_METHODS
+
     @staticmethod
     def create_session() -> requests.Session:
-        return requests.Session()
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=CONDUIT_POOL_SIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @classmethod
+    def shared_session(cls) -> requests.Session:
+        """Return the session shared by clients of this process.
+
+        A new session is created after forking, so that connections are not
+        shared between processes.
+        """
+        with cls._shared_session_lock:
+            if cls._shared_session is None or cls._shared_session_pid != os.getpid():
+                cls._shared_session = cls.create_session()
+                cls._shared_session_pid = os.getpid()
+
+            return cls._shared_session
 
     @classmethod
     def single(
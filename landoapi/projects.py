@@ -2,14 +2,23 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import logging
-from typing import Optional
-
-from landoapi.cache import DEFAULT_CACHE_KEY_TIMEOUT_SECONDS, cache
-from landoapi.phabricator import PhabricatorClient, result_list_to_phid_dict
+import os
+import threading
+import time
+from typing import Iterable, Optional
+
+from landoapi.cache import get_many_cached
+from landoapi.phabricator import (
+    PhabricatorClient,
+    PhabricatorCommunicationException,
+    result_list_to_phid_dict,
+)
 
 logger = logging.getLogger(__name__)
 
 
+PROJECT_PHID_PREFIX = "PHID-PROJ-"
+
 SEC_PROJ_SLUG = "secure-revision"
 CHECKIN_PROJ_SLUG = "check-in_needed"
 
@@ -36,32 +45,124 @@ RELMAN_PROJECT_SLUG = "release-managers"
 # The name of the Phabricator project used to tag revisions requiring data classification.
 NEEDS_DATA_CLASSIFICATION_SLUG = "needs-data-classification"
 
+# Slugs of the projects looked up when assessing and landing a stack.
+LANDING_PROJECT_SLUGS = (
+    SEC_PROJ_SLUG,
+    CHECKIN_PROJ_SLUG,
+    *TESTING_TAG_PROJ_SLUGS,
+    TESTING_POLICY_PROJ_SLUG,
+    SEC_APPROVAL_PROJECT_SLUG,
+    NEEDS_DATA_CLASSIFICATION_SLUG,
+)
+
+# Seconds for which a project PHID is kept in the process-local table.
+PROJECT_PHID_TTL_SECONDS = int(os.environ.get("PROJECT_PHID_TTL_SECONDS", 300))
+
+# Stands in for the PHID of projects which weren't found, so that lookups of
+# missing projects are cached too.
+_MISSING_PROJECT_PHID = ""
+
+# Process-local table mapping project slugs to their PHID and expiry time.
+_project_phids: dict[str, tuple[str, float]] = {}
+_project_phids_lock = threading.Lock()
+
 
 def project_search(
     phabricator: PhabricatorClient, project_phids: list[str]
 ) -> dict[str, dict]:
     """Return a dictionary mapping phid to project data from a project.search.
 
+    Projects are cached individually, and only those missing from the cache are
+    searched for. PHIDs of other types of objects are ignored.
+
     Args:
         phabricator: A PhabricatorClient instance.
         project_phids: A list of project phids to search.
     """
-    if not project_phids:
-        return {}
 
-    project_phids = list(project_phids)
-    project_phids.sort()
-    cache_key = ",".join(project_phids)
+    def search(phids: list[str]) -> dict[str, dict]:
+        projects = phabricator.call_conduit(
+            "project.search", constraints={"phids": sorted(phids)}
+        )
+        return result_list_to_phid_dict(phabricator.expect(projects, "data"))
 
-    if cache.has(cache_key):
-        return cache.get(cache_key)
-
-    projects = phabricator.call_conduit(
-        "project.search", constraints={"phids": project_phids}
+    return get_many_cached(
+        "project_",
+        (phid for phid in project_phids if phid.startswith(PROJECT_PHID_PREFIX)),
+        search,
     )
-    result = result_list_to_phid_dict(phabricator.expect(projects, "data"))
-    cache.set(cache_key, result, timeout=DEFAULT_CACHE_KEY_TIMEOUT_SECONDS)
-    return result
+
+
+def clear_project_phids():
+    """Clear the process-local table of project PHIDs."""
+    with _project_phids_lock:
+        _project_phids.clear()
+
+
+def get_project_phids(
+    project_slugs: Iterable[str], phabricator: PhabricatorClient
+) -> dict[str, Optional[str]]:
+    """Looks up the PHIDs of projects by slug.
+
+    PHIDs are looked up in a process-local table first, then in the cache with
+    a single multi-get. The remaining slugs are resolved with a single
+    `project.search`. Projects which weren't found are remembered as missing in
+    both the table and the cache, like found ones.
+
+    Args:
+        project_slugs: The names of the projects we want the PHIDs for.
+        phabricator: A PhabricatorClient instance.
+
+    Returns:
+        A dictionary mapping each slug to its project's PHID, or None if the
+        project isn't found.
+    """
+    slugs = list(dict.fromkeys(project_slugs))
+    now = time.monotonic()
+    with _project_phids_lock:
+        phids = {
+            slug: entry[0]
+            for slug in slugs
+            if (entry := _project_phids.get(slug)) and entry[1] > now
+        }
+
+    def search(slugs: list[str]) -> dict[str, str]:
+        result = phabricator.call_conduit(
+            "project.search", constraints={"slugs": sorted(slugs)}
+        )
+        found = {
+            phabricator.expect(project, "fields", "slug"): phabricator.expect(
+                project, "phid"
+            )
+            for project in phabricator.expect(result, "data")
+        }
+        # Projects may also have been found by one of their other slugs.
+        slug_map = result.get("maps", {}).get("slugMap") or {}
+        for slug, entry in slug_map.items():
+            found[slug] = phabricator.expect(entry, "projectPHID")
+
+        return {slug: found.get(slug, _MISSING_PROJECT_PHID) for slug in slugs}
+
+    missing = [slug for slug in slugs if slug not in phids]
+    if missing:
+        fetched = get_many_cached("PROJECT_", missing, search)
+        phids.update(fetched)
+
+        expiry = now + PROJECT_PHID_TTL_SECONDS
+        with _project_phids_lock:
+            _project_phids.update(
+                {slug: (phid, expiry) for slug, phid in fetched.items()}
+            )
+
+    return {slug: phids.get(slug) or None for slug in slugs}
+
+
+def prefetch_landing_project_phids(phabricator: PhabricatorClient):
+    """Resolve the PHIDs of all `LANDING_PROJECT_SLUGS` at once.
+
+    Later lookups of these projects are then served from the process-local table.
+    """
+    get_project_phids(LANDING_PROJECT_SLUGS, phabricator)
 
 
 def get_project_phid(
@@ -82,20 +183,12 @@ def get_project_phid(
     Returns:
         A string with the project's PHID or None if the project isn't found.
     """
-    key = f"PROJECT_{project_slug}"
-    if cache.has(key):
-        return cache.get(key)
-
-    project = phabricator.single(
-        phabricator.call_conduit(
-            "project.search", constraints={"slugs": [project_slug]}
-        ),
-        "data",
-        none_when_empty=allow_empty_result,
-    )
+    value = get_project_phids([project_slug], phabricator)[project_slug]
+    if value is None and not allow_empty_result:
+        raise PhabricatorCommunicationException(
+            f"Phabricator project {project_slug} could not be found"
+        )
 
-    value = phabricator.expect(project, "phid") if project else None
-    cache.set(key, value, timeout=DEFAULT_CACHE_KEY_TIMEOUT_SECONDS)
     return value
 
 
@@ -118,8 +211,8 @@ def get_testing_tag_project_phids(
     phabricator: PhabricatorClient,
 ) -> Optional[list[str]]:
     """Return phids for the testing tag projects."""
-    tags = [get_project_phid(slug, phabricator) for slug in TESTING_TAG_PROJ_SLUGS]
-    return [t for t in tags if t is not None]
+    tags = get_project_phids(TESTING_TAG_PROJ_SLUGS, phabricator)
+    return [t for t in tags.values() if t is not None]
 
 
 def get_sec_approval_project_phid(phabricator: PhabricatorClient) -> Optional[str]:
@@ -5,13 +5,17 @@
 from __future__ import annotations
 
 import logging
+import os
 import pathlib
+import time
 import urllib
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import (
     dataclass,
     field,
 )
+from datetime import datetime, timezone
 from typing import Optional
 
 from landoapi.systems import Subsystem
@@ -300,9 +304,46 @@ def get_repos_for_env(env: str) -> dict[str, Repo]:
     return REPO_CONFIG.get(env, {})
 
 
+# Number of times preparing a repository is attempted before giving up.
+REPO_PREPARATION_ATTEMPTS = 5
+
+# Suffixes of the hg and cinnabar bundle snapshots of a repository.
+HG_BUNDLE_SUFFIX = ".hg"
+CINNABAR_BUNDLE_SUFFIX = ".git"
+
+
+def repo_bundles(
+    bundles_path: pathlib.Path, name: str, suffix: str
+) -> list[pathlib.Path]:
+    """Return the snapshots of repository `name` with `suffix`, oldest first.
+
+    Snapshots are stored as `<bundles_path>/<name>/<timestamp><suffix>`. Snapshots
+    that are still being written start with a `.` and are ignored.
+    """
+    repo_path = bundles_path / name
+    if not repo_path.is_dir():
+        return []
+
+    return sorted(
+        path
+        for path in repo_path.iterdir()
+        if path.name.endswith(suffix) and not path.name.startswith(".")
+    )
+
+
 class RepoCloneSubsystem(Subsystem):
+    """Clone and update the repositories to land to.
+
+    Repositories are prepared concurrently in the background, and each becomes
+    available for landing (i.e. appears in `repo_paths`) as soon as it is ready.
+    """
+
     name = "repo_clone"
 
+    # Repositories that are not ready for landing, e.g. because they are still
+    # being cloned.
+    unprepared_repos = frozenset()
+
     def ready(self) -> Optional[bool | str]:
         clones_path = self.flask_app.config["REPO_CLONES_PATH"]
         repo_names = self.flask_app.config["REPOS_TO_LAND"]
@@ -330,38 +371,147 @@ class RepoCloneSubsystem(Subsystem):
 
         self.repos = {name: repos[name] for name in repo_names}
         self.repo_paths = {}
+        self.unprepared_repos = set(self.repos)
+
+        self.preparation_executor = ThreadPoolExecutor(
+            max_workers=int(self.flask_app.config.get("REPO_PREPARATION_WORKERS") or 4),
+            thread_name_prefix="repo-preparation",
+        )
+        for name in sorted(self.repos):
+            self.preparation_executor.submit(
+                self.prepare_repo, name, clones_path.joinpath(name)
+            )
+        self.preparation_executor.shutdown(wait=False)
+
+        return True
 
+    def prepare_repo(self, name: str, path: pathlib.Path):
+        """Clone or update the repository `name` at `path`, retrying on failure."""
+        for attempt in range(REPO_PREPARATION_ATTEMPTS):
+            try:
+                self._prepare_repo(name, path)
+                break
+            except Exception:
+                logger.exception("Failed to prepare repo.", extra={"repo": name})
+                time.sleep(1 + attempt)
+        else:
+            logger.error("Giving up preparing repo.", extra={"repo": name})
+            return
+
+        self.repo_paths[name] = path
+        self.unprepared_repos.discard(name)
+        logger.info("Repo ready.", extra={"repo": name})
+
+    def _prepare_repo(self, name: str, path: pathlib.Path):
         from landoapi.hg import HgRepo
 
-        for name, repo in self.repos.items():
-            path = clones_path.joinpath(name)
-            hgrepo = HgRepo(str(path), native_git_source=repo.native_git_source)
+        repo = self.repos[name]
+        hgrepo = HgRepo(str(path), native_git_source=repo.native_git_source)
+
+        if path.exists():
+            logger.info("Repo exists, pulling.", extra={"repo": name})
+            with hgrepo.for_pull():
+                hgrepo.update_repo(repo.pull_path)
+        else:
+            bundle = self.latest_bundle(name, HG_BUNDLE_SUFFIX)
+            logger.info("Cloning repo.", extra={"repo": name, "bundle": bundle})
+            hgrepo.clone(repo.pull_path, bundle=bundle)
+
+        # Handle cinnabar cloning/updating.
+        if hgrepo.cinnabar_path and hgrepo.cinnabar_path.exists():
+            logger.info("Cinnabar repo exists, fetching.", extra={"repo": name})
+            with hgrepo.for_pull():
+                hgrepo.update_cinnabar_repo(repo.pull_path)
+        elif hgrepo.cinnabar_path:
+            bundle = self.latest_bundle(name, CINNABAR_BUNDLE_SUFFIX)
+            logger.info(
+                "Cloning cinnabar repo.", extra={"repo": name, "bundle": bundle}
+            )
+            with hgrepo.for_pull():
+                hgrepo.clone_cinnabar(repo.pull_path, bundle=bundle)
 
-            if path.exists():
-                logger.info("Repo exists, pulling.", extra={"repo": name})
-                with hgrepo.for_pull():
-                    hgrepo.update_repo(repo.pull_path)
-            else:
-                logger.info("Cloning repo.", extra={"repo": name})
-                hgrepo.clone(repo.pull_path)
+        # Ensure packages required for automated code formatting are installed.
+        if repo.autoformat_enabled:
+            with hgrepo.for_pull():
+                hgrepo.ensure_mach_bootstrap(path.with_name(f"{name}.bootstrap.json"))
 
-            # Handle cinnabar cloning/updating.
-            if hgrepo.cinnabar_path and hgrepo.cinnabar_path.exists():
-                logger.info("Cinnabar repo exists, fetching.", extra={"repo": name})
-                with hgrepo.for_pull():
-                    hgrepo.update_cinnabar_repo(repo.pull_path)
-            elif hgrepo.cinnabar_path:
-                logger.info("Cloning cinnabar repo.", extra={"repo": name})
-                hgrepo.clone_cinnabar(repo.pull_path)
+    @property
+    def bundles_path(self) -> Optional[pathlib.Path]:
+        """Return the directory holding repository snapshots, if configured."""
+        bundles_path = self.flask_app.config.get("REPO_BUNDLES_PATH")
+        return pathlib.Path(bundles_path) if bundles_path else None
+
+    def latest_bundle(self, name: str, suffix: str) -> Optional[pathlib.Path]:
+        """Return the newest snapshot of repository `name` with `suffix`, if any."""
+        if not self.bundles_path:
+            return None
 
-            # Ensure packages required for automated code formatting are installed.
-            if repo.autoformat_enabled:
-                hgrepo.run_mach_bootstrap()
+        bundles = repo_bundles(self.bundles_path, name, suffix)
+        return bundles[-1] if bundles else None
 
-            logger.info("Repo ready.", extra={"repo": name})
-            self.repo_paths[name] = path
+    def create_bundles(self, keep: int = 2):
+        """Snapshot the repository clones to `bundles_path`.
 
-        return True
+        An hg stream bundle is created for each existing clone of `REPOS_TO_LAND`,
+        along with a bundle of its cinnabar clone if it has one. Only the newest
+        `keep` snapshots of each repository are kept.
+
+        The clones are only read from, they are not prepared, pulled or cleaned, as
+        landing workers may be using them at the same time.
+        """
+        from landoapi.hg import HgRepo
+
+        clones_path = pathlib.Path(self.flask_app.config["REPO_CLONES_PATH"])
+        repos = get_repos_for_env(self.flask_app.config.get("ENVIRONMENT"))
+        repo_names = {
+            name.strip() for name in self.flask_app.config["REPOS_TO_LAND"].split(",")
+        }
+
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        for name in sorted(repo_names.intersection(repos)):
+            path = clones_path / name
+            if not (path / ".hg").is_dir():
+                logger.warning("No repo clone to bundle.", extra={"repo": name})
+                continue
+
+            hgrepo = HgRepo(str(path), native_git_source=repos[name].native_git_source)
+            snapshots_path = self.bundles_path / name
+            snapshots_path.mkdir(parents=True, exist_ok=True)
+
+            snapshots = [(HG_BUNDLE_SUFFIX, hgrepo.create_bundle)]
+            if hgrepo.cinnabar_path and hgrepo.cinnabar_path.exists():
+                snapshots.append(
+                    (CINNABAR_BUNDLE_SUFFIX, hgrepo.create_cinnabar_bundle)
+                )
+
+            with hgrepo.for_reading():
+                for suffix, create_bundle in snapshots:
+                    # Write to a hidden file first so a partial bundle is never used.
+                    bundle = snapshots_path / f"{timestamp}{suffix}"
+                    partial_bundle = snapshots_path / f".{bundle.name}"
+                    create_bundle(partial_bundle)
+                    os.replace(partial_bundle, bundle)
+                    logger.info(
+                        "Created repo bundle.", extra={"repo": name, "bundle": bundle}
+                    )
+
+                    bundles = repo_bundles(self.bundles_path, name, suffix)
+                    for old_bundle in bundles[:-keep]:
+                        old_bundle.unlink()
+
+    def is_prepared(self, name: str) -> bool:
+        """Return `True` if the repository `name` is ready for landing."""
+        return name not in self.unprepared_repos
+
+    def join_preparation(self):
+        """Wait until all repositories are prepared and the preparation threads exited.
+
+        Processes must not be forked while preparation threads are running, as the
+        child processes could inherit locks held by those threads.
+        """
+        executor = getattr(self, "preparation_executor", None)
+        if executor is not None:
+            executor.shutdown(wait=True)
 
 
 repo_clone_subsystem = RepoCloneSubsystem()
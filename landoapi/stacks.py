@@ -69,11 +69,19 @@ def request_extended_revision_data(
     if not revision_phids:
         return RevisionData({}, {}, {})
 
-    revs = phab.call_conduit(
-        "differential.revision.search",
-        constraints={"phids": revision_phids},
-        attachments={"reviewers": True, "reviewers-extra": True, "projects": True},
-        limit=len(revision_phids),
+    # Revisions and their diffs are independent, fetch them concurrently.
+    revs, diffs = phab.run_concurrently(
+        lambda: phab.call_conduit(
+            "differential.revision.search",
+            constraints={"phids": revision_phids},
+            attachments={"reviewers": True, "reviewers-extra": True, "projects": True},
+            limit=len(revision_phids),
+        ),
+        lambda: phab.call_conduit(
+            "differential.diff.search",
+            constraints={"revisionPHIDs": revision_phids},
+            attachments={"commits": True},
+        ),
     )
 
     if len(revs["data"]) != len(revision_phids):
@@ -82,11 +90,6 @@ def request_extended_revision_data(
     phab.expect(revs, "data", len(revision_phids) - 1)
     revs = result_list_to_phid_dict(phab.expect(revs, "data"))
 
-    diffs = phab.call_conduit(
-        "differential.diff.search",
-        constraints={"revisionPHIDs": revision_phids},
-        attachments={"commits": True},
-    )
     phab.expect(diffs, "data", len(revision_phids) - 1)
     diffs = result_list_to_phid_dict(phab.expect(diffs, "data"))
 
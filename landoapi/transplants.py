@@ -1036,18 +1036,24 @@ def get_parsed_diffs(
     phab: PhabricatorClient, stack_data: RevisionData
 ) -> dict[int, dict]:
     """Return a mapping of diff PHID to `rs-parsepatch` parsed `diff --git` content."""
-    raw_diffs = {}
-
     # Get the latest diffs for each revision.
     latest_diffs = [
         stack_data.diffs[phab.expect(revision, "fields", "diffPHID")]
         for revision in stack_data.revisions.values()
     ]
-
-    for diff in latest_diffs:
-        diff_id = phab.expect(diff, "id")
-
-        raw_diffs[diff_id] = get_raw_diff_by_id(phab, diff_id)
+    diff_ids = [phab.expect(diff, "id") for diff in latest_diffs]
+
+    raw_diffs = dict(
+        zip(
+            diff_ids,
+            phab.run_concurrently(
+                *(
+                    functools.partial(get_raw_diff_by_id, phab, diff_id)
+                    for diff_id in diff_ids
+                )
+            ),
+        )
+    )
 
     return {
         diff_id: rs_parsepatch.get_diffs(diff) for diff_id, diff in raw_diffs.items()
@@ -1066,9 +1072,6 @@ def build_stack_assessment_state(
     """Given the required state information for a stack, build a `StackAssessmentState`"""
     landable_repos = get_landable_repos_for_revision_data(stack_data, supported_repos)
 
-    # Retrieve and parse diffs from Phabricator.
-    parsed_diffs = get_parsed_diffs(phab, stack_data)
-
     involved_phids = set()
     reviewers = {}
     for revision in stack_data.revisions.values():
@@ -1076,15 +1079,24 @@ def build_stack_assessment_state(
         involved_phids.update(gather_involved_phids(revision, revision_diffs))
         reviewers[revision["phid"]] = get_collated_reviewers(revision)
 
-    # Get more Phabricator data.
+    # Retrieve and parse diffs, and get more Phabricator data.
     involved_phids = list(involved_phids)
 
-    users = user_search(phab, involved_phids)
-    projects = project_search(phab, involved_phids)
-
-    secure_project_phid = get_secure_project_phid(phab)
-    testing_tag_project_phids = get_testing_tag_project_phids(phab)
-    testing_policy_phid = get_testing_policy_phid(phab)
+    (
+        parsed_diffs,
+        users,
+        projects,
+        secure_project_phid,
+        testing_tag_project_phids,
+        testing_policy_phid,
+    ) = phab.run_concurrently(
+        lambda: get_parsed_diffs(phab, stack_data),
+        lambda: user_search(phab, involved_phids),
+        lambda: project_search(phab, involved_phids),
+        lambda: get_secure_project_phid(phab),
+        lambda: get_testing_tag_project_phids(phab),
+        lambda: get_testing_policy_phid(phab),
+    )
 
     stack_state = StackAssessmentState.from_assessment(
         phab=phab,
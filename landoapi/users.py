@@ -2,18 +2,32 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from landoapi.cache import get_many_cached
 from landoapi.phabricator import result_list_to_phid_dict
 
+USER_PHID_PREFIX = "PHID-USER-"
+
 
 def user_search(phabricator, user_phids):
     """Return a dictionary mapping phid to user information from a user.search.
 
+    Users are cached individually, and only those missing from the cache are
+    searched for. PHIDs of other types of objects are ignored.
+
     Args:
         phabricator: A PhabricatorClient instance.
         user_phids: A list of user phids to search.
     """
-    if not user_phids:
-        return {}
 
-    users = phabricator.call_conduit("user.search", constraints={"phids": user_phids})
-    return result_list_to_phid_dict(phabricator.expect(users, "data"))
+    def search(phids):
+        # Sort the PHIDs so that searches for the same users are memoized.
+        users = phabricator.call_conduit(
+            "user.search", constraints={"phids": sorted(phids)}
+        )
+        return result_list_to_phid_dict(phabricator.expect(users, "data"))
+
+    return get_many_cached(
+        "user_",
+        (phid for phid in user_phids if phid.startswith(USER_PHID_PREFIX)),
+        search,
+    )
@@ -7,16 +7,88 @@ from __future__ import annotations
 import logging
 import os
 import re
+import select
+import socket
 import subprocess
+import time
 from time import sleep
+from typing import (
+    Iterable,
+    Optional,
+)
 
 from landoapi import treestatus
+from landoapi.metrics import Metric, MetricsExporter
 from landoapi.models.configuration import ConfigurationKey, ConfigurationVariable
 from landoapi.repos import repo_clone_subsystem
+from landoapi.storage import db
 
 logger = logging.getLogger(__name__)
 
 
+class NotificationListener:
+    """Listen for notifications on a Postgres channel.
+
+    A dedicated connection is used for listening, as notifications are only delivered
+    to connections that are not inside a transaction.
+    """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.connection = None
+
+    def connect(self):
+        """Open a dedicated connection and start listening on the channel."""
+        connection = db.engine.raw_connection()
+
+        # Detach the connection from the pool, it is never returned to it.
+        connection.detach()
+        connection.connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}";')
+
+        self.connection = connection
+        logger.info(f"Listening for notifications on {self.channel}.")
+
+    def close(self):
+        """Close the listening connection."""
+        if self.connection is None:
+            return
+
+        try:
+            self.connection.close()
+        except Exception as e:
+            logger.exception(e)
+        self.connection = None
+
+    def wait(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for a notification.
+
+        Returns `True` if a notification was received, `False` otherwise.
+
+        Raises:
+            Exception: If listening on the channel failed.
+        """
+        if self.connection is None:
+            self.connect()
+
+        dbapi_connection = self.connection.connection
+        try:
+            dbapi_connection.poll()
+            if not dbapi_connection.notifies:
+                readable, _, _ = select.select([dbapi_connection], [], [], timeout)
+                if readable:
+                    dbapi_connection.poll()
+        except Exception:
+            # The connection is unusable, reconnect on the next wait.
+            self.close()
+            raise
+
+        received = bool(dbapi_connection.notifies)
+        dbapi_connection.notifies.clear()
+        return received
+
+
 class Worker:
     """A base class for repository workers."""
 
@@ -30,29 +102,73 @@ class Worker:
         """Return the configuration key that prevents the worker from starting."""
         raise NotImplementedError()
 
+    @property
+    def NOTIFY_CHANNEL(self) -> Optional[str]:
+        """Return the Postgres channel on which the worker is notified of work."""
+        return None
+
     @property
     def PAUSE_KEY(self) -> ConfigurationKey:
         """Return the configuration key that pauses the worker."""
         raise NotImplementedError()
 
-    def __init__(self, sleep_seconds: float = 5, with_ssh: bool = True):
+    def __init__(
+        self,
+        sleep_seconds: float = 5,
+        with_ssh: bool = True,
+        repositories: Optional[Iterable[str]] = None,
+        metrics_port: Optional[int] = None,
+    ):
         SSH_PRIVATE_KEY_ENV_KEY = "SSH_PRIVATE_KEY"
 
+        # Identifies this worker process, e.g. on the jobs it claims.
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+
         # `sleep_seconds` is how long to sleep for if the worker is paused,
         # before checking if the worker is still paused.
         self.sleep_seconds = sleep_seconds
 
-        # The list of all repos that are enabled for this worker
-        self.applicable_repos = (
+        # The list of all repos assigned to this worker.
+        self.assigned_repos = (
             list(repo_clone_subsystem.repos)
             if hasattr(repo_clone_subsystem, "repos")
             else []
         )
 
+        # Restrict the worker to a subset of the repos, if requested. This is used
+        # when running a worker process per repository (or group of repositories).
+        if repositories is not None:
+            repositories = set(repositories)
+            unknown_repos = repositories - set(self.assigned_repos)
+            if unknown_repos:
+                logger.warning(
+                    f"Ignoring repositories that are not cloned: {unknown_repos}"
+                )
+            self.assigned_repos = [r for r in self.assigned_repos if r in repositories]
+
+        # The list of assigned repos that are ready for landing; grows as repos are
+        # prepared via `self.refresh_applicable_repos`.
+        self.applicable_repos = []
+        self.refresh_applicable_repos()
+
         # The list of all repos that have open trees; refreshed when needed via
         # `self.refresh_enabled_repos`.
         self.enabled_repos = []
 
+        # Listener for `NOTIFY_CHANNEL`, connected when the worker first waits.
+        self.listener = (
+            NotificationListener(self.NOTIFY_CHANNEL) if self.NOTIFY_CHANNEL else None
+        )
+
+        # Port on which the worker metrics are served, if any. See `self.metrics`.
+        self.metrics_port = metrics_port
+        self.exporter = None
+
+        # Counters for the main event loop, exposed as metrics.
+        self.started_at = None
+        self.loops = 0
+        self.last_loop_at = None
+
         if with_ssh:
             # Fetch ssh private key from the environment. Note that this key should be
             # stored in standard format including all new lines and new line at the end
@@ -125,14 +241,18 @@ class Worker:
         # NOTE: The worker will exit when max_loops is reached, or when the stop
         # variable is changed to True.
         loops = 0
+        self.started_at = time.time()
         while self._running:
             if max_loops is not None and loops >= max_loops:
                 break
             while self._paused:
                 # Wait a set number of seconds before checking paused variable again.
                 self.throttle(self.sleep_seconds)
+            self.refresh_applicable_repos()
             self.loop(*args, **kwargs)
             loops += 1
+            self.loops += 1
+            self.last_loop_at = time.time()
 
         logger.info(f"{self} exited after {loops} loops.")
 
@@ -145,6 +265,35 @@ class Worker:
         """Sleep for a given number of seconds."""
         sleep(seconds if seconds is not None else self.throttle_seconds)
 
+    def wait_for_work(self, timeout: float) -> bool:
+        """Wait until the worker is notified of new work or `timeout` seconds pass.
+
+        Falls back to sleeping for at most `sleep_seconds` if the worker has no
+        notification channel, or if listening on the channel fails.
+
+        Returns `True` if a notification was received, `False` otherwise.
+        """
+        if self.listener is not None:
+            try:
+                return self.listener.wait(timeout)
+            except Exception as e:
+                logger.exception(f"Could not listen on {self.NOTIFY_CHANNEL}: {e}")
+
+        self.throttle(min(timeout, self.sleep_seconds))
+        return False
+
+    def refresh_applicable_repos(self):
+        """Add assigned repos that finished preparing to the applicable repos."""
+        if len(self.applicable_repos) == len(self.assigned_repos):
+            return
+
+        applicable_repos = [
+            r for r in self.assigned_repos if repo_clone_subsystem.is_prepared(r)
+        ]
+        if len(applicable_repos) != len(self.applicable_repos):
+            logger.info(f"{len(applicable_repos)} applicable repos: {applicable_repos}")
+            self.applicable_repos = applicable_repos
+
     def refresh_enabled_repos(self):
         """Refresh the list of repositories based on treestatus."""
         self.enabled_repos = [
@@ -160,7 +309,55 @@ class Worker:
             logger.warning(f"{self.STOP_KEY} set to True, will not start worker.")
             return
         self._setup()
-        self._start(max_loops=max_loops)
+        if self.metrics_port is not None:
+            self.exporter = MetricsExporter(self.metrics_port, self.metrics)
+            self.exporter.start()
+
+        try:
+            self._start(max_loops=max_loops)
+        finally:
+            if self.exporter is not None:
+                self.exporter.stop()
+                self.exporter = None
+
+    def metrics(self) -> list[Metric]:
+        """Return metrics describing the health of the worker.
+
+        These are served by the worker's `MetricsExporter` and must not query the
+        database, so that scraping does not add load to it.
+        """
+        labels = {"worker": self.worker_id, "worker_class": self.__class__.__name__}
+
+        loops = Metric(
+            "lando_worker_loops_total", "counter", "Iterations of the event loop."
+        )
+        loops.add(self.loops, **labels)
+
+        started = Metric(
+            "lando_worker_start_time_seconds",
+            "gauge",
+            "When the worker started its event loop, as a Unix timestamp.",
+        )
+        if self.started_at is not None:
+            started.add(self.started_at, **labels)
+
+        last_loop = Metric(
+            "lando_worker_last_loop_time_seconds",
+            "gauge",
+            "When the worker last completed an event loop, as a Unix timestamp.",
+        )
+        if self.last_loop_at is not None:
+            last_loop.add(self.last_loop_at, **labels)
+
+        enabled = Metric(
+            "lando_worker_enabled_repositories",
+            "gauge",
+            "Number of repositories the worker is processing, out of those assigned.",
+        )
+        enabled.add(len(self.enabled_repos), state="enabled", **labels)
+        enabled.add(len(self.applicable_repos), state="applicable", **labels)
+
+        return [loops, started, last_loop, enabled]
 
     def loop(self, *args, **kwargs):
         """The main event loop."""
@@ -4,14 +4,22 @@
 from __future__ import annotations
 
 import logging
+import random
 import re
-from contextlib import contextmanager
-from datetime import datetime
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 from io import StringIO
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
 
 import kombu
+from datadog import statsd
+from sqlalchemy.engine import Engine
 
 from landoapi import treestatus
 from landoapi.commit_message import parse_bugs
@@ -28,8 +36,15 @@ from landoapi.hg import (
     TreeApprovalRequired,
     TreeClosed,
 )
-from landoapi.models.configuration import ConfigurationKey
-from landoapi.models.landing_job import LandingJob, LandingJobAction, LandingJobStatus
+from landoapi.metrics import Metric
+from landoapi.models.configuration import ConfigurationKey, ConfigurationVariable
+from landoapi.models.landing_job import (
+    DEFAULT_LEASE_SECONDS,
+    LANDING_JOB_NOTIFY_CHANNEL,
+    LandingJob,
+    LandingJobAction,
+    LandingJobStatus,
+)
 from landoapi.notifications import (
     notify_user_of_bug_update_failure,
     notify_user_of_landing_failure,
@@ -47,25 +62,176 @@ from landoapi.workers.base import Worker
 
 logger = logging.getLogger(__name__)
 
+# The longest time an idle worker waits for a notification before checking the
+# queue again. Workers are notified when jobs are submitted or change state, so
+# this is only a fallback.
+IDLE_TIMEOUT_SECONDS = 60
+
+# Errors encountered while pushing that are expected to go away when retrying.
+TEMPORARY_PUSH_ERRORS = (
+    TreeClosed,
+    TreeApprovalRequired,
+    LostPushRace,
+    PushTimeoutException,
+    HgmoInternalServerError,
+)
+
+# The delay in seconds before the first retry of a deferred job and the longest
+# delay between retries, by the cause of the deferral. The delay doubles with each
+# attempt up to the maximum.
+DEFER_BACKOFF_SECONDS = {
+    TreeClosed: (60, 15 * 60),
+    TreeApprovalRequired: (60, 15 * 60),
+    LostPushRace: (5, 60),
+    PushTimeoutException: (30, 10 * 60),
+    HgmoInternalServerError: (30, 10 * 60),
+}
+DEFAULT_DEFER_BACKOFF_SECONDS = (30, 10 * 60)
+
+
+def defer_until(cause: type[Exception], attempts: int) -> datetime:
+    """Return the time before which a job deferred because of `cause` is not retried.
+
+    The delay grows exponentially with the number of `attempts` made so far, and is
+    jittered so that jobs deferred together are not all retried at once.
+    """
+    initial, maximum = DEFER_BACKOFF_SECONDS.get(cause, DEFAULT_DEFER_BACKOFF_SECONDS)
+    delay = min(initial * 2 ** max(attempts - 1, 0), maximum)
+    return datetime.now(timezone.utc) + timedelta(
+        seconds=random.uniform(delay / 2, delay)
+    )
+
+
+@contextmanager
+def timed_phase(jobs: list[LandingJob], phase: str, detail: Optional[str] = None):
+    """Record the time spent in `phase` on each of `jobs`.
+
+    If `detail` is set, the time is also recorded separately as `phase:detail`.
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        seconds = time.monotonic() - start
+        for job in jobs:
+            job.record_phase_timing(phase, seconds)
+            if detail:
+                job.record_phase_timing(f"{phase}:{detail}", seconds)
+        statsd.timing(
+            "lando-api.landing_worker.phase",
+            seconds * 1000,
+            tags=[f"phase:{phase}", f"repo:{jobs[0].repository_name}"],
+        )
+
+
+@dataclass
+class JobPreparation:
+    """A job whose patches are being applied ahead of time in a working copy."""
+
+    job_id: int
+    # The `(revision_id, diff_id)` of each revision that was applied.
+    diffs: list[tuple[int, int]]
+    hgrepo: HgRepo
+
+    # Resolves to the first changeset created for the job.
+    future: Future
+
+
+def prepare_job(hgrepo: HgRepo, source: str, base_node: str, patches: list[str]) -> str:
+    """Apply `patches` in `hgrepo` on top of `base_node`, which is pulled from `source`.
+
+    This runs in a background thread while the worker is pushing another job, so it
+    must not access the database. `hgrepo` is cloned from `source` if it does not
+    exist. Returns the node of the first changeset created.
+    """
+    if not Path(hgrepo.path).exists():
+        hgrepo.clone(source)
+
+    with hgrepo.for_preparation():
+        hgrepo.clean_repo()
+        hgrepo.run_hg(["pull", "-r", base_node, source])
+        hgrepo.run_hg(["update", "--clean", "-r", base_node])
+        for patch in patches:
+            hgrepo.apply_patch(StringIO(patch))
+
+        return hgrepo.run_hg(
+            ["log", "-r", f"roots(only(., {base_node}))", "-T", "{node}"]
+        ).decode("utf-8")
+
+
+class LeaseHeartbeat(threading.Thread):
+    """Periodically renew a worker's lease on a job while it is being processed.
+
+    Renewals use their own database connection, so they are not affected by the
+    state of the session used to process the job.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        job_id: int,
+        worker_id: str,
+        lease_seconds: int = DEFAULT_LEASE_SECONDS,
+    ):
+        super().__init__(name=f"lease-heartbeat-{job_id}", daemon=True)
+        self.engine = engine
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+
+    def run(self):
+        # Renew well before expiry so a failed renewal can be retried.
+        while not self.stopped.wait(self.lease_seconds / 3):
+            try:
+                with self.engine.begin() as connection:
+                    LandingJob.renew_leases(
+                        connection, [self.job_id], self.worker_id, self.lease_seconds
+                    )
+            except Exception as e:
+                logger.exception(f"Failed to renew lease on job {self.job_id}: {e}")
+
+    def stop(self):
+        """Stop renewing the lease and wait for the thread to exit."""
+        self.stopped.set()
+        self.join()
+
 
 @contextmanager
 def job_processing(worker: LandingWorker, job: LandingJob, db: SQLAlchemy):
     """Mutex-like context manager that manages job processing miscellany.
 
-    This context manager facilitates graceful worker shutdown, tracks the duration of
-    the current job, and commits changes to the DB at the very end.
+    This context manager facilitates graceful worker shutdown, keeps the worker's
+    lease on the job alive, tracks the duration of the current job and logs the
+    time spent in each phase, and commits changes to the DB at the very end.
 
     Args:
         worker: the landing worker that is processing jobs
         job: the job currently being processed
         db: active database session
     """
-    start_time = datetime.now()
+    start_time = time.monotonic()
+    heartbeat = LeaseHeartbeat(db.engine, job.id, worker.worker_id)
+    heartbeat.start()
     try:
         yield
     finally:
-        job.duration_seconds = (datetime.now() - start_time).seconds
-        db.session.commit()
+        seconds = time.monotonic() - start_time
+        job.duration_seconds = round(seconds)
+        job.record_phase_timing("total", seconds)
+        logger.info(
+            "Landing job phase timings",
+            extra={"id": job.id, "phase_timings": job.phase_timings},
+        )
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            # Only wait for the heartbeat once the session holds no locks that a
+            # renewal could be waiting on.
+            heartbeat.stop()
 
 
 class LandingWorker(Worker):
@@ -79,11 +245,29 @@ class LandingWorker(Worker):
         """Return the configuration key that pauses the worker."""
         return ConfigurationKey.LANDING_WORKER_PAUSED
 
+    @property
+    def NOTIFY_CHANNEL(self) -> str:
+        """Return the Postgres channel on which the worker is notified of jobs."""
+        return LANDING_JOB_NOTIFY_CHANNEL
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.last_job_finished = None
         self.refresh_enabled_repos()
 
+        # Processed jobs by whether they finished or need to be retried.
+        self.job_results = Counter()
+
+        # Applies the patches of the next job while the current job is pushing.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.preparation = None
+
+        # Working copies by path, their command servers are reused across jobs.
+        self.hgrepos = {}
+
+        # When each repository was last pulled while the worker was idle.
+        self.last_idle_pulls = {}
+
     def loop(self):
         logger.debug(
             f"{len(self.applicable_repos)} applicable repos: {self.applicable_repos}"
@@ -93,40 +277,382 @@ class LandingWorker(Worker):
         if len(self.enabled_repos) != len(self.applicable_repos):
             self.refresh_enabled_repos()
 
-        if self.last_job_finished is False:
-            logger.info("Last job did not complete, sleeping.")
-            self.throttle(self.sleep_seconds)
-            self.refresh_enabled_repos()
+        if not self.enabled_repos:
+            # An empty list of repositories would not filter the queue at all.
+            logger.info("No enabled repos, waiting.")
+            self.wait_for_job()
+            return
 
         job = LandingJob.next_job_for_update_query(
-            repositories=self.enabled_repos
+            repositories=self.enabled_repos, worker_id=self.worker_id
         ).first()
 
         if job is None:
-            db.session.commit()
-            self.throttle(self.sleep_seconds)
+            if not self.pull_idle_repos():
+                self.wait_for_job()
             return
 
-        with job_processing(self, job, db):
-            job.status = LandingJobStatus.IN_PROGRESS
-            job.attempts += 1
+        train = self.claim_train(job)
+
+        # Wait for any preparation to finish before using the working copies.
+        preparation = self.take_preparation(job)
+        if len(train) > 1:
+            preparation = None
+
+        with ExitStack() as stack:
+            for train_job in train:
+                if (
+                    train_job.status == LandingJobStatus.IN_PROGRESS
+                    and train_job.worker_id != self.worker_id
+                ):
+                    logger.warning(
+                        f"Reclaiming job {train_job.id} from {train_job.worker_id}, "
+                        "its lease expired."
+                    )
+                stack.enter_context(job_processing(self, train_job, db))
+                train_job.claim(self.worker_id)
 
             # Make sure the status and attempt count are updated in the database
             db.session.commit()
 
             repo = repo_clone_subsystem.repos[job.repository_name]
-            hgrepo = HgRepo(
-                str(repo_clone_subsystem.repo_paths[job.repository_name]),
+            if preparation:
+                hgrepo = preparation.hgrepo
+            else:
+                hgrepo = self.get_hgrepo(
+                    repo_clone_subsystem.repo_paths[job.repository_name],
+                    native_git_source=repo.native_git_source,
+                )
+
+            if len(train) == 1:
+                logger.info("Starting landing job", extra={"id": job.id})
+                self.last_job_finished = self.run_job(
+                    job,
+                    repo,
+                    hgrepo,
+                    preparation=preparation,
+                )
+                logger.info("Finished processing landing job", extra={"id": job.id})
+                self.job_results[self.last_job_finished] += 1
+            else:
+                job_ids = [train_job.id for train_job in train]
+                logger.info("Starting landing train", extra={"ids": job_ids})
+                self.last_job_finished = self.run_train(train, repo, hgrepo)
+                logger.info("Finished processing landing train", extra={"ids": job_ids})
+                self.job_results[self.last_job_finished] += len(train)
+
+    def _start(self, *args, **kwargs):
+        try:
+            super()._start(*args, **kwargs)
+        finally:
+            for hgrepo in self.hgrepos.values():
+                hgrepo.close()
+
+    def metrics(self) -> list[Metric]:
+        labels = {"worker": self.worker_id, "worker_class": self.__class__.__name__}
+
+        jobs = Metric(
+            "lando_landing_worker_jobs_total",
+            "counter",
+            "Landing jobs processed, by whether they finished or will be retried.",
+        )
+        jobs.add(self.job_results[True], result="finished", **labels)
+        jobs.add(self.job_results[False], result="retried", **labels)
+
+        pulls = Metric(
+            "lando_landing_worker_pulls_total",
+            "counter",
+            "Pulls from upstream, by whether they were performed or skipped.",
+        )
+        for hgrepo in list(self.hgrepos.values()):
+            # The worker thread may count a new result while metrics are exported.
+            for result, count in list(hgrepo.pulls.items()):
+                pulls.add(count, path=hgrepo.path, result=result, **labels)
+
+        return super().metrics() + [jobs, pulls]
+
+    def get_hgrepo(self, path: Path, native_git_source: Optional[str] = None) -> HgRepo:
+        """Return the working copy at `path`, keeping its command server running."""
+        if str(path) not in self.hgrepos:
+            self.hgrepos[str(path)] = HgRepo(
+                str(path), native_git_source=native_git_source, persistent=True
+            )
+        return self.hgrepos[str(path)]
+
+    @property
+    def pipeline_enabled(self) -> bool:
+        """Whether to prepare the next job while the current job is pushing."""
+        return ConfigurationVariable.get(
+            ConfigurationKey.LANDING_WORKER_PIPELINE_ENABLED, False
+        )
+
+    def prepare_next_job(self, job: LandingJob, repo: Repo, hgrepo: HgRepo):
+        """Start applying the patches of the job queued after `job`, if any.
+
+        The patches are applied in a background thread, in a second working copy of
+        the repository, on top of the public changeset that `job` is based on. The
+        working copies are used alternately: the next job is landed from the working
+        copy it was prepared in, while the job after it is prepared in `hgrepo`.
+        """
+        if not self.pipeline_enabled or repo.force_push:
+            return
+
+        next_job = (
+            LandingJob.job_queue_query(repositories=[job.repository_name])
+            .filter(
+                LandingJob.id != job.id,
+                LandingJob.status != LandingJobStatus.IN_PROGRESS,
+            )
+            .first()
+        )
+        if next_job is None or next_job.target_commit_hash:
+            return
+
+        primary_path = repo_clone_subsystem.repo_paths[job.repository_name]
+        secondary_path = primary_path.with_name(f"{primary_path.name}-pipeline")
+        if Path(hgrepo.path) == secondary_path:
+            secondary = self.get_hgrepo(
+                primary_path, native_git_source=repo.native_git_source
+            )
+        else:
+            secondary = self.get_hgrepo(secondary_path)
+
+        base_node = hgrepo.run_hg(
+            ["log", "-r", "max(::. and public())", "-T", "{node}"]
+        ).decode("utf-8")
+        patches = [revision.patch_string for revision in next_job.revisions]
+
+        logger.info(
+            "Preparing next landing job",
+            extra={"id": next_job.id, "path": secondary.path},
+        )
+        self.preparation = JobPreparation(
+            job_id=next_job.id,
+            diffs=self.job_diffs(next_job),
+            hgrepo=secondary,
+            future=self.executor.submit(
+                prepare_job, secondary, hgrepo.path, base_node, patches
+            ),
+        )
+
+    @staticmethod
+    def job_diffs(job: LandingJob) -> list[tuple[int, int]]:
+        """Return the `(revision_id, diff_id)` of each revision of `job`."""
+        return [(revision.revision_id, revision.diff_id) for revision in job.revisions]
+
+    def take_preparation(self, job: LandingJob) -> Optional[JobPreparation]:
+        """Return the preparation for `job`, if the next job was prepared as `job`.
+
+        Waits for any running preparation to finish. Preparations for other jobs, or
+        for revisions that have since been updated, are discarded.
+        """
+        preparation, self.preparation = self.preparation, None
+        if preparation is None:
+            return None
+
+        try:
+            preparation.future.result()
+        except Exception as e:
+            logger.info(
+                "Preparing landing job failed, discarding.",
+                extra={"id": preparation.job_id},
+                exc_info=e,
+            )
+            return None
+
+        if preparation.job_id != job.id or preparation.diffs != self.job_diffs(job):
+            logger.info(
+                "Prepared landing job is not up next, discarding.",
+                extra={"id": preparation.job_id},
+            )
+            return None
+
+        return preparation
+
+    def finish_preparation(
+        self, job: LandingJob, repo: Repo, hgrepo: HgRepo, preparation: JobPreparation
+    ) -> bool:
+        """Rebase the prepared changesets of `job` onto the remote head.
+
+        Returns `False` if the prepared changesets can't be used, in which case the
+        job should be landed from scratch.
+        """
+        try:
+            with timed_phase([job], "pull"):
+                remote_head = hgrepo.get_remote_head(repo.pull_path)
+                hgrepo.pull_if_needed(repo.pull_path, remote_head)
+            with timed_phase([job], "rebase"):
+                hgrepo.rebase(preparation.future.result(), remote_head)
+        except Exception as e:
+            logger.info(
+                "Could not rebase prepared landing job, landing from scratch.",
+                extra={"id": job.id},
+                exc_info=e,
+            )
+            try:
+                hgrepo.run_hg(["rebase", "--abort"])
+            except Exception:
+                pass
+            return False
+
+        logger.info("Using prepared landing job", extra={"id": job.id})
+        return True
+
+    @property
+    def train_size(self) -> int:
+        """The maximum number of jobs to land together in a single push."""
+        return ConfigurationVariable.get(ConfigurationKey.LANDING_WORKER_TRAIN_SIZE, 1)
+
+    def claim_train(self, job: LandingJob) -> list[LandingJob]:
+        """Return `job` followed by the queued jobs that should be landed with it.
+
+        Jobs are only batched for repositories that are not force pushed and do not
+        run autoformatting, and only if they do not target a specific commit. The
+        push is attributed to a single user, so all jobs in a train must have the
+        same requester. The train ends at the first queued job that does not
+        qualify, so jobs never land ahead of their place in the queue.
+        """
+        train = [job]
+
+        repo = repo_clone_subsystem.repos[job.repository_name]
+        if (
+            self.train_size <= 1
+            or repo.force_push
+            or repo.autoformat_enabled
+            or job.target_commit_hash
+        ):
+            return train
+
+        candidates = (
+            LandingJob.next_job_for_update_query(
+                repositories=[job.repository_name], worker_id=self.worker_id
+            )
+            .filter(LandingJob.id != job.id)
+            .limit(self.train_size - 1)
+            .all()
+        )
+        for candidate in candidates:
+            if (
+                candidate.status == LandingJobStatus.IN_PROGRESS
+                or candidate.target_commit_hash
+                or candidate.requester_email != job.requester_email
+            ):
+                break
+            train.append(candidate)
+
+        return train
+
+    @property
+    def idle_pull_seconds(self) -> int:
+        """The minimum time between pulls of a repository while the worker is idle.
+
+        Idle pulls are disabled if this is 0.
+        """
+        return ConfigurationVariable.get(
+            ConfigurationKey.LANDING_WORKER_IDLE_PULL_SECONDS, 5 * 60
+        )
+
+    def job_is_waiting(self) -> bool:
+        """Return `True` if a queued job is ready to be processed."""
+        job = (
+            LandingJob.job_queue_query(repositories=self.enabled_repos)
+            .filter(LandingJob.status != LandingJobStatus.IN_PROGRESS)
+            .first()
+        )
+        db.session.commit()
+        return job is not None
+
+    def pull_idle_repos(self) -> bool:
+        """Pull the enabled repos from upstream while there are no jobs to process.
+
+        This moves most of the cost of pulling out of the landing of the next job.
+        Each repo is pulled at most once every `idle_pull_seconds`, and the cinnabar
+        repo is updated for repos with a `native_git_source`. Pulling stops as soon
+        as a job is ready to be processed.
+
+        Returns `True` if any repo was pulled, otherwise the worker should wait for
+        a job.
+
+        Working copies holding the prepared next job are skipped, as they may still
+        be in use by the preparation thread, and pulling would strip the prepared
+        changesets.
+        """
+        interval = self.idle_pull_seconds
+        if interval <= 0:
+            return False
+
+        # Don't keep the transaction open while pulling.
+        db.session.commit()
+
+        pulled = False
+        for name in self.enabled_repos:
+            last_pull = self.last_idle_pulls.get(name)
+            if last_pull is not None and time.monotonic() - last_pull < interval:
+                continue
+
+            if self.preparation and Path(self.preparation.hgrepo.path) == Path(
+                repo_clone_subsystem.repo_paths[name]
+            ):
+                logger.info(
+                    "Skipping idle pull of repo with a prepared job.",
+                    extra={"repo": name, "id": self.preparation.job_id},
+                )
+                continue
+
+            if pulled and self.job_is_waiting():
+                logger.info("Job is ready, interrupting idle pulls.")
+                break
+
+            self.last_idle_pulls[name] = time.monotonic()
+            pulled = True
+
+            repo = repo_clone_subsystem.repos[name]
+            hgrepo = self.get_hgrepo(
+                repo_clone_subsystem.repo_paths[name],
                 native_git_source=repo.native_git_source,
             )
+            logger.info("Pulling idle repo.", extra={"repo": name})
+            try:
+                with hgrepo.for_pull():
+                    hgrepo.pull_if_needed(
+                        repo.pull_path, hgrepo.get_remote_head(repo.pull_path)
+                    )
+
+                    if hgrepo.cinnabar_path and not self.job_is_waiting():
+                        hgrepo.update_cinnabar_repo(repo.pull_path)
+            except Exception as e:
+                logger.warning(
+                    "Could not pull idle repo.", extra={"repo": name}, exc_info=e
+                )
+
+        return pulled
 
-            logger.info("Starting landing job", extra={"id": job.id})
-            self.last_job_finished = self.run_job(
-                job,
-                repo,
-                hgrepo,
+    def wait_for_job(self):
+        """Wait until a job may be ready to be processed.
+
+        The wait ends early when a job is submitted or changes state, or when a
+        queued job leaves its grace period.
+        """
+        if len(self.enabled_repos) != len(self.applicable_repos) or len(
+            self.applicable_repos
+        ) < len(self.assigned_repos):
+            # Tree status changes and repos finishing preparation are not notified,
+            # check them regularly.
+            timeout = self.sleep_seconds
+        else:
+            timeout = IDLE_TIMEOUT_SECONDS
+
+        if self.enabled_repos:
+            seconds_until_eligible = LandingJob.seconds_until_next_eligible(
+                repositories=self.enabled_repos
             )
-            logger.info("Finished processing landing job", extra={"id": job.id})
+            if seconds_until_eligible is not None:
+                timeout = min(timeout, seconds_until_eligible)
+
+        # Don't keep the transaction open while idle.
+        db.session.commit()
+
+        self.wait_for_work(timeout)
 
     @staticmethod
     def notify_user_of_landing_failure(job: LandingJob):
@@ -151,45 +677,28 @@ class LandingWorker(Worker):
         failed_paths, reject_paths = self.extract_error_data(str(exception))
 
         # Find last commits to touch each failed path.
-        failed_path_changesets = [
-            (
-                path,
-                hgrepo.run_hg(
-                    [
-                        "log",
-                        "--cwd",
-                        hgrepo.path,
-                        "--template",
-                        "{node}",
-                        "-l",
-                        "1",
-                        path,
-                    ]
-                ),
-            )
-            for path in failed_paths
-        ]
+        changesets = hgrepo.last_changesets_for_paths(failed_paths)
 
         breakdown = {
             "revision_id": revision_id,
             "content": None,
-            "reject_paths": None,
+            "failed_paths": [],
+            "reject_paths": {},
         }
+        rejects_dir = REJECTS_PATH / hgrepo.path[1:]
+        for path in failed_paths:
+            breakdown["failed_paths"].append(
+                {
+                    "path": path,
+                    "url": f"{repo.pull_path}/file/{changesets[path]}/{path}",
+                    "changeset_id": changesets[path],
+                }
+            )
 
-        breakdown["failed_paths"] = [
-            {
-                "path": path[0],
-                "url": f"{repo.pull_path}/file/{path[1].decode('utf-8')}/{path[0]}",
-                "changeset_id": path[1].decode("utf-8"),
-            }
-            for path in failed_path_changesets
-        ]
-        breakdown["reject_paths"] = {}
         for path in reject_paths:
             reject = {"path": path}
             try:
-                with open(REJECTS_PATH / hgrepo.path[1:] / path, "r") as f:
-                    reject["content"] = f.read()
+                reject["content"] = (rejects_dir / path).read_text()
             except Exception as e:
                 logger.exception(e)
             # Use actual path of file to store reject data, by removing
@@ -247,11 +756,185 @@ class LandingWorker(Worker):
 
         return failed_paths, reject_paths
 
+    def transition_jobs(
+        self,
+        jobs: list[LandingJob],
+        action: LandingJobAction,
+        message: str,
+        notify: bool = False,
+        cause: Optional[type[Exception]] = None,
+    ):
+        """Apply `action` to each of `jobs`, optionally notifying their requesters.
+
+        Jobs deferred with a `cause` are backed off before being retried, see
+        `defer_until`.
+        """
+        for job in jobs:
+            kwargs = {"message": message}
+            if cause is not None and action == LandingJobAction.DEFER:
+                kwargs["not_before"] = defer_until(cause, job.attempts)
+            job.transition_status(action, commit=True, db=db, **kwargs)
+            if notify:
+                self.notify_user_of_landing_failure(job)
+
+    def update_repo(
+        self, jobs: list[LandingJob], repo: Repo, hgrepo: HgRepo
+    ) -> Optional[bool]:
+        """Update the local repo to prepare for applying the patches of `jobs`.
+
+        The repo is updated to the target commit of the first job.
+
+        Returns:
+            None: The repo was updated successfully.
+            Otherwise, the jobs have been transitioned and the value should be
+            returned from `run_job`.
+        """
+        job = jobs[0]
+        repo_pull_info = f"tree: {repo.tree}, pull path: {repo.pull_path}"
+        try:
+            target_cset = job.target_commit_hash
+            if hgrepo.cinnabar_path and job.target_commit_hash_vcs == "git":
+                with timed_phase(jobs, "cinnabar"):
+                    target_cset = hgrepo.convert_git_cset(repo.pull_path, target_cset)
+
+            with timed_phase(jobs, "pull"):
+                hgrepo.update_repo(repo.pull_path, target_cset=target_cset)
+        except HgmoInternalServerError as e:
+            message = (
+                f"`Temporary error ({e.__class__}) "
+                f"encountered while pulling from {repo_pull_info}"
+            )
+            logger.exception(message)
+            self.transition_jobs(
+                jobs, LandingJobAction.DEFER, message, cause=e.__class__
+            )
+
+            # Try again, this is a temporary failure.
+            return False
+        except CinnabarConversionError as e:
+            message = str(e)
+            logger.exception(message)
+
+            # After 5 attempts, consider this job a permanent failure.
+            status, is_permanent_failure = (
+                (LandingJobAction.DEFER, False)
+                if job.attempts < 5
+                else (LandingJobAction.FAIL, True)
+            )
+
+            self.transition_jobs(jobs, status, message, cause=e.__class__)
+
+            return is_permanent_failure
+
+        except Exception as e:
+            message = f"Unexpected error while fetching repo from {repo.pull_path}."
+            logger.exception(message)
+            self.transition_jobs(
+                jobs, LandingJobAction.FAIL, message + f"\n{e}", notify=True
+            )
+            return True
+
+    def apply_job_patches(self, job: LandingJob, repo: Repo, hgrepo: HgRepo) -> bool:
+        """Apply the patches of `job` to the repo one by one.
+
+        Returns `True` if all patches applied, otherwise the job has been failed
+        and `False` is returned.
+        """
+        for revision in job.revisions:
+            patch_buf = StringIO(revision.patch_string)
+            label = (
+                f"D{revision.revision_id}"
+                if revision.revision_id
+                else f"patch-{revision.id}"
+            )
+
+            try:
+                with timed_phase([job], "apply", label):
+                    hgrepo.apply_patch(patch_buf)
+            except PatchConflict as exc:
+                breakdown = self.process_merge_conflict(
+                    exc, repo, hgrepo, revision.revision_id
+                )
+                job.error_breakdown = breakdown
+
+                message = (
+                    f"Problem while applying patch in revision {revision.revision_id}:\n\n"
+                    f"{str(exc)}"
+                )
+                logger.exception(message)
+                self.transition_jobs([job], LandingJobAction.FAIL, message, notify=True)
+                return False
+            except NoDiffStartLine:
+                message = (
+                    "Lando encountered a malformed patch, please try again. "
+                    "If this error persists please file a bug: "
+                    "Patch without a diff start line."
+                )
+                logger.error(message)
+                self.transition_jobs([job], LandingJobAction.FAIL, message, notify=True)
+                return False
+            except Exception as e:
+                message = (
+                    f"Aborting, could not apply patch buffer for {revision.revision_id}."
+                    f"\n{e}"
+                )
+                logger.exception(message)
+                self.transition_jobs([job], LandingJobAction.FAIL, message, notify=True)
+                return False
+
+        return True
+
+    @staticmethod
+    def changeset_titles(hgrepo: HgRepo, revset: str) -> list[str]:
+        """Return the first line of the description of each changeset in `revset`."""
+        return (
+            hgrepo.run_hg(["log", "-r", revset, "-T", "{desc|firstline}\n"])
+            .decode("utf-8")
+            .splitlines()
+        )
+
+    @staticmethod
+    def current_node(hgrepo: HgRepo) -> str:
+        """Return the changeset hash of the working directory parent."""
+        return hgrepo.run_hg(["log", "-r", ".", "-T", "{node}"]).decode("utf-8")
+
+    def post_land_job(
+        self, job: LandingJob, repo: Repo, hgrepo: HgRepo, bug_ids: list[str]
+    ):
+        """Perform the follow-up steps for a job that has landed."""
+        mots_path = Path(hgrepo.path) / "mots.yaml"
+        if mots_path.exists():
+            logger.info(f"{mots_path} found, setting reviewer data.")
+            try:
+                job.set_landed_reviewers(mots_path)
+                db.session.commit()
+            except Exception as exc:
+                # Catch a wide exception here to work around bug 1936373.
+                logger.info(f"could not set reviewer data, continuing: {str(exc)}")
+        else:
+            logger.info(f"{mots_path} not found, skipping setting reviewer data.")
+
+        # Extra steps for post-uplift landings.
+        if repo.approval_required and bug_ids:
+            try:
+                # If we just landed an uplift, update the relevant bugs as appropriate.
+                update_bugs_for_uplift(
+                    repo.short_name,
+                    hgrepo.read_checkout_file("config/milestone.txt"),
+                    repo.milestone_tracking_flag_template,
+                    bug_ids,
+                )
+            except Exception as e:
+                # The changesets will have gone through even if updating the bugs fails. Notify
+                # the landing user so they are aware and can update the bugs themselves.
+                self.notify_user_of_bug_update_failure(job, e)
+
     def run_job(
         self,
         job: LandingJob,
         repo: Repo,
         hgrepo: HgRepo,
+        preparation: Optional[JobPreparation] = None,
     ) -> bool:
         """Run a given LandingJob and return appropriate boolean state.
 
@@ -262,125 +945,38 @@ class LandingWorker(Worker):
         - Perform additional processes and checks (e.g., code formatting).
         - Push changes to remote repo.
 
+        If the patches were applied ahead of time (see `prepare_next_job`), the
+        prepared changesets are rebased onto the latest changes instead of updating
+        the repo and applying the patches again.
+
         Returns:
             True: The job finished processing and is in a permanent state.
             False: The job encountered a temporary failure and should be tried again.
         """
         if not treestatus.is_open(repo.tree):
-            job.transition_status(
+            self.transition_jobs(
+                [job],
                 LandingJobAction.DEFER,
-                message=f"Tree {repo.tree} is closed - retrying later.",
-                commit=True,
-                db=db,
+                f"Tree {repo.tree} is closed - retrying later.",
+                cause=TreeClosed,
             )
             return False
 
         with hgrepo.for_push(job.requester_email):
-            # Update local repo.
-            repo_pull_info = f"tree: {repo.tree}, pull path: {repo.pull_path}"
-            try:
-                hgrepo.update_repo(
-                    repo.pull_path,
-                    target_cset=job.target_commit_hash,
-                    target_cset_vcs=job.target_commit_hash_vcs,
-                )
-            except HgmoInternalServerError as e:
-                message = (
-                    f"`Temporary error ({e.__class__}) "
-                    f"encountered while pulling from {repo_pull_info}"
-                )
-                logger.exception(message)
-                job.transition_status(
-                    LandingJobAction.DEFER, message=message, commit=True, db=db
-                )
-
-                # Try again, this is a temporary failure.
-                return False
-            except CinnabarConversionError as e:
-                message = str(e)
-                logger.exception(message)
-
-                # After 5 attempts, consider this job a permanent failure.
-                status, is_permanent_failure = (
-                    (LandingJobAction.DEFER, False)
-                    if job.attempts < 5
-                    else (LandingJobAction.FAIL, True)
-                )
-
-                job.transition_status(status, message=message, commit=True, db=db)
+            if not preparation or not self.finish_preparation(
+                job, repo, hgrepo, preparation
+            ):
+                # Update local repo.
+                result = self.update_repo([job], repo, hgrepo)
+                if result is not None:
+                    return result
 
-                return is_permanent_failure
-
-            except Exception as e:
-                message = f"Unexpected error while fetching repo from {repo.pull_path}."
-                logger.exception(message)
-                job.transition_status(
-                    LandingJobAction.FAIL,
-                    message=message + f"\n{e}",
-                    commit=True,
-                    db=db,
-                )
-                self.notify_user_of_landing_failure(job)
-                return True
-
-            # Run through the patches one by one and try to apply them.
-            for revision in job.revisions:
-                patch_buf = StringIO(revision.patch_string)
-
-                try:
-                    hgrepo.apply_patch(patch_buf)
-                except PatchConflict as exc:
-                    breakdown = self.process_merge_conflict(
-                        exc, repo, hgrepo, revision.revision_id
-                    )
-                    job.error_breakdown = breakdown
-
-                    message = (
-                        f"Problem while applying patch in revision {revision.revision_id}:\n\n"
-                        f"{str(exc)}"
-                    )
-                    logger.exception(message)
-                    job.transition_status(
-                        LandingJobAction.FAIL, message=message, commit=True, db=db
-                    )
-                    self.notify_user_of_landing_failure(job)
-                    return True
-                except NoDiffStartLine:
-                    message = (
-                        "Lando encountered a malformed patch, please try again. "
-                        "If this error persists please file a bug: "
-                        "Patch without a diff start line."
-                    )
-                    logger.error(message)
-                    job.transition_status(
-                        LandingJobAction.FAIL,
-                        message=message,
-                        commit=True,
-                        db=db,
-                    )
-                    self.notify_user_of_landing_failure(job)
-                    return True
-                except Exception as e:
-                    message = (
-                        f"Aborting, could not apply patch buffer for {revision.revision_id}."
-                        f"\n{e}"
-                    )
-                    logger.exception(message)
-                    job.transition_status(
-                        LandingJobAction.FAIL,
-                        message=message,
-                        commit=True,
-                        db=db,
-                    )
-                    self.notify_user_of_landing_failure(job)
+                # Run through the patches one by one and try to apply them.
+                if not self.apply_job_patches(job, repo, hgrepo):
                     return True
 
             # Get the changeset titles for the stack.
-            changeset_titles = (
-                hgrepo.run_hg(["log", "-r", "stack()", "-T", "{desc|firstline}\n"])
-                .decode("utf-8")
-                .splitlines()
-            )
+            changeset_titles = self.changeset_titles(hgrepo, "stack()")
 
             # Parse bug numbers from commits in the stack.
             bug_ids = [
@@ -390,7 +986,10 @@ class LandingWorker(Worker):
             # Run automated code formatters if enabled.
             if repo.autoformat_enabled:
                 try:
-                    replacements = hgrepo.format_stack(len(changeset_titles), bug_ids)
+                    with timed_phase([job], "format"):
+                        replacements = hgrepo.format_stack(
+                            len(changeset_titles), bug_ids
+                        )
 
                     # If autoformatting added any changesets, note those in the job.
                     if replacements:
@@ -412,31 +1011,30 @@ class LandingWorker(Worker):
                     return False
 
             # Get the changeset hash of the first node.
-            commit_id = hgrepo.run_hg(["log", "-r", ".", "-T", "{node}"]).decode(
-                "utf-8"
-            )
+            commit_id = self.current_node(hgrepo)
+
+            # Overlap applying the next job with pushing this one.
+            try:
+                self.prepare_next_job(job, repo, hgrepo)
+            except Exception:
+                logger.exception("Could not start preparing the next landing job.")
 
             repo_push_info = f"tree: {repo.tree}, push path: {repo.push_path}"
             try:
-                hgrepo.push(
-                    repo.push_path,
-                    bookmark=repo.push_bookmark or None,
-                    force_push=repo.force_push,
-                )
-            except (
-                TreeClosed,
-                TreeApprovalRequired,
-                LostPushRace,
-                PushTimeoutException,
-                HgmoInternalServerError,
-            ) as e:
+                with timed_phase([job], "push"):
+                    hgrepo.push(
+                        repo.push_path,
+                        bookmark=repo.push_bookmark or None,
+                        force_push=repo.force_push,
+                    )
+            except TEMPORARY_PUSH_ERRORS as e:
                 message = (
                     f"`Temporary error ({e.__class__}) "
                     f"encountered while pushing to {repo_push_info}"
                 )
                 logger.exception(message)
-                job.transition_status(
-                    LandingJobAction.DEFER, message=message, commit=True, db=db
+                self.transition_jobs(
+                    [job], LandingJobAction.DEFER, message, cause=e.__class__
                 )
                 return False  # Try again, this is a temporary failure.
             except Exception as e:
@@ -455,36 +1053,151 @@ class LandingWorker(Worker):
             LandingJobAction.LAND, commit_id=commit_id, commit=True, db=db
         )
 
-        mots_path = Path(hgrepo.path) / "mots.yaml"
-        if mots_path.exists():
-            logger.info(f"{mots_path} found, setting reviewer data.")
-            try:
-                job.set_landed_reviewers(mots_path)
-                db.session.commit()
-            except Exception as exc:
-                # Catch a wide exception here to work around bug 1936373.
-                logger.info(f"could not set reviewer data, continuing: {str(exc)}")
-        else:
-            logger.info(f"{mots_path} not found, skipping setting reviewer data.")
+        with timed_phase([job], "post_land"):
+            self.post_land_job(job, repo, hgrepo, bug_ids)
 
-        # Extra steps for post-uplift landings.
-        if repo.approval_required and bug_ids:
+            # Trigger update of repo in Phabricator so patches are closed quicker.
+            # Especially useful on low-traffic repositories.
+            if repo.phab_identifier:
+                self.phab_trigger_repo_update(repo.phab_identifier)
+
+        return True
+
+    def run_train(
+        self,
+        jobs: list[LandingJob],
+        repo: Repo,
+        hgrepo: HgRepo,
+    ) -> bool:
+        """Land a train of jobs for the same repository with as few pushes as possible.
+
+        The patches of each job are applied in queue order on top of the previous
+        job. A job whose patches fail to apply is failed and its changesets are
+        removed before continuing with the rest of the train. The remaining jobs are
+        pushed together, see `push_train`.
+
+        Returns:
+            True: All jobs finished processing and are in a permanent state.
+            False: A job encountered a temporary failure and should be tried again.
+        """
+        if not treestatus.is_open(repo.tree):
+            self.transition_jobs(
+                jobs,
+                LandingJobAction.DEFER,
+                f"Tree {repo.tree} is closed - retrying later.",
+                cause=TreeClosed,
+            )
+            return False
+
+        with hgrepo.for_push(jobs[0].requester_email):
+            result = self.update_repo(jobs, repo, hgrepo)
+            if result is not None:
+                return result
+
+            # Each applied job with the last changeset it added and its bug numbers.
+            applied = []
+            base = self.current_node(hgrepo)
+            for job in jobs:
+                if not self.apply_job_patches(job, repo, hgrepo):
+                    # Remove anything this job applied and carry on from the
+                    # previous job.
+                    hgrepo.strip_descendants(base)
+                    continue
+
+                changeset_titles = self.changeset_titles(hgrepo, f"only(., {base})")
+                bug_ids = [
+                    str(bug) for title in changeset_titles for bug in parse_bugs(title)
+                ]
+                base = self.current_node(hgrepo)
+                applied.append((job, base, bug_ids))
+
+            if not applied:
+                return True
+
+            landed, finished = self.push_train(applied, repo, hgrepo)
+
+        for job, commit_id, bug_ids in landed:
+            job.transition_status(
+                LandingJobAction.LAND, commit_id=commit_id, commit=True, db=db
+            )
+            with timed_phase([job], "post_land"):
+                self.post_land_job(job, repo, hgrepo, bug_ids)
+
+        if landed and repo.phab_identifier:
+            self.phab_trigger_repo_update(repo.phab_identifier)
+
+        return finished
+
+    def push_train(
+        self,
+        applied: list[tuple[LandingJob, str, list[str]]],
+        repo: Repo,
+        hgrepo: HgRepo,
+    ) -> tuple[list[tuple[LandingJob, str, list[str]]], bool]:
+        """Push the applied jobs of a train, bisecting the train on failure.
+
+        `applied` holds each job in train order along with the last changeset it
+        added and its bug numbers. All jobs are pushed at once. If the push fails
+        permanently, only the first half of the jobs is pushed, and so on until
+        the failing job is isolated. That job is failed and the jobs stacked on
+        top of it are deferred so they are retried without it.
+
+        Returns a tuple of the entries of `applied` which were pushed and whether
+        all jobs are in a permanent state.
+        """
+        repo_push_info = f"tree: {repo.tree}, push path: {repo.push_path}"
+        landed = []
+        remaining = list(applied)
+        candidates = remaining
+        while candidates:
             try:
-                # If we just landed an uplift, update the relevant bugs as appropriate.
-                update_bugs_for_uplift(
-                    repo.short_name,
-                    hgrepo.read_checkout_file("config/milestone.txt"),
-                    repo.milestone_tracking_flag_template,
-                    bug_ids,
+                with timed_phase([job for job, _node, _bug_ids in candidates], "push"):
+                    hgrepo.push(
+                        repo.push_path,
+                        bookmark=repo.push_bookmark or None,
+                        rev=candidates[-1][1],
+                    )
+            except TEMPORARY_PUSH_ERRORS as e:
+                message = (
+                    f"`Temporary error ({e.__class__}) "
+                    f"encountered while pushing to {repo_push_info}"
                 )
+                logger.exception(message)
+                self.transition_jobs(
+                    [job for job, _node, _bug_ids in remaining],
+                    LandingJobAction.DEFER,
+                    message,
+                    cause=e.__class__,
+                )
+                return landed, False
             except Exception as e:
-                # The changesets will have gone through even if updating the bugs fails. Notify
-                # the landing user so they are aware and can update the bugs themselves.
-                self.notify_user_of_bug_update_failure(job, e)
+                if len(candidates) > 1:
+                    logger.info(
+                        f"Push of {len(candidates)} jobs in train failed, bisecting.",
+                        exc_info=e,
+                    )
+                    candidates = candidates[: len(candidates) // 2]
+                    continue
 
-        # Trigger update of repo in Phabricator so patches are closed quicker.
-        # Especially useful on low-traffic repositories.
-        if repo.phab_identifier:
-            self.phab_trigger_repo_update(repo.phab_identifier)
+                job = candidates[0][0]
+                message = f"Unexpected error while pushing to {repo.push_path}.\n{e}"
+                logger.exception(message)
+                self.transition_jobs([job], LandingJobAction.FAIL, message, notify=True)
 
-        return True
+                deferred = [job for job, _node, _bug_ids in remaining[1:]]
+                if not deferred:
+                    return landed, True
+
+                self.transition_jobs(
+                    deferred,
+                    LandingJobAction.DEFER,
+                    f"Landing job {job.id} in the same merge train failed to push, "
+                    "retrying later.",
+                )
+                return landed, False
+
+            landed.extend(candidates)
+            remaining = remaining[len(candidates) :]
+            candidates = remaining
+
+        return landed, True
@@ -0,0 +1,175 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""This module contains a supervisor which runs a worker process per repo group."""
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import signal
+from time import sleep
+from typing import (
+    Iterable,
+    Type,
+)
+
+from landoapi.repos import repo_clone_subsystem
+from landoapi.storage import db
+from landoapi.workers.base import Worker
+
+logger = logging.getLogger(__name__)
+
+
+def parse_repo_groups(value: str) -> list[list[str]]:
+    """Parse a repository group specification into a list of repository groups.
+
+    Groups are separated by semicolons and repositories within a group are separated
+    by commas, e.g. `"autoland,try;mozilla-central"` results in two groups.
+
+    Raises:
+        ValueError: If a repository appears in more than one group.
+    """
+    groups = []
+    seen = set()
+    for raw_group in value.split(";"):
+        group = [name.strip() for name in raw_group.split(",") if name.strip()]
+        if not group:
+            continue
+
+        duplicates = seen.intersection(group)
+        if duplicates:
+            raise ValueError(
+                f"Repositories {duplicates} appear in more than one repository group."
+            )
+
+        seen.update(group)
+        groups.append(group)
+
+    return groups
+
+
+def _run_worker(worker_class: Type[Worker], repositories: list[str], **kwargs):
+    """Entry point for a supervised worker process."""
+    # Connections inherited from the parent process must not be shared with it,
+    # make sure new connections are established in this process.
+    db.engine.dispose()
+
+    # Restore the default handler, the supervisor is responsible for signalling us.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    worker = worker_class(repositories=repositories, **kwargs)
+    worker.start()
+
+
+class WorkerSupervisor:
+    """Run and monitor a worker process for each group of repositories.
+
+    Each worker process only claims jobs for the repositories in its group, so a
+    long running job on one repository does not delay jobs on other repositories.
+    Worker processes that exit unexpectedly are restarted, while processes that exit
+    cleanly (e.g. because the worker was stopped) are not.
+    """
+
+    def __init__(
+        self,
+        worker_class: Type[Worker],
+        repo_groups: Iterable[list[str]],
+        restart_delay_seconds: float = 5,
+        **worker_kwargs,
+    ):
+        self.worker_class = worker_class
+        self.repo_groups = [list(group) for group in repo_groups]
+        self.restart_delay_seconds = restart_delay_seconds
+        self.worker_kwargs = worker_kwargs
+
+        # Use `fork` so that the child processes inherit the initialized app
+        # and the repository clone state.
+        self.context = multiprocessing.get_context("fork")
+        self.processes: dict[int, multiprocessing.Process] = {}
+        self.running = False
+
+    def __str__(self) -> str:
+        return f"{self.__class__.__name__}({self.worker_class.__name__})"
+
+    def spawn(self, index: int) -> multiprocessing.Process:
+        """Start a worker process for the repository group at `index`."""
+        repositories = self.repo_groups[index]
+        kwargs = dict(self.worker_kwargs)
+
+        # Each worker process serves its metrics on its own port.
+        if kwargs.get("metrics_port") is not None:
+            kwargs["metrics_port"] += index
+
+        process = self.context.Process(
+            target=_run_worker,
+            args=(self.worker_class, repositories),
+            kwargs=kwargs,
+            name=f"{self.worker_class.__name__}-{'-'.join(repositories)}",
+            daemon=True,
+        )
+        process.start()
+        logger.info(
+            f"Started worker process {process.pid} for repositories {repositories}."
+        )
+        self.processes[index] = process
+        return process
+
+    def terminate(self, *args):
+        """Stop all worker processes."""
+        self.running = False
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+
+    def monitor(self):
+        """Restart worker processes that exited with an error."""
+        for index, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+
+            if process.exitcode == 0 or not self.running:
+                logger.info(
+                    f"Worker process {process.pid} exited with {process.exitcode}."
+                )
+                del self.processes[index]
+                continue
+
+            logger.error(
+                f"Worker process {process.pid} for {self.repo_groups[index]} exited "
+                f"with {process.exitcode}, restarting."
+            )
+            self.spawn(index)
+
+    def start(self):
+        """Start a worker process per repository group and monitor them."""
+        if not self.repo_groups:
+            logger.warning(f"{self} has no repository groups, exiting.")
+            return
+
+        signal.signal(signal.SIGTERM, self.terminate)
+
+        # Wait for every repository, not just those of the first group, so that no
+        # preparation threads are running when worker processes are forked.
+        repo_clone_subsystem.join_preparation()
+
+        self.running = True
+        for index, repositories in enumerate(self.repo_groups):
+            unprepared = [
+                name
+                for name in repositories
+                if not repo_clone_subsystem.is_prepared(name)
+            ]
+            if unprepared:
+                logger.error(
+                    f"Repositories {unprepared} could not be prepared, not starting "
+                    f"a worker process for {repositories}."
+                )
+                continue
+
+            self.spawn(index)
+
+        while self.processes:
+            sleep(self.restart_delay_seconds)
+            self.monitor()
+
+        logger.info(f"{self} exited.")
@@ -29,13 +29,14 @@ from landoapi.models.treestatus import (
     Tree,
     TreeStatus,
 )
-from landoapi.phabricator import PhabricatorClient
+from landoapi.phabricator import PhabricatorClient, conduit_circuit_breaker
 from landoapi.projects import (
     CHECKIN_PROJ_SLUG,
     NEEDS_DATA_CLASSIFICATION_SLUG,
     RELMAN_PROJECT_SLUG,
     SEC_APPROVAL_PROJECT_SLUG,
     SEC_PROJ_SLUG,
+    clear_project_phids,
 )
 from landoapi.repos import SCM_LEVEL_1, SCM_LEVEL_3, Repo, get_repos_for_env
 from landoapi.stacks import (
@@ -275,6 +276,11 @@ def app(request, versionfile, docker_env_vars, disable_migrations, mocked_repo_c
     for system in SUBSYSTEMS:
         system.init_app(flask_app)
 
+    # Don't let Phabricator failures in a previous test fail requests fast.
+    conduit_circuit_breaker.reset()
+    # Projects of a previous test are not those of this one.
+    clear_project_phids()
+
     return flask_app
 
 
@@ -845,9 +845,15 @@ class PhabricatorDouble:
         if limit:
             items = items[:limit]
 
+        slug_map = {
+            i["slug"]: {"slug": i["slug"], "projectPHID": i["phid"]}
+            for i in items
+            if "slugs" in constraints
+        }
+
         return {
             "data": [to_response(i) for i in items],
-            "maps": {"slugMap": {}},
+            "maps": {"slugMap": slug_map},
             "query": {"queryKey": queryKey},
             "cursor": {
                 "limit": limit,
@@ -3,9 +3,11 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import io
 import os
+import unittest.mock as mock
 from pathlib import Path
 
 import pytest
+import rs_parsepatch
 
 from landoapi.hg import (
     REQUEST_USER_ENV_VAR,
@@ -21,6 +23,7 @@ from landoapi.hg import (
     TreeClosed,
     hglib,
 )
+from landoapi.repos import HG_BUNDLE_SUFFIX, RepoCloneSubsystem, repo_bundles
 
 
 def test_integrated_hgrepo_clean_repo(hg_clone):
@@ -80,6 +83,64 @@ def test_integrated_hgrepo_can_log(hg_clone):
         assert repo.run_hg_cmds([["log"]])
 
 
+def test_integrated_hgrepo_update_repo_skips_redundant_pull(
+    hg_server, hg_clone, tmpdir
+):
+    repo = HgRepo(hg_clone.strpath)
+    with repo.for_pull():
+        # The clone already has the remote head.
+        head = repo.update_repo(hg_server)
+        assert repo.pulls == {"skipped": 1}
+
+        # Push a new changeset from another clone.
+        other_dir = tmpdir.join("other_clone")
+        other = HgRepo(other_dir.strpath)
+        other.clone(hg_server)
+        with other.for_pull():
+            other_dir.join("new_file.txt").write("text")
+            other.run_hg_cmds(
+                [
+                    ["add", other_dir.join("new_file.txt").strpath],
+                    ["commit", "-m", "adding file"],
+                    ["push"],
+                ]
+            )
+
+        new_head = repo.update_repo(hg_server)
+        assert new_head != head
+        assert repo.pulls == {"skipped": 1, "pulled": 1}
+        assert repo.lookup_node(".").startswith(new_head)
+
+        repo.update_repo(hg_server)
+        assert repo.pulls == {"skipped": 2, "pulled": 1}
+
+
+def test_integrated_hgrepo_persistent_command_server(hg_clone, monkeypatch):
+    repo = HgRepo(hg_clone.strpath, persistent=True)
+    with repo.for_pull():
+        pid = repo.hg_repo.server.pid
+
+    # The command server is reused across contexts.
+    with repo.for_push("test@example.com"):
+        assert repo.hg_repo.server.pid == pid
+
+    # It is restarted if it died...
+    repo.hg_repo.server.kill()
+    repo.hg_repo.server.wait()
+    with repo.for_pull():
+        assert repo.hg_repo.server.pid != pid
+        pid = repo.hg_repo.server.pid
+        repo.run_hg(["status"])
+
+    # ...and recycled after running enough commands.
+    monkeypatch.setattr("landoapi.hg.HG_COMMAND_SERVER_MAX_COMMANDS", 1)
+    with repo.for_pull():
+        assert repo.hg_repo.server.pid != pid
+
+    repo.close()
+    assert repo.hg_repo is None
+
+
 PATCH_WITHOUT_STARTLINE = r"""
 # HG changeset patch
 # User Test User <test@example.com>
@@ -311,3 +372,296 @@ def test_hgrepo_request_user(hg_clone):
         assert REQUEST_USER_ENV_VAR in os.environ
         assert os.environ[REQUEST_USER_ENV_VAR] == "test@example.com"
     assert REQUEST_USER_ENV_VAR not in os.environ
+
+
+def test_integrated_hgrepo_last_changesets_for_paths(hg_clone):
+    repo = HgRepo(hg_clone.strpath)
+    with repo.for_pull(), hg_clone.as_cwd():
+        hg_clone.join("a.txt").write("a")
+        hg_clone.join("b.txt").write("b")
+        repo.run_hg_cmds(
+            [
+                ["add", hg_clone.join("a.txt").strpath, hg_clone.join("b.txt").strpath],
+                ["commit", "-m", "add a and b"],
+            ]
+        )
+        both = repo.lookup_node(".")
+
+        hg_clone.join("a.txt").write("a again")
+        repo.run_hg_cmds([["commit", "-m", "change a"]])
+        only_a = repo.lookup_node(".")
+
+        assert repo.last_changesets_for_paths(["a.txt", "b.txt", "missing.txt"]) == {
+            "a.txt": only_a,
+            "b.txt": both,
+            "missing.txt": "",
+        }
+
+
+def test_integrated_hgrepo_clean_repo_targets_status(hg_clone, monkeypatch):
+    rejects_path = Path(hg_clone.dirname) / "rejects"
+    monkeypatch.setattr("landoapi.hg.REJECTS_PATH", rejects_path)
+
+    repo = HgRepo(hg_clone.strpath)
+    with repo.for_pull(), hg_clone.as_cwd():
+        hg_clone.join("test.txt").write("modified", mode="a")
+        hg_clone.join("added.txt").write("added")
+        repo.run_hg(["add", hg_clone.join("added.txt").strpath])
+        hg_clone.join("unknown.txt").write("unknown")
+        hg_clone.join("test.txt.rej").write("rejected hunk")
+        hg_clone.join("new", "dir", "unknown.txt").write("unknown", ensure=True)
+
+        repo.clean_repo()
+        assert repo.known_clean
+        assert not repo.dirty_files()
+        assert not hg_clone.join("added.txt").exists()
+        assert not hg_clone.join("new").exists()
+        assert (
+            rejects_path / hg_clone.join("test.txt.rej").strpath[1:]
+        ).read_text() == "rejected hunk"
+
+        # Cleaning a repo that is known to be clean runs no commands.
+        commands_run = repo.commands_run
+        repo.clean_repo()
+        assert repo.commands_run == commands_run
+
+        # Read only commands keep the repo known to be clean, others don't.
+        repo.run_hg(["log", "-r", "."])
+        assert repo.known_clean
+        repo.run_hg(["--config", "ui.quiet=1", "update", "--clean", "-r", "."])
+        assert not repo.known_clean
+
+        # A failed step leaves the repo not known to be clean.
+        hg_clone.join("unknown.txt").write("unknown")
+        run_hg = repo.run_hg
+
+        def failing_run_hg(args):
+            if args[0] == "purge":
+                raise hglib.error.CommandError(args, 255, b"", b"abort: purge failed")
+            return run_hg(args)
+
+        monkeypatch.setattr(repo, "run_hg", failing_run_hg)
+        repo.clean_repo()
+        assert not repo.known_clean
+
+
+def test_hgrepo_external_patch_may_apply():
+    assert HgRepo._external_patch_may_apply(
+        rs_parsepatch.get_counts(PATCH_NORMAL.split("add another file.\n")[1] + "\n")
+    )
+
+    rename = "diff --git a/a.txt b/b.txt\nrename from a.txt\nrename to b.txt\n"
+    assert not HgRepo._external_patch_may_apply(rs_parsepatch.get_counts(rename))
+
+    binary = (
+        "diff --git a/image.png b/image.png\n"
+        "new file mode 100644\n"
+        "GIT binary patch\n"
+        "literal 1\n"
+        "Ic${}000\n"
+        "\n"
+        "literal 0\n"
+        "HcmV?d00001\n"
+    )
+    assert not HgRepo._external_patch_may_apply(rs_parsepatch.get_counts(binary))
+
+    # Binary diffs don't prevent retrying the text changes of a patch.
+    text = "diff --git a/test.txt b/test.txt\n--- a/test.txt\n+++ b/test.txt\n"
+    text += "@@ -1,1 +1,2 @@\n TEST\n+adding another line\n"
+    mixed = rs_parsepatch.get_counts(binary + "\n" + text)
+    assert HgRepo._external_patch_may_apply(mixed)
+
+
+def test_integrated_hgrepo_apply_patch_without_retry_saves_rejects(
+    hg_clone, monkeypatch
+):
+    rejects_path = Path(hg_clone.dirname) / "rejects"
+    monkeypatch.setattr("landoapi.hg.REJECTS_PATH", rejects_path)
+    stale_reject = rejects_path / hg_clone.join("stale.txt.rej").strpath[1:]
+    stale_reject.parent.mkdir(parents=True)
+    stale_reject.write_text("rejected hunk of a previous job")
+    other_reject = rejects_path / "other-repo" / "other.txt.rej"
+    other_reject.parent.mkdir()
+    other_reject.write_text("rejected hunk of another repo")
+
+    monkeypatch.setattr(
+        HgRepo, "_external_patch_may_apply", staticmethod(lambda diffs: False)
+    )
+    repo = HgRepo(hg_clone.strpath)
+    with repo.for_pull(), pytest.raises(PatchConflict):
+        repo.apply_patch(io.StringIO(PATCH_WITH_CONFLICT))
+
+    assert (rejects_path / hg_clone.join("not-real.txt.rej").strpath[1:]).exists()
+    assert not stale_reject.exists()
+
+    # Rejects of repos used by other worker processes are left alone.
+    assert other_reject.exists()
+
+
+FAKE_MACH_UPPERCASE = """#!/usr/bin/env python3
+import pathlib
+import sys
+
+HERE = pathlib.Path(__file__).resolve().parent
+
+paths = sys.argv[sys.argv.index("--") + 1 :]
+with (HERE / "mach-calls.txt").open("a") as f:
+    f.write(" ".join(paths) + "\\n")
+
+for path in paths:
+    path = HERE / path
+    path.write_text(path.read_text().upper())
+"""
+
+
+def test_integrated_hgrepo_format_files_reuses_results(hg_clone):
+    repo = HgRepo(hg_clone.strpath)
+    mach = Path(hg_clone.strpath) / "mach"
+    mach.write_text(FAKE_MACH_UPPERCASE)
+    mach.chmod(0o755)
+    calls = Path(hg_clone.strpath) / "mach-calls.txt"
+    test_txt = Path(hg_clone.strpath) / "test.txt"
+
+    with repo.for_preparation():
+        test_txt.write_text("formatted\n")
+        assert repo.format_files(["test.txt"]) is not None
+        assert test_txt.read_text() == "FORMATTED\n"
+        assert calls.read_text().splitlines() == ["test.txt"]
+
+        # The same contents are formatted from the cache, as on a retried job.
+        test_txt.write_text("formatted\n")
+        assert repo.format_files(["test.txt"]) is None
+        assert test_txt.read_text() == "FORMATTED\n"
+
+        # Formatted contents are not formatted again.
+        assert repo.format_files(["test.txt"]) is None
+        assert calls.read_text().splitlines() == ["test.txt"]
+
+        # The same contents at another path are formatted again.
+        other_txt = Path(hg_clone.strpath) / "other.txt"
+        other_txt.write_text("formatted\n")
+        assert repo.format_files(["other.txt"]) is not None
+        assert calls.read_text().splitlines() == ["test.txt", "other.txt"]
+
+        # Changing the configuration of a directory invalidates the cache for the
+        # files below it.
+        sub_txt = Path(hg_clone.strpath) / "sub" / "dir" / "test.txt"
+        sub_txt.parent.mkdir(parents=True)
+        sub_txt.write_text("formatted\n")
+        assert repo.format_files(["sub/dir/test.txt"]) is not None
+        (sub_txt.parent.parent / "pyproject.toml").write_text("[tool.black]\n")
+        sub_txt.write_text("formatted\n")
+        assert repo.format_files(["sub/dir/test.txt"]) is not None
+        assert calls.read_text().splitlines()[-2:] == ["sub/dir/test.txt"] * 2
+
+        # Changing the formatter configuration invalidates the cache.
+        (Path(hg_clone.strpath) / ".clang-format").write_text("BasedOnStyle: LLVM\n")
+        assert repo.format_files(["test.txt"]) is not None
+        assert calls.read_text().splitlines() == [
+            "test.txt",
+            "other.txt",
+            "sub/dir/test.txt",
+            "sub/dir/test.txt",
+            "test.txt",
+        ]
+
+    repo.close()
+
+
+def test_integrated_hgrepo_ensure_mach_bootstrap(hg_clone, tmp_path, monkeypatch):
+    monkeypatch.setenv("MOZBUILD_STATE_PATH", str(tmp_path / "mozbuild"))
+    stamp_path = tmp_path / "bootstrap.json"
+
+    repo = HgRepo(hg_clone.strpath)
+    mach = Path(hg_clone.strpath) / "mach"
+    mach.write_text(
+        "#!/bin/sh\n"
+        'mkdir -p "$MOZBUILD_STATE_PATH"\n'
+        'echo "$1" >> "$MOZBUILD_STATE_PATH/calls.txt"\n'
+    )
+    mach.chmod(0o755)
+    calls = tmp_path / "mozbuild" / "calls.txt"
+
+    with repo.for_pull(), hg_clone.as_cwd():
+        assert repo.ensure_mach_bootstrap(stamp_path)
+        assert not repo.ensure_mach_bootstrap(stamp_path)
+        assert calls.read_text().splitlines() == ["bootstrap"]
+
+        # Changes to bootstrap related files cause a new bootstrap.
+        mozboot = hg_clone.join("python", "mozboot", "bootstrap.py")
+        mozboot.write("# bootstrap\n", ensure=True)
+        repo.run_hg_cmds(
+            [["add", mozboot.strpath], ["commit", "-m", "change bootstrap"]]
+        )
+        assert repo.ensure_mach_bootstrap(stamp_path)
+        assert calls.read_text().splitlines() == ["bootstrap", "bootstrap"]
+
+
+def test_integrated_hgrepo_clone_from_bundle(hg_server, hg_clone, tmpdir):
+    bundles_path = Path(tmpdir.mkdir("bundles").strpath)
+    (bundles_path / "test-repo").mkdir()
+    bundle = bundles_path / "test-repo" / f"20240101T000000Z{HG_BUNDLE_SUFFIX}"
+    (bundles_path / "test-repo" / f".20240102T000000Z{HG_BUNDLE_SUFFIX}").touch()
+
+    repo = HgRepo(hg_clone.strpath)
+    with repo.for_pull():
+        repo.create_bundle(bundle)
+        bundled_head = repo.lookup_node("tip")
+
+        # Push a changeset that isn't in the bundle.
+        hg_clone.join("new_file.txt").write("text")
+        repo.run_hg_cmds(
+            [
+                ["add", hg_clone.join("new_file.txt").strpath],
+                ["commit", "-m", "adding file"],
+                ["push"],
+            ]
+        )
+        new_head = repo.lookup_node("tip")
+
+    # Partially written snapshots are ignored.
+    assert repo_bundles(bundles_path, "test-repo", HG_BUNDLE_SUFFIX) == [bundle]
+
+    seeded = HgRepo(tmpdir.join("seeded").strpath)
+    seeded.clone(hg_server, bundle=bundle)
+    with seeded.for_pull():
+        assert seeded.lookup_node(bundled_head)
+        assert seeded.lookup_node(".") == new_head
+        assert seeded.run_hg(["paths", "default"]).decode().strip("/\n") == hg_server
+
+
+def test_integrated_create_bundles_leaves_clones_alone(
+    hg_server, tmpdir, mocked_repo_config
+):
+    clones_path = tmpdir.mkdir("clones")
+    clone = clones_path.join("mozilla-central")
+    repo = HgRepo(clone.strpath)
+    repo.clone(hg_server)
+
+    # A worker's draft changeset and working directory changes.
+    with repo.for_preparation():
+        clone.join("draft.txt").write("draft")
+        repo.run_hg_cmds(
+            [["add", clone.join("draft.txt").strpath], ["commit", "-m", "draft"]]
+        )
+        draft = repo.lookup_node(".")
+    clone.join("untracked.txt").write("untracked")
+
+    bundles_path = Path(tmpdir.mkdir("bundles").strpath)
+    subsystem = RepoCloneSubsystem()
+    subsystem.flask_app = mock.MagicMock(
+        config={
+            "ENVIRONMENT": "test",
+            "REPO_CLONES_PATH": clones_path.strpath,
+            "REPO_BUNDLES_PATH": str(bundles_path),
+            "REPOS_TO_LAND": "mozilla-central,try",
+        }
+    )
+    subsystem.create_bundles()
+
+    assert len(repo_bundles(bundles_path, "mozilla-central", HG_BUNDLE_SUFFIX)) == 1
+    assert not repo_bundles(bundles_path, "try", HG_BUNDLE_SUFFIX)
+
+    assert clone.join("untracked.txt").exists()
+    with repo.for_reading():
+        assert repo.lookup_node(".") == draft
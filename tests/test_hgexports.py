@@ -452,6 +452,7 @@ diff --git a/autoland/autoland/transplant.py b/autoland/autoland/transplant.py
     assert buf.getvalue() == commit_desc
 
     assert patch.get_diff() == diff
+    assert patch.get_commit_description_and_diff() == (commit_desc, diff)
 
     buf = io.StringIO("")
     patch.write_diff(buf)
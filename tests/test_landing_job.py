@@ -2,9 +2,22 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from datetime import datetime, timedelta, timezone
+
 import pytest
 
-from landoapi.models.landing_job import LandingJob, LandingJobStatus
+from landoapi.models.configuration import (
+    ConfigurationKey,
+    ConfigurationVariable,
+    VariableType,
+)
+from landoapi.models.landing_job import (
+    LandingJob,
+    LandingJobAction,
+    LandingJobStatus,
+    LandingQueuePolicy,
+    parse_repository_weights,
+)
 
 
 @pytest.fixture
@@ -160,6 +173,78 @@ def test_landing_job_acquire_job_job_queue_query(db):
     assert jobs[1] not in queue_items
 
 
+def test_landing_job_queue_fair_share(db):
+    created_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    jobs = []
+    for repository_name, requester_email in (
+        ("try", "busy@example.com"),
+        ("try", "busy@example.com"),
+        ("try", "busy@example.com"),
+        ("try", "other@example.com"),
+        ("autoland", "busy@example.com"),
+        ("autoland", "third@example.com"),
+    ):
+        job = LandingJob(
+            status=LandingJobStatus.SUBMITTED,
+            requester_email=requester_email,
+            repository_name=repository_name,
+            revision_to_diff_id={},
+            revision_order=[],
+            created_at=created_at,
+        )
+        created_at += timedelta(seconds=1)
+        db.session.add(job)
+        jobs.append(job)
+    db.session.commit()
+
+    def queue(**kwargs) -> list[LandingJob]:
+        return LandingJob.job_queue_query(
+            repositories=["try", "autoland"], **kwargs
+        ).all()
+
+    assert queue() == jobs, "The FIFO policy should be used by default."
+
+    # Each repository and requester gets one job per round.
+    ConfigurationVariable.set(
+        ConfigurationKey.LANDING_QUEUE_POLICY,
+        VariableType.STR,
+        LandingQueuePolicy.FAIR_SHARE.value,
+    )
+    assert queue() == [jobs[0], jobs[5], jobs[3], jobs[1], jobs[2], jobs[4]]
+
+    # Requesters may be allowed more jobs per round, and repositories weighted.
+    ConfigurationVariable.set(
+        ConfigurationKey.LANDING_QUEUE_REQUESTER_CAP, VariableType.INT, "2"
+    )
+    ConfigurationVariable.set(
+        ConfigurationKey.LANDING_QUEUE_REPOSITORY_WEIGHTS, VariableType.STR, "try:2"
+    )
+    assert queue() == [jobs[0], jobs[1], jobs[5], jobs[2], jobs[3], jobs[4]]
+    assert queue(policy=LandingQueuePolicy.FIFO) == jobs
+
+    # Aged jobs catch up with higher priority jobs.
+    jobs[3].priority = 1
+    db.session.commit()
+    assert queue()[0] is jobs[3]
+    ConfigurationVariable.set(
+        ConfigurationKey.LANDING_QUEUE_AGING_SECONDS, VariableType.INT, "60"
+    )
+    assert queue()[:2] == [jobs[0], jobs[1]]
+
+    # Rows can be locked while using the fair share policy.
+    job = LandingJob.next_job_for_update_query(repositories=["try"]).first()
+    assert job is jobs[0]
+    db.session.commit()
+
+
+def test_parse_repository_weights():
+    assert parse_repository_weights("") == {}
+    assert parse_repository_weights("autoland:3, try:0,bad, x:y") == {
+        "autoland": 3,
+        "try": 1,
+    }
+
+
 def test_landing_job_commit_id(db, client, landing_job):
     """Test fetching commit_id of a landing job."""
 
@@ -183,3 +268,166 @@ def test_landing_job_commit_id(db, client, landing_job):
     assert response.status_code == 200
     assert response.json["status"] == "LANDED"
     assert response.json["commit_id"] == hash
+    assert response.json["phase_timings"] == {}
+
+    job.record_phase_timing("push", 1.25)
+    job.record_phase_timing("push", 0.5)
+    db.session.commit()
+    response = client.get(f"/landing_jobs/{job.id}")
+    assert response.json["phase_timings"] == {"push": 1.75}
+
+
+def test_landing_job_next_job_for_update_query_skips_locked_jobs(db):
+    REPO_NAME = "test-repo"
+    jobs = [
+        LandingJob(
+            status=LandingJobStatus.SUBMITTED,
+            requester_email="test@example.com",
+            repository_name=REPO_NAME,
+            revision_to_diff_id={str(i): i},
+            revision_order=[str(i)],
+            # Make sure the jobs are outside the grace period.
+            created_at=datetime.now(timezone.utc) - timedelta(hours=1, seconds=-i),
+        )
+        for i in range(2)
+    ]
+    for job in jobs:
+        db.session.add(job)
+        db.session.commit()
+
+    # Lock the first job from another connection, as a concurrent worker would.
+    with db.engine.connect() as connection:
+        transaction = connection.begin()
+        connection.execute(
+            f"SELECT id FROM landing_job WHERE id = {jobs[0].id} FOR UPDATE"
+        )
+
+        job = LandingJob.next_job_for_update_query(repositories=[REPO_NAME]).first()
+        assert job is jobs[1], "Locked jobs should be skipped."
+        db.session.commit()
+
+        transaction.rollback()
+
+    job = LandingJob.next_job_for_update_query(repositories=[REPO_NAME]).first()
+    assert job is jobs[0], "Unlocked jobs should be claimed in queue order."
+    db.session.commit()
+
+
+def test_landing_job_seconds_until_next_eligible(db):
+    REPO_NAME = "test-repo"
+    assert LandingJob.seconds_until_next_eligible(repositories=[REPO_NAME]) is None
+
+    job = LandingJob(
+        status=LandingJobStatus.SUBMITTED,
+        requester_email="test@example.com",
+        repository_name=REPO_NAME,
+        revision_to_diff_id={},
+        revision_order=[],
+        created_at=datetime.now(timezone.utc) - timedelta(seconds=30),
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    seconds = LandingJob.seconds_until_next_eligible(
+        repositories=[REPO_NAME], grace_seconds=120
+    )
+    assert 80 < seconds <= 90
+
+    # Jobs outside of the grace period are already eligible.
+    assert (
+        LandingJob.seconds_until_next_eligible(
+            repositories=[REPO_NAME], grace_seconds=10
+        )
+        is None
+    )
+
+
+def test_landing_job_not_before(db):
+    REPO_NAME = "test-repo"
+    job = LandingJob(
+        status=LandingJobStatus.IN_PROGRESS,
+        requester_email="test@example.com",
+        repository_name=REPO_NAME,
+        revision_to_diff_id={},
+        revision_order=[],
+        created_at=datetime.now(timezone.utc) - timedelta(hours=1),
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    job.transition_status(
+        LandingJobAction.DEFER,
+        message="Tree is closed.",
+        not_before=datetime.now(timezone.utc) + timedelta(seconds=60),
+    )
+    db.session.commit()
+
+    # Deferred jobs are skipped until they are due.
+    assert LandingJob.job_queue_query(repositories=[REPO_NAME]).count() == 0
+    seconds = LandingJob.seconds_until_next_eligible(repositories=[REPO_NAME])
+    assert 50 < seconds <= 60
+
+    job.not_before = datetime.now(timezone.utc) - timedelta(seconds=1)
+    db.session.commit()
+    assert LandingJob.job_queue_query(repositories=[REPO_NAME]).first() is job
+
+    # The backoff is cleared when the job is picked up again.
+    job.transition_status(LandingJobAction.FAIL, message="Failed.")
+    assert job.not_before is None
+
+    with pytest.raises(ValueError):
+        job.transition_status(
+            LandingJobAction.FAIL, message="Failed.", not_before=datetime.now()
+        )
+
+
+def test_landing_job_leases(db):
+    REPO_NAME = "test-repo"
+    jobs = [
+        LandingJob(
+            status=LandingJobStatus.SUBMITTED,
+            requester_email="test@example.com",
+            repository_name=REPO_NAME,
+            revision_to_diff_id={str(i): i},
+            revision_order=[str(i)],
+            created_at=datetime.now(timezone.utc) - timedelta(hours=1, seconds=-i),
+        )
+        for i in range(2)
+    ]
+    for job in jobs:
+        db.session.add(job)
+        db.session.commit()
+
+    jobs[0].claim("worker-1", lease_seconds=60)
+    db.session.commit()
+    assert jobs[0].status == LandingJobStatus.IN_PROGRESS
+    assert jobs[0].attempts == 1
+
+    # Other workers skip jobs with a live lease, the owner can pick it back up.
+    job = LandingJob.next_job_for_update_query(
+        repositories=[REPO_NAME], worker_id="worker-2"
+    ).first()
+    assert job is jobs[1]
+    db.session.commit()
+    job = LandingJob.next_job_for_update_query(
+        repositories=[REPO_NAME], worker_id="worker-1"
+    ).first()
+    assert job is jobs[0]
+    db.session.commit()
+
+    # Only the owner can renew the lease.
+    with db.engine.begin() as connection:
+        assert not LandingJob.renew_leases(connection, [jobs[0].id], "worker-2")
+        assert LandingJob.renew_leases(connection, [jobs[0].id], "worker-1")
+
+    # Expired leases can be reclaimed.
+    jobs[0].lease_expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+    db.session.commit()
+    job = LandingJob.next_job_for_update_query(
+        repositories=[REPO_NAME], worker_id="worker-2"
+    ).first()
+    assert job is jobs[0]
+    db.session.commit()
+
+    jobs[0].transition_status(LandingJobAction.CANCEL, commit=True, db=db)
+    assert jobs[0].lease_expires_at is None
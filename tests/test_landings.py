@@ -5,17 +5,24 @@
 import io
 import textwrap
 import unittest.mock as mock
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 
 import pytest
 
 from landoapi.hg import AUTOFORMAT_COMMIT_MESSAGE, HgRepo
+from landoapi.models.configuration import (
+    ConfigurationKey,
+    ConfigurationVariable,
+    VariableType,
+)
 from landoapi.models.landing_job import (
     LandingJob,
     LandingJobStatus,
     add_job_with_revisions,
 )
 from landoapi.models.revisions import Revision
-from landoapi.repos import SCM_LEVEL_3, Repo
+from landoapi.repos import SCM_LEVEL_3, Repo, repo_clone_subsystem
 from landoapi.workers.landing_worker import LandingWorker
 
 
@@ -72,6 +79,36 @@ diff --git a/test.txt b/test.txt
 +adding one more line again
 """.strip()
 
+PATCH_CONFLICT = r"""
+# HG changeset patch
+# User Test User <test@example.com>
+# Date 0 0
+#      Thu Jan 01 00:00:00 1970 +0000
+# Diff Start Line 7
+Add to a file that doesn't exist
+diff --git a/not-real.txt b/not-real.txt
+--- a/not-real.txt
++++ b/not-real.txt
+@@ -1,1 +1,2 @@
+ TEST
++This line doesn't exist
+""".strip()
+
+PATCH_NEW_FILE = r"""
+# HG changeset patch
+# User Test User <test@example.com>
+# Date 0 0
+#      Thu Jan 01 00:00:00 1970 +0000
+# Diff Start Line 7
+add a new file.
+diff --git a/new-file.txt b/new-file.txt
+new file mode 100644
+--- /dev/null
++++ b/new-file.txt
+@@ -0,0 +1,1 @@
++TEST
+""".strip()
+
 PATCH_FORMATTING_PATTERN_PASS = r"""
 # HG changeset patch
 # User Test User <test@example.com>
@@ -270,6 +307,11 @@ def test_integrated_execute_job(
         mock_trigger_update.call_count == 1
     ), "Successful landing should trigger Phab repo update."
 
+    # Each phase of the landing is timed, and each patch individually.
+    assert {"pull", "apply", "push", "post_land"} <= job.phase_timings.keys()
+    for revision in revisions:
+        assert f"apply:D{revision.revision_id}" in job.phase_timings
+
 
 def test_integrated_execute_job_with_force_push(
     app,
@@ -397,6 +439,225 @@ def test_lose_push_race(
     assert not worker.run_job(job, repo, hgrepo)
     assert job.status == LandingJobStatus.DEFERRED
 
+    # The job is backed off before being retried.
+    assert job.not_before > datetime.now(timezone.utc)
+    assert (
+        LandingJob.next_job_for_update_query(repositories=["mozilla-central"]).first()
+        is None
+    )
+
+
+@pytest.fixture
+def create_train(create_patch_revision):
+    """Create jobs for a merge train, one job per patch."""
+
+    def _create_train(patches):
+        return [
+            add_job_with_revisions(
+                [create_patch_revision(number, patch=patch)],
+                status=LandingJobStatus.IN_PROGRESS,
+                requester_email="test@example.com",
+                repository_name="mozilla-central",
+                attempts=1,
+            )
+            for number, patch in enumerate(patches, start=1)
+        ]
+
+    return _create_train
+
+
+def test_integrated_execute_train(
+    app,
+    db,
+    hg_server,
+    hg_clone,
+    monkeypatch,
+    new_treestatus_tree,
+    create_train,
+    normal_patch,
+):
+    new_treestatus_tree(tree="mozilla-central", status="open")
+    repo = Repo(
+        tree="mozilla-central",
+        url=hg_server,
+        access_group=SCM_LEVEL_3,
+        push_path=hg_server,
+        pull_path=hg_server,
+    )
+    hgrepo = HgRepo(hg_clone.strpath)
+    jobs = create_train([normal_patch(0), PATCH_CONFLICT, normal_patch(1)])
+
+    worker = LandingWorker(sleep_seconds=0.01)
+    mock_trigger_update = mock.MagicMock()
+    monkeypatch.setattr(
+        "landoapi.workers.landing_worker.LandingWorker.phab_trigger_repo_update",
+        mock_trigger_update,
+    )
+    mock_notify = mock.MagicMock()
+    monkeypatch.setattr(
+        "landoapi.workers.landing_worker.notify_user_of_landing_failure", mock_notify
+    )
+    push = mock.MagicMock(wraps=hgrepo.push)
+    hgrepo.push = push
+
+    assert worker.run_train(jobs, repo, hgrepo)
+
+    # The job that failed to apply is removed from the train, the others are
+    # pushed together.
+    assert [job.status for job in jobs] == [
+        LandingJobStatus.LANDED,
+        LandingJobStatus.FAILED,
+        LandingJobStatus.LANDED,
+    ]
+    assert push.call_count == 1
+    assert mock_notify.call_count == 1
+    assert mock_trigger_update.call_count == 1
+    assert jobs[0].landed_commit_id != jobs[2].landed_commit_id
+
+    # Both jobs were pushed, so they are public in the local repo.
+    with hgrepo.for_pull():
+        for job in (jobs[0], jobs[2]):
+            assert (
+                hgrepo.run_hg(
+                    [
+                        "log",
+                        "-r",
+                        f"{job.landed_commit_id} and public()",
+                        "-T",
+                        "{node}",
+                    ]
+                ).decode("utf-8")
+                == job.landed_commit_id
+            )
+
+
+def test_integrated_execute_train_bisects_push_failure(
+    app,
+    db,
+    hg_server,
+    hg_clone,
+    monkeypatch,
+    new_treestatus_tree,
+    create_train,
+    normal_patch,
+):
+    new_treestatus_tree(tree="mozilla-central", status="open")
+    repo = Repo(
+        tree="mozilla-central",
+        url=hg_server,
+        access_group=SCM_LEVEL_3,
+        push_path=hg_server,
+        pull_path=hg_server,
+    )
+    hgrepo = HgRepo(hg_clone.strpath)
+    jobs = create_train([normal_patch(0), normal_patch(1), normal_patch(2)])
+
+    worker = LandingWorker(sleep_seconds=0.01)
+    monkeypatch.setattr(
+        "landoapi.workers.landing_worker.LandingWorker.phab_trigger_repo_update",
+        mock.MagicMock(),
+    )
+    monkeypatch.setattr(
+        "landoapi.workers.landing_worker.notify_user_of_landing_failure",
+        mock.MagicMock(),
+    )
+
+    # Reject any push that includes the changeset of the second job.
+    real_push = hgrepo.push
+
+    def push(*args, rev="tip", **kwargs):
+        bad = hgrepo.run_hg(
+            ["log", "-r", f"::{rev} and not public() and diffcontains('one more')"]
+        )
+        if bad:
+            raise Exception("Rejected by hook.")
+        return real_push(*args, rev=rev, **kwargs)
+
+    hgrepo.push = mock.MagicMock(side_effect=push)
+
+    assert not worker.run_train(jobs, repo, hgrepo)
+    assert [job.status for job in jobs] == [
+        LandingJobStatus.LANDED,
+        LandingJobStatus.FAILED,
+        LandingJobStatus.DEFERRED,
+    ]
+    # The whole train, the first job, the rest of the train, then the second job
+    # on its own.
+    assert hgrepo.push.call_count == 4
+    assert "Rejected by hook." in jobs[1].error
+
+
+def test_integrated_pipelined_landing(
+    app,
+    db,
+    hg_server,
+    hg_clone,
+    monkeypatch,
+    new_treestatus_tree,
+    create_patch_revision,
+    normal_patch,
+):
+    new_treestatus_tree(tree="mozilla-central", status="open")
+    repo = Repo(
+        tree="mozilla-central",
+        url=hg_server,
+        access_group=SCM_LEVEL_3,
+        push_path=hg_server,
+        pull_path=hg_server,
+    )
+    monkeypatch.setattr(
+        repo_clone_subsystem, "repos", {"mozilla-central": repo}, raising=False
+    )
+    monkeypatch.setattr(
+        repo_clone_subsystem,
+        "repo_paths",
+        {"mozilla-central": Path(hg_clone.strpath)},
+        raising=False,
+    )
+    monkeypatch.setattr(
+        "landoapi.workers.landing_worker.LandingWorker.phab_trigger_repo_update",
+        mock.MagicMock(),
+    )
+    ConfigurationVariable.set(
+        ConfigurationKey.LANDING_WORKER_PIPELINE_ENABLED, VariableType.BOOL, "1"
+    )
+
+    jobs = [
+        add_job_with_revisions(
+            [create_patch_revision(number, patch=patch)],
+            status=LandingJobStatus.SUBMITTED,
+            requester_email="test@example.com",
+            repository_name="mozilla-central",
+        )
+        for number, patch in ((1, normal_patch(0)), (2, PATCH_NEW_FILE))
+    ]
+    for job in jobs:
+        job.created_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    db.session.commit()
+
+    worker = LandingWorker(with_ssh=False, sleep_seconds=0.01)
+
+    # Landing the first job prepares the second one in another working copy.
+    worker.loop()
+    assert jobs[0].status == LandingJobStatus.LANDED, jobs[0].error
+    assert worker.preparation.job_id == jobs[1].id
+    assert worker.preparation.hgrepo.path == f"{hg_clone.strpath}-pipeline"
+
+    # The prepared job is rebased onto the first job instead of being applied again.
+    update_repo = mock.MagicMock(wraps=worker.update_repo)
+    monkeypatch.setattr(worker, "update_repo", update_repo)
+    worker.loop()
+    assert jobs[1].status == LandingJobStatus.LANDED, jobs[1].error
+    assert update_repo.call_count == 0
+
+    hgrepo = HgRepo(hg_clone.strpath)
+    with hgrepo.for_pull():
+        hgrepo.run_hg(["pull", hg_server])
+        parent = hgrepo.run_hg(
+            ["log", "-r", f"p1({jobs[1].landed_commit_id})", "-T", "{node}"]
+        )
+    assert parent.decode("utf-8") == jobs[0].landed_commit_id
+
 
 def test_failed_landing_job_notification(
     app,
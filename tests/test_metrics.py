@@ -0,0 +1,94 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import urllib.request
+
+from landoapi.metrics import Metric, MetricsExporter, render_metrics
+from landoapi.models.configuration import (
+    ConfigurationKey,
+    ConfigurationVariable,
+    VariableType,
+)
+from landoapi.models.landing_job import LandingJob, LandingJobStatus
+from landoapi.workers.landing_worker import LandingWorker
+
+
+def test_render_metrics():
+    metric = Metric("lando_test", "gauge", "A test metric.")
+    metric.add(1, repository="autoland")
+    metric.add(2.5, "_sum", repository='quoted "repo"')
+
+    assert render_metrics([metric]) == (
+        "# HELP lando_test A test metric.\n"
+        "# TYPE lando_test gauge\n"
+        'lando_test{repository="autoland"} 1\n'
+        'lando_test_sum{repository="quoted \\"repo\\""} 2.5\n'
+    )
+
+
+def test_metrics_endpoint_reports_landing_queue(db, client):
+    jobs = [
+        (LandingJobStatus.SUBMITTED, "autoland", 0),
+        (LandingJobStatus.SUBMITTED, "autoland", 0),
+        (LandingJobStatus.DEFERRED, "autoland", 2),
+        (LandingJobStatus.IN_PROGRESS, "try", 1),
+        (LandingJobStatus.LANDED, "try", 1),
+    ]
+    for status, repository_name, attempts in jobs:
+        db.session.add(
+            LandingJob(
+                status=status,
+                requester_email="test@example.com",
+                repository_name=repository_name,
+                attempts=attempts,
+                revision_to_diff_id={},
+                revision_order=[],
+            )
+        )
+    db.session.commit()
+
+    response = client.get("/__metrics__")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+
+    lines = response.get_data(as_text=True).splitlines()
+    assert 'lando_landing_jobs{repository="autoland",status="SUBMITTED"} 2' in lines
+    assert 'lando_landing_jobs{repository="autoland",status="DEFERRED"} 1' in lines
+    assert 'lando_landing_jobs{repository="try",status="IN_PROGRESS"} 1' in lines
+    assert not any('status="LANDED"' in line for line in lines)
+    assert any(
+        line.startswith(
+            'lando_landing_queue_oldest_submitted_age_seconds{repository="autoland"}'
+        )
+        for line in lines
+    )
+    assert 'lando_landing_job_attempts_bucket{le="1"} 3' in lines
+    assert 'lando_landing_job_attempts_bucket{le="+Inf"} 4' in lines
+    assert "lando_landing_job_attempts_sum 3" in lines
+    assert "lando_landing_job_attempts_count 4" in lines
+
+
+def test_metrics_endpoint_available_in_maintenance(db, client):
+    ConfigurationVariable.set(
+        ConfigurationKey.API_IN_MAINTENANCE, VariableType.BOOL, "1"
+    )
+    assert client.get("/__metrics__").status_code == 200
+
+
+def test_worker_metrics_exporter(db):
+    worker = LandingWorker(with_ssh=False)
+    worker.job_results.update({True: 3, False: 1})
+
+    exporter = MetricsExporter(0, worker.metrics)
+    exporter.start()
+    try:
+        with urllib.request.urlopen(f"http://localhost:{exporter.port}/") as response:
+            body = response.read().decode("utf-8")
+    finally:
+        exporter.stop()
+
+    labels = f'worker="{worker.worker_id}",worker_class="LandingWorker"'
+    assert f"lando_worker_loops_total{{{labels}}} 0" in body
+    assert f'lando_landing_worker_jobs_total{{result="finished",{labels}}} 3' in body
+    assert f'lando_landing_worker_jobs_total{{result="retried",{labels}}} 1' in body
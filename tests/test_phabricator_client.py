@@ -5,11 +5,20 @@
 Tests for the PhabricatorClient
 """
 
+import threading
+import time
+
 import pytest
 import requests
 import requests_mock
+from flask import current_app
 
-from landoapi.phabricator import PhabricatorAPIException
+from landoapi.phabricator import (
+    CONDUIT_CIRCUIT_THRESHOLD,
+    PhabricatorAPIException,
+    PhabricatorClient,
+    PhabricatorCommunicationException,
+)
 from tests.utils import phab_url
 
 pytestmark = pytest.mark.usefixtures("docker_env_vars")
@@ -86,3 +95,165 @@ def test_phabricator_exception(get_phab_client):
             phab.call_conduit("differential.query", ids=["1"])[0]
         assert e_info.value.error_code == error["error_code"]
         assert e_info.value.error_info == error["error_info"]
+
+
+def test_run_concurrently(get_phab_client):
+    phab = get_phab_client(api_key="api-key")
+    phab.max_concurrency = 2
+
+    lock = threading.Lock()
+    running = []
+    max_running = []
+    barrier = threading.Barrier(2, timeout=5)
+
+    def call(value):
+        with lock:
+            running.append(value)
+            max_running.append(len(running))
+        # Only returns once two calls are running at the same time.
+        barrier.wait()
+        with lock:
+            running.remove(value)
+        return value, current_app.name
+
+    results = phab.run_concurrently(*(lambda v=v: call(v) for v in range(4)))
+
+    assert results == [(v, current_app.name) for v in range(4)]
+    assert max(max_running) == 2, "Calls should run concurrently up to the limit."
+
+
+def test_nested_run_concurrently_limits_requests(app, monkeypatch):
+    phab = PhabricatorClient(
+        app.config["PHABRICATOR_URL"], "api-key", max_concurrency=2
+    )
+
+    lock = threading.Lock()
+    in_flight = []
+    max_in_flight = []
+
+    def post(url, **kwargs):
+        with lock:
+            in_flight.append(url)
+            max_in_flight.append(len(in_flight))
+        time.sleep(0.05)
+        with lock:
+            in_flight.remove(url)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"result": [], "error_code": null}'
+        return response
+
+    monkeypatch.setattr(phab.session, "post", post)
+
+    def search(n):
+        return phab.run_concurrently(
+            *(lambda m=m: phab.call_conduit("user.search", n=n, m=m) for m in range(2))
+        )
+
+    assert (
+        phab.run_concurrently(*(lambda n=n: search(n) for n in range(3)))
+        == [[[], []]] * 3
+    )
+    assert max(max_in_flight) == 2, "Requests should be limited per client."
+
+
+def test_run_concurrently_raises_first_exception(get_phab_client):
+    phab = get_phab_client(api_key="api-key")
+
+    def fail(message):
+        raise ValueError(message)
+
+    with pytest.raises(ValueError, match="first"):
+        phab.run_concurrently(
+            lambda: "ok", lambda: fail("first"), lambda: fail("second")
+        )
+
+
+def test_clients_share_session(get_phab_client):
+    assert get_phab_client().session is get_phab_client(api_key="api-key").session
+
+
+def test_search_retried_on_transient_error(get_phab_client, monkeypatch):
+    monkeypatch.setattr("landoapi.phabricator.CONDUIT_RETRY_DELAY_SECONDS", 0)
+    phab = get_phab_client(api_key="api-key")
+    with requests_mock.mock() as m:
+        m.post(
+            phab_url("user.search"),
+            [
+                {"status_code": 503, "text": "unavailable"},
+                {"exc": requests.ConnectionError},
+                {
+                    "status_code": 200,
+                    "json": {"result": {"data": []}, "error_code": None},
+                },
+            ],
+        )
+        assert phab.call_conduit("user.search") == {"data": []}
+        assert m.call_count == 3
+        assert m.last_request.timeout == (5, 30)
+
+
+def test_edit_not_retried_on_transient_error(get_phab_client):
+    phab = get_phab_client(api_key="api-key")
+    with requests_mock.mock() as m:
+        m.post(phab_url("differential.revision.edit"), status_code=502)
+        with pytest.raises(PhabricatorCommunicationException):
+            phab.call_conduit("differential.revision.edit")
+        assert m.call_count == 1
+
+
+def test_circuit_breaker_fails_fast(get_phab_client, monkeypatch):
+    monkeypatch.setattr("landoapi.phabricator.CONDUIT_RETRIES", 0)
+    phab = get_phab_client(api_key="api-key")
+    with requests_mock.mock() as m:
+        m.post(phab_url("conduit.ping"), exc=requests.Timeout)
+        for _ in range(CONDUIT_CIRCUIT_THRESHOLD):
+            with pytest.raises(PhabricatorCommunicationException):
+                phab.call_conduit("conduit.ping")
+
+        with pytest.raises(PhabricatorCommunicationException, match="unavailable"):
+            phab.call_conduit("conduit.ping")
+        assert m.call_count == CONDUIT_CIRCUIT_THRESHOLD
+
+
+def test_idempotent_calls_memoized(get_phab_client):
+    phab = get_phab_client(api_key="api-key")
+    with requests_mock.mock() as m:
+        m.post(
+            phab_url("user.search"),
+            json={"result": {"data": [{"phid": "PHID-USER-1"}]}, "error_code": None},
+        )
+        m.post(
+            phab_url("differential.revision.edit"),
+            json={"result": {}, "error_code": None},
+        )
+
+        result = phab.call_conduit("user.search", constraints={"phids": ["1"]})
+        result["data"].clear()
+        assert phab.call_conduit("user.search", constraints={"phids": ["1"]}) == {
+            "data": [{"phid": "PHID-USER-1"}]
+        }, "Memoized results should not be modified by callers."
+        assert m.call_count == 1
+
+        phab.call_conduit("user.search", constraints={"phids": ["2"]})
+        assert m.call_count == 2, "Calls with other params should not be memoized."
+
+        phab.call_conduit("differential.revision.edit", objectIdentifier="D1")
+        phab.call_conduit("user.search", constraints={"phids": ["1"]})
+        assert m.call_count == 4, "Other calls should clear memoized results."
+
+
+def test_failed_calls_not_memoized(get_phab_client):
+    phab = get_phab_client(api_key="api-key")
+    with requests_mock.mock() as m:
+        m.post(
+            phab_url("user.search"),
+            [
+                {"json": {"error_code": "ERR-CONDUIT-CORE", "error_info": "BOOM"}},
+                {"json": {"result": {"data": []}, "error_code": None}},
+            ],
+        )
+        with pytest.raises(PhabricatorAPIException):
+            phab.call_conduit("user.search")
+        assert phab.call_conduit("user.search") == {"data": []}
+        assert m.call_count == 2
@@ -4,7 +4,8 @@
 
 import pytest
 
-from landoapi.phabricator import PhabricatorCommunicationException
+from landoapi.cache import cache
+from landoapi.phabricator import PhabricatorClient, PhabricatorCommunicationException
 from landoapi.projects import project_search
 from landoapi.reviews import (
     approvals_for_commit_message,
@@ -138,3 +139,42 @@ def test_approvals_for_commit_message(
     assert (
         release_management_project["name"] not in accepted_reviewers
     ), "`release-managers` project should be filtered from `accepted_reviewers`."
+
+
+def test_user_and_project_search_cached_per_phid(app, phabdouble, monkeypatch):
+    cache.init_app(app, config={"CACHE_TYPE": "SimpleCache"})
+    try:
+        users = [phabdouble.user(username=f"user{i}") for i in range(3)]
+        projects = [phabdouble.project(f"project{i}") for i in range(2)]
+
+        searches = []
+
+        def call_conduit(self, method, **kwargs):
+            searches.append((method, kwargs["constraints"]["phids"]))
+            return phabdouble.call_conduit(method, **kwargs)
+
+        monkeypatch.setattr(PhabricatorClient, "call_conduit", call_conduit)
+        phab = phabdouble.get_phabricator_client()
+
+        phids = [users[0]["phid"], users[1]["phid"], projects[0]["phid"]]
+        assert set(user_search(phab, phids)) == {users[0]["phid"], users[1]["phid"]}
+        assert set(project_search(phab, phids)) == {projects[0]["phid"]}
+        assert len(searches) == 2
+
+        searches.clear()
+        phids = [user["phid"] for user in users] + [p["phid"] for p in projects]
+        assert set(user_search(phab, phids)) == {user["phid"] for user in users}
+        assert set(project_search(phab, phids)) == {p["phid"] for p in projects}
+        assert searches == [
+            ("user.search", [users[2]["phid"]]),
+            ("project.search", [projects[1]["phid"]]),
+        ], "Only uncached users and projects should be searched for."
+
+        searches.clear()
+        user_search(phab, phids)
+        project_search(phab, phids)
+        assert not searches
+    finally:
+        cache.init_app(
+            app, config={"CACHE_TYPE": "null", "CACHE_NO_NULL_WARNING": True}
+        )
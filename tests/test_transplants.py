@@ -7,6 +7,7 @@ from unittest.mock import MagicMock
 
 import pytest
 
+from landoapi.cache import cache
 from landoapi.hg import HgRepo
 from landoapi.mocks.canned_responses.auth0 import CANNED_USERINFO
 from landoapi.models.landing_job import (
@@ -17,9 +18,19 @@ from landoapi.models.landing_job import (
 from landoapi.models.revisions import Revision
 from landoapi.models.transplant import Transplant
 from landoapi.phabricator import (
+    PhabricatorClient,
     PhabricatorRevisionStatus,
     ReviewerStatus,
 )
+from landoapi.projects import (
+    SEC_PROJ_SLUG,
+    TESTING_TAG_PROJ_SLUGS,
+    clear_project_phids,
+    get_project_phid,
+    get_project_phids,
+    get_secure_project_phid,
+    get_testing_tag_project_phids,
+)
 from landoapi.repos import DONTBUILD, SCM_CONDUIT, SCM_LEVEL_3, Repo, get_repos_for_env
 from landoapi.tasks import admin_remove_phab_project
 from landoapi.transplants import (
@@ -1910,3 +1921,46 @@ def test_warning_multiple_authors(phabdouble, mocked_repo_config, create_state):
     assert (
         warning.details == "Revision has multiple authors: alice, bob."
     ), "Multiple authors on a revision should return a warning."
+
+
+def test_get_project_phids_single_search(app, phabdouble, monkeypatch):
+    cache.init_app(app, config={"CACHE_TYPE": "SimpleCache"})
+    try:
+        secure_project = phabdouble.project(SEC_PROJ_SLUG)
+        tags = [phabdouble.project(slug) for slug in TESTING_TAG_PROJ_SLUGS[:2]]
+
+        searches = []
+
+        def call_conduit(self, method, **kwargs):
+            searches.append((method, kwargs))
+            return phabdouble.call_conduit(method, **kwargs)
+
+        monkeypatch.setattr(PhabricatorClient, "call_conduit", call_conduit)
+        phab = phabdouble.get_phabricator_client()
+
+        phids = get_project_phids([SEC_PROJ_SLUG, *TESTING_TAG_PROJ_SLUGS], phab)
+        assert phids[SEC_PROJ_SLUG] == secure_project["phid"]
+        assert [phids[slug] for slug in TESTING_TAG_PROJ_SLUGS] == [
+            tags[0]["phid"],
+            tags[1]["phid"],
+            None,
+            None,
+            None,
+        ]
+        assert len(searches) == 1, "All slugs should be resolved with one search."
+
+        searches.clear()
+        assert get_secure_project_phid(phab) == secure_project["phid"]
+        assert get_testing_tag_project_phids(phab) == [t["phid"] for t in tags]
+        assert get_project_phid(TESTING_TAG_PROJ_SLUGS[2], phab) is None
+        assert not searches, "Projects should be served from the local table."
+
+        # Missing projects are cached too, for other processes.
+        clear_project_phids()
+        assert get_project_phid(TESTING_TAG_PROJ_SLUGS[2], phab) is None
+        assert get_secure_project_phid(phab) == secure_project["phid"]
+        assert not searches, "Projects should be served from the cache."
+    finally:
+        cache.init_app(
+            app, config={"CACHE_TYPE": "null", "CACHE_NO_NULL_WARNING": True}
+        )
@@ -520,6 +520,44 @@ def test_hgrepo_git2hg_conversion(app, db, tmp_path, monkeypatch):
     assert result == "convertedhgsha1234567890"
 
 
+def test_hgrepo_git2hg_conversion_batched_and_cached(app, db, tmp_path, monkeypatch):
+    """Test batched git2hg conversion and the on-disk mapping cache."""
+    repo_path = tmp_path / "repo"
+    repo_path.mkdir()
+    hgrepo = HgRepo(str(repo_path), native_git_source="https://example.com")
+    hgrepo.cinnabar_path.mkdir()
+
+    git_calls = []
+
+    def fake_run_git(args):
+        git_calls.append(args)
+        return "\n".join(
+            "0" * 40 if sha == "unknown" else f"hg-{sha}" for sha in args[2:]
+        )
+
+    monkeypatch.setattr(hgrepo, "run_git", fake_run_git)
+
+    assert hgrepo.git_to_hg_many(["a", "b", "unknown", "a"]) == {
+        "a": "hg-a",
+        "b": "hg-b",
+    }
+    assert git_calls == [["cinnabar", "git2hg", "a", "b", "unknown"]]
+
+    # A new repo object reads known conversions from disk.
+    hgrepo = HgRepo(str(repo_path), native_git_source="https://example.com")
+    monkeypatch.setattr(hgrepo, "run_git", fake_run_git)
+    update_calls = []
+    monkeypatch.setattr(hgrepo, "update_cinnabar_repo", update_calls.append)
+
+    assert hgrepo.convert_git_cset("source", "b") == "hg-b"
+    assert len(git_calls) == 1, "Known SHA should not run `git2hg`."
+    assert not update_calls, "Known SHA should not update the cinnabar repo."
+
+    with pytest.raises(CinnabarConversionError):
+        hgrepo.convert_git_cset("source", "unknown")
+    assert update_calls == ["source"], "Unknown SHA should update the cinnabar repo."
+
+
 def test_hgrepo_git2hg_conversion_failure(app, db, tmp_path):
     repo_path = tmp_path / "repo"
     repo_path.mkdir()
@@ -0,0 +1,384 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+import time
+import unittest.mock as mock
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from landoapi.hg import LostPushRace, TreeClosed
+from landoapi.models.configuration import (
+    ConfigurationKey,
+    ConfigurationVariable,
+    VariableType,
+)
+from landoapi.models.landing_job import (
+    LANDING_JOB_NOTIFY_CHANNEL,
+    LandingJob,
+    LandingJobAction,
+    LandingJobStatus,
+)
+from landoapi.repos import (
+    SCM_LEVEL_3,
+    Repo,
+    RepoCloneSubsystem,
+    repo_clone_subsystem,
+)
+from landoapi.workers.base import NotificationListener, Worker
+from landoapi.workers.landing_worker import (
+    LandingWorker,
+    LeaseHeartbeat,
+    defer_until,
+    job_processing,
+)
+from landoapi.workers.supervisor import WorkerSupervisor, parse_repo_groups
+
+
+def test_defer_until():
+    now = datetime.now(timezone.utc)
+
+    # The delay doubles with each attempt, jittered to between half and all of it.
+    assert now + timedelta(seconds=30) <= defer_until(TreeClosed, 1)
+    assert defer_until(TreeClosed, 1) <= now + timedelta(seconds=61)
+    assert now + timedelta(seconds=60) <= defer_until(TreeClosed, 2)
+
+    # Lost push races are retried sooner, and delays are capped.
+    assert defer_until(LostPushRace, 1) <= now + timedelta(seconds=6)
+    assert defer_until(LostPushRace, 20) <= now + timedelta(seconds=61)
+
+
+def test_parse_repo_groups():
+    assert parse_repo_groups("autoland, try;mozilla-central;") == [
+        ["autoland", "try"],
+        ["mozilla-central"],
+    ]
+    assert parse_repo_groups("") == []
+
+    with pytest.raises(ValueError):
+        parse_repo_groups("autoland,try;try")
+
+
+def test_worker_supervisor_skips_unprepared_groups(monkeypatch):
+    join_preparation = mock.MagicMock()
+    monkeypatch.setattr(repo_clone_subsystem, "join_preparation", join_preparation)
+    monkeypatch.setattr(
+        repo_clone_subsystem, "unprepared_repos", {"try"}, raising=False
+    )
+
+    supervisor = WorkerSupervisor(Worker, [["autoland", "try"], ["mozilla-central"]])
+    spawned = []
+    monkeypatch.setattr(supervisor, "spawn", spawned.append)
+    supervisor.start()
+
+    # All preparation finished before any process was forked.
+    join_preparation.assert_called_once()
+    assert spawned == [1]
+
+
+def test_worker_restricted_to_repositories(monkeypatch):
+    monkeypatch.setattr(
+        repo_clone_subsystem,
+        "repos",
+        {"autoland": None, "try": None, "mozilla-central": None},
+        raising=False,
+    )
+
+    worker = Worker(with_ssh=False)
+    assert set(worker.applicable_repos) == {"autoland", "try", "mozilla-central"}
+
+    worker = Worker(with_ssh=False, repositories=["try", "unknown-repo"])
+    assert worker.applicable_repos == ["try"]
+
+
+def test_worker_applicable_repos_grow_as_repos_are_prepared(monkeypatch):
+    monkeypatch.setattr(
+        repo_clone_subsystem,
+        "repos",
+        {"autoland": None, "try": None},
+        raising=False,
+    )
+    monkeypatch.setattr(repo_clone_subsystem, "unprepared_repos", {"try"})
+
+    worker = Worker(with_ssh=False)
+    assert worker.applicable_repos == ["autoland"]
+
+    repo_clone_subsystem.unprepared_repos.discard("try")
+    worker.refresh_applicable_repos()
+    assert worker.applicable_repos == ["autoland", "try"]
+
+
+def test_landing_worker_polls_while_repos_are_prepared(db, monkeypatch):
+    monkeypatch.setattr(
+        repo_clone_subsystem,
+        "repos",
+        {"autoland": None, "try": None},
+        raising=False,
+    )
+    monkeypatch.setattr(
+        repo_clone_subsystem, "unprepared_repos", {"autoland", "try"}, raising=False
+    )
+    seconds_until_next_eligible = mock.MagicMock(return_value=None)
+    monkeypatch.setattr(
+        LandingJob, "seconds_until_next_eligible", seconds_until_next_eligible
+    )
+
+    worker = LandingWorker(with_ssh=False, sleep_seconds=1)
+    worker.wait_for_work = mock.MagicMock()
+    worker.wait_for_job()
+
+    # Repos finishing preparation are picked up soon, and jobs of any repo are not
+    # considered while none are enabled.
+    worker.wait_for_work.assert_called_once_with(1)
+    seconds_until_next_eligible.assert_not_called()
+
+
+def test_repo_clone_subsystem_prepares_repos_concurrently(
+    tmp_path, monkeypatch, mocked_repo_config
+):
+    subsystem = RepoCloneSubsystem()
+    subsystem.flask_app = mock.MagicMock(
+        config={
+            "ENVIRONMENT": "test",
+            "REPO_CLONES_PATH": str(tmp_path),
+            "REPOS_TO_LAND": "mozilla-central,mozilla-uplift",
+        }
+    )
+
+    started = threading.Barrier(2, timeout=5)
+    failures = {"mozilla-uplift": 1}
+    attempted = set()
+
+    def prepare_repo(name, path):
+        # Both repos must be in preparation at the same time.
+        if name not in attempted:
+            attempted.add(name)
+            started.wait()
+        if failures.get(name):
+            failures[name] -= 1
+            raise Exception("Clone failed.")
+
+    monkeypatch.setattr(subsystem, "_prepare_repo", prepare_repo)
+    monkeypatch.setattr("landoapi.repos.time.sleep", lambda seconds: None)
+
+    # Preparation happens in the background.
+    assert subsystem.ready() is True
+
+    subsystem.join_preparation()
+    assert subsystem.is_prepared("mozilla-central")
+    assert subsystem.repo_paths["mozilla-central"] == tmp_path / "mozilla-central"
+
+    # Failed preparations are retried.
+    assert subsystem.is_prepared("mozilla-uplift")
+
+
+def test_notification_listener_receives_job_notifications(db):
+    listener = NotificationListener(LANDING_JOB_NOTIFY_CHANNEL)
+    try:
+        assert not listener.wait(0.01), "No notification should have been received."
+
+        job = LandingJob(
+            status=LandingJobStatus.SUBMITTED,
+            requester_email="test@example.com",
+            repository_name="test-repo",
+            revision_to_diff_id={},
+            revision_order=[],
+        )
+        db.session.add(job)
+        job.notify_queue()
+        db.session.commit()
+
+        assert listener.wait(5), "Notification should be received after commit."
+        assert not listener.wait(0.01), "Notifications should be consumed."
+
+        job.transition_status(LandingJobAction.CANCEL, commit=True, db=db)
+        assert listener.wait(5), "Status transitions should notify listeners."
+    finally:
+        listener.close()
+
+
+def test_landing_worker_claim_train(db, monkeypatch):
+    monkeypatch.setattr(
+        repo_clone_subsystem,
+        "repos",
+        {
+            "autoland": Repo(
+                tree="autoland", url="http://hg.test", access_group=SCM_LEVEL_3
+            ),
+        },
+        raising=False,
+    )
+
+    created_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    jobs = []
+    for requester_email in (
+        "test@example.com",
+        "test@example.com",
+        "other@example.com",
+        "test@example.com",
+    ):
+        job = LandingJob(
+            status=LandingJobStatus.SUBMITTED,
+            requester_email=requester_email,
+            repository_name="autoland",
+            revision_to_diff_id={},
+            revision_order=[],
+        )
+        db.session.add(job)
+        db.session.commit()
+        job.created_at = created_at
+        created_at += timedelta(seconds=1)
+        jobs.append(job)
+    db.session.commit()
+
+    worker = LandingWorker(with_ssh=False)
+    head = LandingJob.next_job_for_update_query(repositories=["autoland"]).first()
+    assert head == jobs[0]
+
+    # Trains are disabled by default.
+    assert worker.claim_train(head) == [head]
+
+    # The train stops at the first job requested by someone else.
+    ConfigurationVariable.set(
+        ConfigurationKey.LANDING_WORKER_TRAIN_SIZE, VariableType.INT, "10"
+    )
+    assert worker.claim_train(head) == jobs[:2]
+
+    ConfigurationVariable.set(
+        ConfigurationKey.LANDING_WORKER_TRAIN_SIZE, VariableType.INT, "1"
+    )
+    assert worker.claim_train(head) == [head]
+
+
+def test_landing_worker_pull_idle_repos(db, monkeypatch):
+    repos = {
+        name: Repo(tree=name, url="http://hg.test", access_group=SCM_LEVEL_3)
+        for name in ("autoland", "try")
+    }
+    monkeypatch.setattr(repo_clone_subsystem, "repos", repos, raising=False)
+    monkeypatch.setattr(
+        repo_clone_subsystem,
+        "repo_paths",
+        {name: f"/repos/{name}" for name in repos},
+        raising=False,
+    )
+
+    worker = LandingWorker(with_ssh=False)
+    worker.enabled_repos = ["autoland", "try"]
+    hgrepos = {name: mock.MagicMock(cinnabar_path=None) for name in repos}
+    worker.get_hgrepo = lambda path, **kwargs: hgrepos[path.split("/")[-1]]
+
+    assert worker.pull_idle_repos()
+    for hgrepo in hgrepos.values():
+        hgrepo.pull_if_needed.assert_called_once()
+
+    # Repos are not pulled again until the interval has passed.
+    assert not worker.pull_idle_repos()
+
+    # Pulling stops when a job is ready to be processed.
+    worker.last_idle_pulls = {}
+    job = LandingJob(
+        status=LandingJobStatus.SUBMITTED,
+        requester_email="test@example.com",
+        repository_name="autoland",
+        revision_to_diff_id={},
+        revision_order=[],
+    )
+    db.session.add(job)
+    db.session.commit()
+    job.created_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    db.session.commit()
+    assert worker.pull_idle_repos()
+    assert hgrepos["autoland"].pull_if_needed.call_count == 2
+    assert hgrepos["try"].pull_if_needed.call_count == 1
+
+    # The working copy holding the prepared next job is left alone.
+    worker.last_idle_pulls = {}
+    db.session.delete(job)
+    db.session.commit()
+    worker.preparation = mock.MagicMock(hgrepo=mock.MagicMock(path="/repos/autoland"))
+    assert worker.pull_idle_repos()
+    assert hgrepos["autoland"].pull_if_needed.call_count == 2
+    assert hgrepos["try"].pull_if_needed.call_count == 2
+    worker.preparation = None
+
+    # Idle pulls can be disabled.
+    worker.last_idle_pulls = {}
+    ConfigurationVariable.set(
+        ConfigurationKey.LANDING_WORKER_IDLE_PULL_SECONDS, VariableType.INT, "0"
+    )
+    assert not worker.pull_idle_repos()
+
+
+def test_lease_heartbeat_renews_lease(db):
+    job = LandingJob(
+        status=LandingJobStatus.SUBMITTED,
+        requester_email="test@example.com",
+        repository_name="test-repo",
+        revision_to_diff_id={},
+        revision_order=[],
+    )
+    db.session.add(job)
+    db.session.commit()
+    job.claim("worker-1", lease_seconds=1)
+    db.session.commit()
+    claimed_lease = job.lease_expires_at
+
+    heartbeat = LeaseHeartbeat(db.engine, job.id, "worker-1", lease_seconds=0.3)
+    heartbeat.start()
+    try:
+        time.sleep(0.5)
+    finally:
+        heartbeat.stop()
+
+    db.session.refresh(job)
+    assert job.lease_expires_at != claimed_lease
+    assert not heartbeat.is_alive()
+
+
+def test_lease_heartbeat_skips_job_locked_by_session(db, monkeypatch):
+    job = LandingJob(
+        status=LandingJobStatus.SUBMITTED,
+        requester_email="test@example.com",
+        repository_name="test-repo",
+        revision_to_diff_id={},
+        revision_order=[],
+    )
+    db.session.add(job)
+    db.session.commit()
+    job.claim("worker-1", lease_seconds=60)
+    db.session.commit()
+
+    # Flushing a change to the job locks its row until the session commits.
+    job.record_phase_timing("apply", 1)
+    db.session.flush()
+    with db.engine.begin() as connection:
+        assert not LandingJob.renew_leases(connection, [job.id], "worker-1")
+    db.session.commit()
+    with db.engine.begin() as connection:
+        assert LandingJob.renew_leases(connection, [job.id], "worker-1")
+
+    heartbeats = []
+
+    def heartbeat(*args, **kwargs):
+        heartbeats.append(LeaseHeartbeat(*args, **kwargs, lease_seconds=0.3))
+        return heartbeats[0]
+
+    monkeypatch.setattr("landoapi.workers.landing_worker.LeaseHeartbeat", heartbeat)
+    worker = LandingWorker(with_ssh=False)
+    worker.worker_id = "worker-1"
+
+    # A job failing with a flushed change to its row must not leave the worker
+    # waiting on a heartbeat that waits on the row.
+    with pytest.raises(RuntimeError):
+        with job_processing(worker, job, db):
+            job.record_phase_timing("apply", 1)
+            db.session.flush()
+            time.sleep(0.5)
+            raise RuntimeError("Unexpected error.")
+
+    assert not heartbeats[0].is_alive()
+    db.session.refresh(job)
+    assert job.phase_timings["apply"] == 2